@@ -0,0 +1,88 @@
+"""
+Async against threaded greetings
+
+Greets --joins new members against a local fake Bot API taking --latency seconds per call: first by a pool
+of 4 threads making the get member, restrict and question calls of a join, then by AsyncBotUtils coroutines
+on one event loop. Reports greetings per second of both. Usage, from the repository root:
+
+    PYTHONPATH=src:benchmark python benchmark/async_greetings.py [--joins 100] [--latency 0.02]
+"""
+import argparse
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from telebot import TeleBot
+from telebot.types import Message
+
+from async_api import AsyncTelegramApi
+from async_utils import AsyncBotUtils
+from fake_api import FakeBotApi
+from greeting import NewbieStorage, QuestionProvider
+from notification import Notification
+
+CHAT_ID = -100
+TOKEN = '123456789:benchmark'
+
+
+def join_message(user_id: int) -> Message:
+    return Message.de_json({
+        'message_id': user_id,
+        'date': int(time.time()),
+        'chat': {'id': CHAT_ID, 'type': 'supergroup'},
+        'new_chat_members': [{'id': user_id, 'is_bot': False, 'first_name': f'user_{user_id}'}],
+    })
+
+
+def measure(joins: int) -> Dict[str, float]:
+    """Greetings per second against the installed Bot API"""
+    logger = logging.getLogger('benchmark')
+    bot = TeleBot(TOKEN)
+
+    def threaded_greeting(message: Message):
+        new_user = message.new_chat_members[0]
+        bot.get_chat_member(message.chat.id, new_user.id)
+        bot.restrict_chat_member(message.chat.id, new_user.id, until_date=message.date + 240)
+        bot.send_message(message.chat.id, 'question', reply_to_message_id=message.message_id)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(threaded_greeting, [join_message(_) for _ in range(joins)]))
+    threaded = joins / (time.perf_counter() - started)
+
+    storage = NewbieStorage(logger)
+    methods = AsyncBotUtils(AsyncTelegramApi(TOKEN, logger), Notification(), storage, QuestionProvider(), logger)
+
+    async def greet_all():
+        await asyncio.gather(*[methods.greeting_handler(join_message(_)) for _ in range(joins)])
+        for key in list(methods._timers):
+            methods.cancel_scheduled_task(key)
+        await methods._api.close()
+
+    started = time.perf_counter()
+    asyncio.run(greet_all())
+    concurrent = joins / (time.perf_counter() - started)
+    return dict(threaded=round(threaded), concurrent=round(concurrent), greeted=len(storage))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Async against threaded greetings per second')
+    parser.add_argument('--joins', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per Bot API call')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    api = FakeBotApi(latency=args.latency).start()
+    api.install()
+    try:
+        result = measure(args.joins)
+        print(f'greetings/s: threaded (4 workers) {result["threaded"]}, async {result["concurrent"]}')
+    finally:
+        api.uninstall()
+        api.stop()
+
+
+if __name__ == '__main__':
+    main()
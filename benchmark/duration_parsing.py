@@ -0,0 +1,74 @@
+"""
+Duration parsing
+
+Parses --durations restrict durations of the bot commands with the previous recursive parser and with
+BotUtils.get_duration, and reports milliseconds of both. Usage, from the repository root:
+
+    PYTHONPATH=src:benchmark python benchmark/duration_parsing.py [--durations 40000]
+"""
+import argparse
+import time
+from typing import Dict
+
+from const import BaseDuration, RestrictDuration
+from error import ParseBanDurationError
+from utils import BotUtils
+
+TEXTS = ['', '5', '10m', '1h', '3d', '7d', '30s', '2h']
+
+
+def legacy_get_duration(text: str, duration_class: BaseDuration):
+    """Previous recursive parser, kept as baseline"""
+    if text == '':
+        return legacy_get_duration(f'{duration_class.DEFAULT_DURATION}{duration_class.DEFAULT_UNIT}', duration_class)
+    try:
+        return legacy_get_duration(f'{int(text)}{duration_class.DEFAULT_UNIT}', duration_class)
+    except ValueError:
+        pass
+    try:
+        amount = int(text[:-1])
+        unit = duration_class.UNITS[text[-1]]
+        duration_seconds = int(amount * unit['rate'])
+        if duration_seconds < duration_class.MIN_DURATION.seconds:
+            return duration_class.MIN_DURATION
+        if duration_seconds > duration_class.MAX_DURATION.seconds:
+            return duration_class.MAX_DURATION
+        return duration_seconds, f'{amount} {BotUtils.get_plural(amount, unit["plural_forms"])}'
+    except (ValueError, KeyError, IndexError):
+        raise ParseBanDurationError
+
+
+def measure(count: int) -> Dict[str, float]:
+    """Milliseconds to parse durations with the previous and the current parser"""
+    methods = BotUtils.__new__(BotUtils)  # get_duration does not depend on bot state
+    texts = (TEXTS * (count // len(TEXTS) + 1))[:count]
+
+    started = time.perf_counter()
+    legacy = [legacy_get_duration(text, RestrictDuration()) for text in texts]
+    legacy_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    compiled = [methods.get_duration(text, RestrictDuration()) for text in texts]
+    compiled_time = time.perf_counter() - started
+    return dict(
+        durations=len(texts),
+        mismatches=sum(
+            duration.seconds != (expected[0] if isinstance(expected, tuple) else expected.seconds)
+            for duration, expected in zip(compiled, legacy)
+        ),
+        legacy_ms=round(legacy_time * 1000, 2),
+        compiled_ms=round(compiled_time * 1000, 2),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Previous recursive against current duration parser')
+    parser.add_argument('--durations', type=int, default=40000)
+    args = parser.parse_args()
+
+    result = measure(args.durations)
+    print(f'{result["durations"]} durations: legacy {result["legacy_ms"]}ms, compiled {result["compiled_ms"]}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qsl
+
+from telebot import apihelper
+
+GET_UPDATES = 'getUpdates'
+
+
+class FakeApiServer(ThreadingHTTPServer):
+    request_queue_size = 1024
+    daemon_threads = True
+    _thread_ids = itertools.count()
+
+    def process_request(self, request, client_address):
+        """Request threads are named, so benchmarks can tell them from bot threads"""
+        thread = threading.Thread(
+            target=self.process_request_thread,
+            args=(request, client_address),
+            name=f'fake-api-{next(self._thread_ids)}',
+            daemon=True,
+        )
+        thread.start()
+
+
+class FakeBotApi:
+    """
+    Local Telegram Bot API for tests and benchmarks
+
+    getUpdates long-polls updates pushed with push_updates(), sendMessage returns a new message, getChatMember
+    returns a member with member_status, getChatAdministrators returns admin_ids, other methods succeed.
+    Every method but getUpdates waits latency seconds and fails with error_rate share of 400 errors and
+    flood_rate share of 429 errors; errors maps method names to an error code returned on every call.
+    Method names and parameters of calls are kept in requests.
+    Parameters are read from query string, form and JSON bodies, as sent by telebot and AsyncTelegramApi.
+    """
+    calls: List[str]
+    requests: List[Tuple[str, dict]]
+    sent_messages: List[dict]
+    errors: Dict[str, int]
+
+    def __init__(
+            self,
+            latency: float = 0.0,
+            error_rate: float = 0.0,
+            flood_rate: float = 0.0,
+            retry_after: int = 1,
+            admin_ids: tuple = (),
+            member_status: str = 'member',
+            errors: Dict[str, int] = None,
+            poll_wait: float = 0.5,
+            seed: int = None,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.admin_ids = admin_ids
+        self.member_status = member_status
+        self.errors = errors or dict()
+        self.poll_wait = poll_wait
+        self.calls = []
+        self.requests = []
+        self.sent_messages = []
+        self._random = random.Random(seed)
+        self._updates = []
+        self._condition = threading.Condition()
+        self._message_ids = itertools.count(1000000)
+        self._server = FakeApiServer(('127.0.0.1', 0), self._request_handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_address[1]}/bot{{0}}/{{1}}'
+
+    def start(self) -> 'FakeBotApi':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def install(self):
+        """Point telebot at this server"""
+        apihelper.API_URL = self.url
+
+    @staticmethod
+    def uninstall():
+        apihelper.API_URL = None
+
+    def push_updates(self, updates: List[dict]):
+        with self._condition:
+            self._updates.extend(updates)
+            self._condition.notify_all()
+
+    def pending_updates(self) -> int:
+        with self._condition:
+            return len(self._updates)
+
+    def call(self, method_name: str, params: dict) -> tuple:
+        """Returns HTTP status and response object"""
+        self.calls.append(method_name)
+        self.requests.append((method_name, params))
+        if method_name == GET_UPDATES:
+            return 200, dict(ok=True, result=self._get_updates(params))
+
+        if self.latency:
+            time.sleep(self.latency)
+        error_code = self.errors.get(method_name)
+        if error_code is None and self.error_rate and self._random.random() < self.error_rate:
+            error_code = 400
+        if error_code is None and self.flood_rate and self._random.random() < self.flood_rate:
+            error_code = 429
+        if error_code == 429:
+            return 429, dict(ok=False, error_code=429, description=f'Too Many Requests: retry after {self.retry_after}',
+                             parameters=dict(retry_after=self.retry_after))
+        if error_code is not None:
+            return error_code, dict(ok=False, error_code=error_code, description='Bad Request: injected error')
+        return 200, dict(ok=True, result=self._result(method_name, params))
+
+    def _get_updates(self, params: dict) -> list:
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        deadline = time.monotonic() + min(float(params.get('timeout') or 0), self.poll_wait)
+        with self._condition:
+            if offset < 0:  # Last -offset updates, as skip_pending asks for
+                return self._updates[offset:]
+            while True:
+                self._updates = [_ for _ in self._updates if _['update_id'] >= offset]
+                remaining = deadline - time.monotonic()
+                if self._updates or remaining <= 0:
+                    return self._updates[:limit]
+                self._condition.wait(remaining)
+
+    def _result(self, method_name: str, params: dict):
+        if method_name == 'sendMessage':
+            message = dict(
+                message_id=next(self._message_ids),
+                date=int(time.time()),
+                chat=dict(id=int(params['chat_id']), type='supergroup'),
+                text=params.get('text', ''),
+            )
+            self.sent_messages.append(dict(message, reply_to_message_id=int(params.get('reply_to_message_id') or 0)))
+            return message
+        if method_name == 'getChatMember':
+            user_id = int(params['user_id'])
+            status = 'administrator' if user_id in self.admin_ids else self.member_status
+            return dict(user=self._user(user_id), status=status)
+        if method_name == 'getChatAdministrators':
+            return [dict(user=self._user(user_id), status='administrator') for user_id in self.admin_ids]
+        return True
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return dict(id=user_id, is_bot=False, first_name=f'user_{user_id}')
+
+    def _request_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+            wbufsize = -1  # Send headers and body in one segment
+
+            def do_POST(self):
+                path, _, query = self.path.partition('?')
+                params = dict(parse_qsl(query))
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if body:
+                    if self.headers.get('Content-Type', '').startswith('application/json'):
+                        params.update(json.loads(body.decode('utf8')))
+                    else:
+                        params.update(parse_qsl(body.decode('utf8')))
+                status, response = api.call(path.rsplit('/', 1)[-1], params)
+
+                response_body = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response_body)))
+                self.end_headers()
+                self.wfile.write(response_body)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
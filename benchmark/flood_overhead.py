@@ -0,0 +1,93 @@
+"""
+Flood detector overhead
+
+Counts messages of --users active users, one message per user per second in turns with every fifth one a photo,
+and reports microseconds per message of FloodDetector.register() and traced bytes per counted user.
+The whole flood_listener path, Message attributes included, is measured for reference. Usage, from the repository
+root:
+
+    PYTHONPATH=src:benchmark python benchmark/flood_overhead.py [--users 100000] [--messages 1000000]
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from typing import Dict
+
+from telebot.types import Message
+
+from const import FloodSettings
+from flood import FloodDetector
+
+CHAT_ID = -1001424452281
+START = 1600000000
+
+
+def message(user_id: int, second: int, photo: bool) -> Message:
+    content = dict(photo=[dict(file_id='1', file_unique_id='1', width=1, height=1)]) if photo else dict(text='hi')
+    return Message.de_json(dict(
+        message_id=second, date=second, chat=dict(id=CHAT_ID, type='supergroup'),
+        **{'from': dict(id=user_id, is_bot=False, first_name=f'user_{user_id}')}, **content,
+    ))
+
+
+def fill(users: int) -> FloodDetector:
+    detector = FloodDetector(capacity=users)
+    for user_id in range(1, users + 1):
+        detector.register(user_id, False, START)
+    return detector
+
+
+def bytes_per_user(users: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        detector = fill(users)
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    assert len(detector) == users
+    return used / users
+
+
+def measure(users: int, messages: int) -> Dict[str, float]:
+    """Microseconds per message of register() and of the listener checks around it, flooding users are counted"""
+    detector = fill(users)
+    started = time.perf_counter()
+    floods = 0
+    for index in range(messages):
+        if detector.register(index % users + 1, index % 5 == 0, START + index // users) is not None:
+            floods += 1
+    register_us = (time.perf_counter() - started) / messages * 1e6
+
+    sample = [message(user_id, START, user_id % 5 == 0) for user_id in range(1, min(users, 1000) + 1)]
+    detector = fill(users)
+    started = time.perf_counter()
+    for index in range(messages):
+        current = sample[index % len(sample)]
+        if current.content_type in FloodSettings.CONTENT_TYPES:
+            detector.register(
+                current.from_user.id,
+                current.content_type in FloodSettings.MEDIA_CONTENT_TYPES,
+                current.date + index // len(sample),
+            )
+    listener_us = (time.perf_counter() - started) / messages * 1e6
+    return dict(register_us=round(register_us, 2), listener_us=round(listener_us, 2), floods=floods)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Flood detector overhead per message and memory per user')
+    parser.add_argument('--users', type=int, default=FloodSettings.MAX_USERS)
+    parser.add_argument('--messages', type=int, default=1000000)
+    args = parser.parse_args()
+
+    result = measure(args.users, args.messages)
+    print(f'register {result["register_us"]}us, listener {result["listener_us"]}us per message, '
+          f'{result["floods"]} floods')
+    print(f'{args.users} users: {bytes_per_user(args.users):.0f} bytes per user')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Greeting answer and timeout kick races
+
+Seeds a chat with greeted newbies, then feeds an answer of every newbie through the handler pool while the scheduler
+fires its timeout kick at the same moment. Each newbie must be either unrestricted or kicked, never both.
+Reports races handled per second by handler worker count against an in-process Bot API taking --latency seconds
+per call. Usage, from the repository root:
+
+    PYTHONPATH=src:benchmark python benchmark/handler_races.py [--newbies 2000] [--workers 1 --workers 8]
+"""
+import argparse
+import logging
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List
+
+from application import create_app
+from clock import Clock
+from const import ScheduledTaskKey
+from dto import MessageDto, NewbieDto, UserDto
+from replay import StubTransport
+from runner import benchmark_settings, TOKEN, WAIT_INTERVAL
+
+CHAT_ID = -1001424452281
+WORKERS = (1, 2, 4, 8, 16)
+TIMEOUT = 120
+
+
+class RaceTransport(StubTransport):
+    """StubTransport taking latency seconds per call, unrestrictions and kicks are counted by user"""
+
+    def __init__(self, latency: float):
+        super().__init__(Clock())
+        self._latency = latency
+        self.unrestricted = Counter()
+        self.kicked = Counter()
+
+    def make_request(self, token: str, method_name: str, method: str = 'get', params: dict = None, files=None):
+        time.sleep(self._latency)
+        params = params or dict()
+        with self._lock:
+            if method_name == 'restrictChatMember' and str(params.get('can_send_messages')).lower() == 'true':
+                self.unrestricted[int(params['user_id'])] += 1
+            elif method_name == 'kickChatMember':
+                self.kicked[int(params['user_id'])] += 1
+        return super().make_request(token, method_name, method, params, files)
+
+
+def answer(newbie: NewbieDto) -> dict:
+    """Callback query update of a greeting keyboard click"""
+    user = dict(id=newbie.user.id, is_bot=False, first_name=newbie.user.first_name)
+    greeting = dict(message_id=newbie.greeting.message_id, date=newbie.greeting.date,
+                    chat=dict(id=CHAT_ID, type='supergroup'))
+    return dict(update_id=newbie.user.id, callback_query={
+        'id': str(newbie.user.id), 'from': user, 'chat_instance': '1', 'data': '0', 'message': greeting,
+    })
+
+
+def measure(newbies: int, workers: int, latency: float = 0.002) -> Dict[str, float]:
+    """Races per second and users unrestricted and kicked, violations are users handled other than once"""
+    transport = RaceTransport(latency)
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = dict(TELEGRAM_TOKEN=TOKEN, TELEGRAM_CHAT_ID=str(CHAT_ID), HANDLER_WORKERS=str(workers),
+                   STATE_FILE=str(Path(work_dir) / 'state.sqlite3'))
+        with benchmark_settings(env, rate_limits=False):
+            app = create_app(logging.getLogger('handler_races'), components=dict(transport=transport))
+            app.start()
+            try:
+                chat = app.chats[CHAT_ID]
+                question = chat.questions.get_question()
+                now = int(time.time())
+                for user_id in range(1, newbies + 1):
+                    user = UserDto(user_id, f'user_{user_id}')
+                    chat.newbie_storage.add(user, now + TIMEOUT, question)
+                    chat.newbie_storage.update(user, MessageDto(CHAT_ID, newbies + user_id, now))
+                seeded = list(chat.newbie_storage)
+
+                started = time.perf_counter()
+                for newbie in seeded:
+                    app.bot.process_new_updates(app.bot.de_json_updates([answer(newbie)]))
+                    chat.methods.create_scheduled_threat(
+                        pause=0,
+                        action=chat.methods.timeout_kick,
+                        args=(newbie,),
+                        key=chat.methods.task_key(newbie.user.id, ScheduledTaskKey.TIMEOUT_KICK),
+                    )
+                app.bot.drain(TIMEOUT, WAIT_INTERVAL)
+                app.scheduler.wait_idle(TIMEOUT)
+                elapsed = time.perf_counter() - started
+            finally:
+                app.stop()
+
+    handled = [transport.unrestricted[_.user.id] + transport.kicked[_.user.id] for _ in seeded]
+    return dict(
+        races_per_second=round(newbies / elapsed, 1),
+        unrestricted=len(transport.unrestricted),
+        kicked=len(transport.kicked),
+        violations=sum(1 for _ in handled if _ != 1),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Greeting answer and timeout kick races by handler worker count')
+    parser.add_argument('--newbies', type=int, default=2000)
+    parser.add_argument('--workers', type=int, action='append', help=f'handler threads, {WORKERS} by default')
+    parser.add_argument('--latency', type=float, default=0.002, help='seconds per Bot API call')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    worker_counts: List[int] = args.workers or list(WORKERS)
+    for workers in worker_counts:
+        result = measure(args.newbies, workers, args.latency)
+        print(f'{workers:>3} workers: {result["races_per_second"]} races per second, '
+              f'{result["unrestricted"]} unrestricted, {result["kicked"]} kicked, {result["violations"]} violations')
+
+
+if __name__ == '__main__':
+    main()
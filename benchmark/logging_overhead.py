@@ -0,0 +1,140 @@
+"""
+Per-update logging overhead
+
+Replays the log calls of a join and a greeting answer in the calling thread and reports microseconds per update
+at INFO and DEBUG levels for eager f-string records written by a synchronous handler, as the bot logged before,
+and for structured records of the queue pipeline. Writes go to /dev/null, --write-latency simulates a slow stderr.
+Usage, from the repository root:
+
+    PYTHONPATH=src:benchmark python benchmark/logging_overhead.py [--updates 2000] [--write-latency 0.0005]
+"""
+import argparse
+import logging
+import os
+import time
+from typing import Callable, Dict, TextIO
+
+from telebot.types import Message
+
+from const import LoggingSettings
+from logs import configure_logging, log_fields
+
+CHAT_ID = -100
+ERROR_BURST = 1000
+
+
+class SlowStream:
+    """/dev/null writes taking latency seconds each, written records are counted"""
+
+    def __init__(self, stream: TextIO, latency: float):
+        self._stream = stream
+        self._latency = latency
+        self.writes = 0
+
+    def write(self, text: str):
+        self.writes += 1
+        if self._latency:
+            time.sleep(self._latency)
+        return self._stream.write(text)
+
+    def flush(self):
+        self._stream.flush()
+
+
+def join_message(user_id: int) -> Message:
+    user = dict(id=user_id, is_bot=False, first_name=f'user_{user_id}', username=f'user_{user_id}')
+    return Message.de_json(dict(
+        message_id=user_id,
+        date=int(time.time()),
+        chat=dict(id=CHAT_ID, type='supergroup', title='Chat'),
+        new_chat_members=[user],
+        **{'from': user},
+    ))
+
+
+def eager_update(logger: logging.Logger, message: Message):
+    """Log calls of one newbie as they were, f-strings of whole telebot objects"""
+    user = message.new_chat_members[0]
+    logger.info(f'New member joined the group: {user}')
+    logger.debug(f'Trying to add user @{user.username} into newbie list')
+    logger.info(f'Trying to temporary restrict all users content for @{user.username}')
+    logger.debug(f'Trying to update greeting {message} for newbie @{user.username}')
+    logger.debug(f'Trying to edit {message}')
+    logger.debug(f'Trying to remove newbie {user} from list')
+
+
+def lazy_update(logger: logging.Logger, message: Message):
+    """The same log calls with structured fields"""
+    user = message.new_chat_members[0]
+    logger.info('New member joined the group', extra=log_fields(
+        chat_id=message.chat.id, user_id=user.id, username=user.username,
+    ))
+    logger.debug('Trying to add user into newbie list', extra=log_fields(
+        chat_id=message.chat.id, user_id=user.id, username=user.username,
+    ))
+    logger.info('Trying to temporary restrict all user content', extra=log_fields(
+        chat_id=message.chat.id, user_id=user.id, username=user.username,
+    ))
+    logger.debug('Trying to update greeting for newbie', extra=log_fields(
+        chat_id=message.chat.id, user_id=user.id, message_id=message.message_id,
+    ))
+    logger.debug('Trying to remove inline keyboard', extra=log_fields(
+        chat_id=message.chat.id, message_id=message.message_id,
+    ))
+    logger.debug('Trying to remove newbie from list', extra=log_fields(
+        chat_id=message.chat.id, user_id=user.id, username=user.username,
+    ))
+
+
+def measure(updates: int, level: int, pipeline: bool, write_latency: float = 0.0) -> Dict[str, float]:
+    """Microseconds per update in the calling thread and records written of an error burst"""
+    logger = logging.Logger(f'logging_overhead_{pipeline}')
+    messages = [join_message(user_id) for user_id in range(1, updates + 1)]
+    with open(os.devnull, 'w') as devnull:
+        stream = SlowStream(devnull, write_latency)
+        listener = None
+        if pipeline:
+            listener = configure_logging(stream=stream, logger=logger)
+            log_update: Callable = lazy_update
+        else:
+            handler = logging.StreamHandler(stream)
+            handler.setFormatter(logging.Formatter(LoggingSettings.RECORD_FORMAT, LoggingSettings.DATE_FORMAT))
+            logger.addHandler(handler)
+            log_update = eager_update
+        logger.setLevel(level)
+
+        started = time.perf_counter()
+        for message in messages:
+            log_update(logger, message)
+        elapsed = time.perf_counter() - started
+
+        if listener is not None:  # Records of updates are written before the burst
+            listener.stop()
+            listener.start()
+        stream.writes = 0
+        for message_id in range(ERROR_BURST):
+            if pipeline:
+                logger.error('Can not delete chat message', extra=log_fields(chat_id=CHAT_ID, message_id=message_id))
+            else:
+                logger.error(f'Can not delete chat message {message_id}')
+        if listener is not None:
+            listener.stop()
+    return dict(us_per_update=round(elapsed / updates * 1e6, 1), burst_written=stream.writes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-update logging overhead in the calling thread')
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--write-latency', type=float, default=0.0, help='seconds per stream write')
+    args = parser.parse_args()
+
+    for level in logging.INFO, logging.DEBUG:
+        for pipeline in False, True:
+            result = measure(args.updates, level, pipeline, args.write_latency)
+            name = f'{logging.getLevelName(level)} {"queue, fields" if pipeline else "sync, f-strings"}'
+            print(f'{name:>22}: {result["us_per_update"]}us per update, '
+                  f'{result["burst_written"]} of {ERROR_BURST} burst errors written')
+
+
+if __name__ == '__main__':
+    main()
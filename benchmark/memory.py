@@ -0,0 +1,106 @@
+"""
+Memory per tracked user
+
+Fills a NewbieStorage with greeted newbies and a RestrictionStorage with custom restrictions and reports traced
+bytes per user, records and indexes included. The telebot User and greeting Message graphs the storages kept
+before are measured for reference up to --reference-max entries. The 1M run takes minutes, most of them parsing
+greeting messages under tracemalloc. Usage, from the repository root:
+
+    PYTHONPATH=src:benchmark python benchmark/memory.py [--size 1000 --size 100000 --size 1000000]
+"""
+import argparse
+import gc
+import logging
+import time
+import tracemalloc
+from typing import Callable, List
+
+from telebot.types import User, Message
+
+from dto import GreetingQuestionDto, RestrictionDto, RestrictedUserDto
+from greeting import NewbieStorage
+from restriction import RestrictionStorage
+
+CHAT_ID = -1001424452281
+BOT_ID = 1
+SIZES = (1000, 100000, 1000000)
+REFERENCE_MAX = 100000
+QUESTION = GreetingQuestionDto(text='{mention}, are you ok?', keyboard=None, timeout=120, reply={'0': 'Sure!'})
+RESTRICTION = RestrictionDto(messages=False, media=False, other=False, web_preview=False)
+
+
+def user(user_id: int) -> User:
+    return User(id=user_id, is_bot=False, first_name=f'user_{user_id}', username=f'user_{user_id}')
+
+
+def greeting(user_id: int) -> Message:
+    """sendMessage result as telebot parses it, with the join message replied to"""
+    chat = dict(id=CHAT_ID, type='supergroup', title='Chat')
+    joined = dict(id=user_id, is_bot=False, first_name=f'user_{user_id}', username=f'user_{user_id}')
+    return Message.de_json(dict(
+        message_id=user_id * 2 + 1,
+        date=int(time.time()),
+        chat=chat,
+        text=f'user_{user_id}, are you ok?',
+        reply_to_message=dict(message_id=user_id * 2, date=int(time.time()), chat=chat,
+                              new_chat_members=[joined], **{'from': joined}),
+        **{'from': dict(id=BOT_ID, is_bot=True, first_name='bot')},
+    ))
+
+
+def fill_newbies(size: int) -> NewbieStorage:
+    storage = NewbieStorage(logging.getLogger('memory'), chat_id=CHAT_ID, capacity=size)
+    now = int(time.time())
+    for user_id in range(BOT_ID + 1, size + BOT_ID + 1):
+        storage.add(user=user(user_id), timeout=now + QUESTION.timeout, question=QUESTION)
+        storage.update(user=user(user_id), greeting=greeting(user_id))
+    return storage
+
+
+def fill_restrictions(size: int) -> RestrictionStorage:
+    storage = RestrictionStorage(logging.getLogger('memory'), chat_id=CHAT_ID, capacity=size)
+    now = int(time.time())
+    for user_id in range(BOT_ID + 1, size + BOT_ID + 1):
+        storage.add(RestrictedUserDto(user(user_id), CHAT_ID, now + 60, RESTRICTION, now + 3600))
+    return storage
+
+
+def fill_telebot(size: int) -> dict:
+    """User and greeting Message by user id, as newbies were kept before"""
+    return {user_id: (user(user_id), greeting(user_id)) for user_id in range(BOT_ID + 1, size + BOT_ID + 1)}
+
+
+FILLS = dict(newbies=fill_newbies, restrictions=fill_restrictions, telebot=fill_telebot)
+
+
+def bytes_per_user(fill: Callable, size: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        storage = fill(size)
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del storage
+    return used / size
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory per tracked newbie and restriction')
+    parser.add_argument('--size', type=int, action='append', help=f'tracked users, {SIZES} by default')
+    parser.add_argument('--reference-max', type=int, default=REFERENCE_MAX,
+                        help='largest size to measure telebot objects at')
+    args = parser.parse_args()
+
+    sizes: List[int] = args.size or list(SIZES)
+    for name, fill in FILLS.items():
+        for size in sizes:
+            if fill is fill_telebot and size > args.reference_max:
+                continue
+            print(f'{name:>12} {size:>8}: {bytes_per_user(fill, size):.0f} bytes per user')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Metrics recording overhead
+
+Calls a no-op handler wrapped by MetricsRegistry.timed and increments a labeled counter --calls times each,
+and reports microseconds per timed call and per increment. Usage, from the repository root:
+
+    PYTHONPATH=src:benchmark python benchmark/metrics_overhead.py [--calls 100000]
+"""
+import argparse
+import time
+from typing import Dict
+
+from const import MetricsSettings
+from metrics import MetricsRegistry
+
+
+def measure(count: int) -> Dict[str, float]:
+    """Microseconds per timed call and per counter increment, and the recorded totals"""
+    metrics = MetricsRegistry()
+    handler = metrics.timed(MetricsSettings.HANDLER_LATENCY, 'noop')(lambda: None)
+
+    started = time.perf_counter()
+    for _ in range(count):
+        handler()
+    timed = (time.perf_counter() - started) / count
+
+    started = time.perf_counter()
+    for _ in range(count):
+        metrics.inc(MetricsSettings.API_ERRORS, ('sendMessage', '429'))
+    counted = (time.perf_counter() - started) / count
+
+    series = metrics.collect()
+    return dict(
+        observed=series[(MetricsSettings.HANDLER_LATENCY, ('noop',))][-1],
+        counted=series[(MetricsSettings.API_ERRORS, ('sendMessage', '429'))][0],
+        timed_us=round(timed * 1e6, 2),
+        counter_us=round(counted * 1e6, 2),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Metrics recording overhead per call')
+    parser.add_argument('--calls', type=int, default=100000)
+    args = parser.parse_args()
+
+    result = measure(args.calls)
+    print(f'timed call {result["timed_us"]}us, counter increment {result["counter_us"]}us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Greeting question loading
+
+Writes question banks of --size questions, then reports milliseconds to parse and compile each one from yaml
+and to load it from its compiled snapshot, as the bot does on start. Usage, from the repository root:
+
+    PYTHONPATH=src:benchmark python benchmark/question_loading.py [--size 10 --size 1000 --size 50000]
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict
+
+from greeting import QuestionLoader
+
+SIZES = (10, 1000, 50000)
+
+
+def question_bank(size: int) -> str:
+    question = """
+  - name: question_{0}
+    text: '{{mention}}, question {0}?'
+    question_timeout: 60
+    options:
+      - option_text: 'yes'
+        reply_text: 'ok {0}'
+      - option_text: 'no'
+        reply_text: 'not ok {0}'"""
+    return 'questions:' + ''.join(question.format(_) for _ in range(size))
+
+
+def measure(size: int, directory: Path) -> Dict[str, float]:
+    """Milliseconds to compile the yaml file and to load its snapshot"""
+    file_path = directory / f'questions_{size}.yaml'
+    file_path.write_text(question_bank(size), encoding='utf8')
+
+    started = time.perf_counter()
+    QuestionLoader.compile_file(file_path)
+    from_yaml = time.perf_counter() - started
+
+    started = time.perf_counter()
+    questions = QuestionLoader._load_questions_from_file(file_path)
+    from_snapshot = time.perf_counter() - started
+    return dict(
+        questions=len(questions),
+        yaml_ms=round(from_yaml * 1000, 1),
+        snapshot_ms=round(from_snapshot * 1000, 1),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Greeting question loading from yaml and from snapshots')
+    parser.add_argument('--size', type=int, action='append')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.size or SIZES:
+            result = measure(size, Path(directory))
+            print(f'{size} questions: yaml {result["yaml_ms"]}ms, snapshot {result["snapshot_ms"]}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Command routing of ordinary chat text
+
+Runs --messages ordinary chat messages through the previous lambda filter chain of per-handler decorators and
+through CommandRouter, and reports milliseconds of both. Usage, from the repository root:
+
+    PYTHONPATH=src:benchmark python benchmark/routing.py [--messages 20000]
+"""
+import argparse
+import time
+from typing import Dict
+
+from telebot.types import Message
+
+from const import Command, TelegramChatType
+from router import CommandRouter
+
+CHAT_ID = -100
+
+
+def chat_message(text: str) -> Message:
+    return Message.de_json({
+        'message_id': 1,
+        'date': 0,
+        'chat': {'id': CHAT_ID, 'type': TelegramChatType.SUPER_GROUP},
+        'from': {'id': 1, 'is_bot': False, 'first_name': 'user'},
+        'text': text,
+    })
+
+
+def measure(count: int) -> Dict[str, float]:
+    """Milliseconds to pass chat messages through the filter chain and the router"""
+    filters = [
+        lambda m: m.text and m.text[:4].rstrip() in [Command.RO.bot_command, Command.TO.bot_command],
+        lambda m: m.text and m.text.strip() == Command.RW.bot_command,
+        lambda m: m.text and m.text[:5].rstrip() == Command.BAN.bot_command,
+        lambda m: m.text and m.text == Command.PASS.bot_command,
+    ]
+    router = CommandRouter({CHAT_ID})
+    for command in Command.RO, Command.TO, Command.RW, Command.BAN, Command.PASS, Command.PING, Command.ME:
+        router.command(command)(lambda message, command=command: command)
+    messages = [chat_message(f'just some chat text number {_}') for _ in range(count)]
+
+    started = time.perf_counter()
+    for message in messages:
+        for message_filter in filters:
+            if message_filter(message):
+                break
+    chain = time.perf_counter() - started
+
+    started = time.perf_counter()
+    accepted = sum(1 for message in messages if router.accepts(message))
+    routed = time.perf_counter() - started
+    return dict(accepted=accepted, chain_ms=round(chain * 1000, 2), router_ms=round(routed * 1000, 2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Filter chain against command router on ordinary chat text')
+    parser.add_argument('--messages', type=int, default=20000)
+    args = parser.parse_args()
+
+    result = measure(args.messages)
+    print(f'{args.messages} chat messages: filter chain {result["chain_ms"]}ms, router {result["router_ms"]}ms')
+
+
+if __name__ == '__main__':
+    main()
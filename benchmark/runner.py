@@ -0,0 +1,237 @@
+"""
+End-to-end load benchmark
+
+Runs the bot application in polling mode against a local fake Bot API, pushes scenario updates in one burst
+and reports updates per second, handler latency percentiles, peak thread count and peak RSS.
+Every scenario runs in a fresh process. Usage, from the repository root:
+
+    PYTHONPATH=src:benchmark python benchmark/runner.py [--scenario join_flood] [--compare] [--save]
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import yaml
+
+from application import create_app
+from const import OutboundSettings
+from fake_api import FakeBotApi, GET_UPDATES
+from scenarios import SCENARIOS, Scenario, ADMIN_ID
+
+ROOT = Path(__file__).parents[1]
+BASELINE_FILE = Path(__file__).parent / 'baseline.json'
+QUESTIONS_FILE = ROOT / 'resources' / 'questions.yaml'
+TOKEN = '123456789:benchmark'
+UNLIMITED_RATE = 1e6
+RATE_SETTINGS = ('GLOBAL_RATE', 'GLOBAL_BURST', 'CHAT_RATE', 'CHAT_BURST')
+WAIT_INTERVAL = 0.005
+MAX_THROUGHPUT_DROP = 0.25  # Share of baseline updates per second
+MAX_P99_GROWTH = 0.5  # Share of baseline p99 latency
+
+
+class HandlerRecorder:
+    """Handler completion times by update id"""
+    finished: Dict[int, float]
+
+    def __init__(self):
+        self.finished = dict()
+
+    def wrap(self, function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(update_object, *args, **kwargs):
+            try:
+                return function(update_object, *args, **kwargs)
+            finally:
+                self.finished[update_object.update_id] = time.perf_counter()
+
+        return wrapper
+
+    def install(self, bot):
+        for handlers in bot.message_handlers, bot.callback_query_handlers:
+            for handler in handlers:
+                handler['function'] = self.wrap(handler['function'])
+        bot.chat_member_handlers = [self.wrap(_) for _ in bot.chat_member_handlers]
+
+
+class ThreadSampler:
+    """Peak count of threads other than the fake API ones"""
+
+    def __init__(self, interval: float = WAIT_INTERVAL):
+        self.peak = 0
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name='thread-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._stopped.wait(self._interval):
+            count = sum(1 for _ in threading.enumerate() if not _.name.startswith('fake-api'))
+            self.peak = max(self.peak, count - 1)  # Sampler thread excluded
+
+
+def wait_for(condition: Callable[[], bool], timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(WAIT_INTERVAL)
+    return True
+
+
+def percentile(values: List[float], share: float) -> float:
+    return values[min(int(len(values) * share), len(values) - 1)] if values else 0.0
+
+
+@contextmanager
+def benchmark_settings(env: Dict[str, str], rate_limits: bool):
+    """Application env vars and, unless rate_limits, outbound token buckets without limits"""
+    saved_env = {name: os.environ.get(name) for name in env}
+    saved_rates = {name: getattr(OutboundSettings, name) for name in RATE_SETTINGS}
+    os.environ.update(env)
+    if not rate_limits:  # Token buckets would measure Telegram limits instead of the bot
+        for name in RATE_SETTINGS:
+            setattr(OutboundSettings, name, UNLIMITED_RATE)
+    try:
+        yield
+    finally:
+        for name, value in saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        for name, value in saved_rates.items():
+            setattr(OutboundSettings, name, value)
+
+
+def run_scenario(scenario: Scenario, api: FakeBotApi, work_dir: Path, timeout: float = 120,
+                 rate_limits: bool = False) -> dict:
+    """Run the application against started api, scenario updates are pushed once the bot polls"""
+    chats_file = work_dir / 'chats.yaml'
+    chats_file.write_text(yaml.safe_dump(dict(chats=[
+        dict(chat_id=chat_id, questions_file=str(QUESTIONS_FILE)) for chat_id in scenario.chat_ids
+    ])), encoding='utf8')
+    env = dict(TELEGRAM_TOKEN=TOKEN, CHATS_FILE=str(chats_file), STATE_FILE=str(work_dir / 'state.sqlite3'))
+    with benchmark_settings(env, rate_limits):
+        api.install()
+        app = create_app(logging.getLogger('benchmark'))
+        recorder = HandlerRecorder()
+        recorder.install(app.bot)
+        sampler = ThreadSampler()
+        sampler.start()
+        thread = threading.Thread(target=app.run, name='app')
+        thread.start()
+        try:
+            # Pending updates are skipped by the first getUpdates, scenario updates are pushed after it
+            if not wait_for(lambda: api.calls.count(GET_UPDATES) >= 2, timeout):
+                raise TimeoutError('Bot did not start polling')
+
+            warm_up = scenario.warm_up()
+            api.push_updates(warm_up)
+            wait_for(lambda: len(recorder.finished) >= len(warm_up), timeout)
+            recorder.finished.clear()
+
+            updates = scenario.updates(api)
+            expected = [update['update_id'] for update, handled in updates if handled]
+            pushed_at = time.perf_counter()
+            api.push_updates([update for update, _ in updates])
+            wait_for(lambda: len(recorder.finished) >= len(expected), timeout)
+            finished = dict(recorder.finished)
+        finally:
+            app.bot.drain(timeout, WAIT_INTERVAL)
+            thread.join()
+            sampler.stop()
+            api.uninstall()
+
+    latencies = sorted(finished[_] - pushed_at for _ in expected if _ in finished)
+    elapsed = max(latencies) if latencies else timeout
+    return dict(
+        updates=len(updates),
+        handled=len(latencies),
+        expected=len(expected),
+        updates_per_second=round(len(updates) / elapsed, 1) if len(latencies) == len(expected) else 0.0,
+        p50_ms=round(percentile(latencies, 0.5) * 1000, 1),
+        p99_ms=round(percentile(latencies, 0.99) * 1000, 1),
+        peak_threads=sampler.peak,
+        peak_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    )
+
+
+def run_isolated(name: str, count: int, api_options: dict, rate_limits: bool) -> dict:
+    """Process pool task, one scenario per process"""
+    logging.basicConfig(level=logging.CRITICAL)  # Injected API errors would flood the report
+    api = FakeBotApi(admin_ids=(ADMIN_ID,), seed=0, **api_options).start()
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            return run_scenario(SCENARIOS[name](count), api, Path(work_dir), rate_limits=rate_limits)
+    finally:
+        api.stop()
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict]) -> List[str]:
+    """Regressions against baseline results"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['updates_per_second'] < base['updates_per_second'] * (1 - MAX_THROUGHPUT_DROP):
+            regressions.append(f'{name}: {result["updates_per_second"]} updates/s, '
+                               f'baseline {base["updates_per_second"]}')
+        if result['p99_ms'] > base['p99_ms'] * (1 + MAX_P99_GROWTH):
+            regressions.append(f'{name}: p99 {result["p99_ms"]}ms, baseline {base["p99_ms"]}ms')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end load benchmark against a local fake Bot API')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), action='append', help='all scenarios by default')
+    parser.add_argument('--count', type=int, default=1000, help='measured updates per scenario')
+    parser.add_argument('--latency', type=float, default=0.005, help='fake API latency, seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of API calls failing with 400')
+    parser.add_argument('--flood-rate', type=float, default=0.0, help='share of API calls failing with 429')
+    parser.add_argument('--rate-limits', action='store_true', help='keep outbound token buckets')
+    parser.add_argument('--compare', action='store_true', help='exit with 1 on regressions against the baseline')
+    parser.add_argument('--save', action='store_true', help=f'store results as the baseline in {BASELINE_FILE.name}')
+    args = parser.parse_args()
+
+    api_options = dict(latency=args.latency, error_rate=args.error_rate, flood_rate=args.flood_rate)
+    results = dict()
+    for name in args.scenario or list(SCENARIOS):
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results[name] = executor.submit(run_isolated, name, args.count, api_options, args.rate_limits).result()
+        print(f'{name:>16}: ' + ', '.join(f'{key} {value}' for key, value in results[name].items()))
+
+    if args.save:
+        BASELINE_FILE.write_text(json.dumps(dict(
+            environment=dict(python=platform.python_version(), cpus=os.cpu_count(), count=args.count, **api_options),
+            results=results,
+        ), indent=2) + '\n', encoding='utf8')
+    if args.compare:
+        regressions = compare(results, json.loads(BASELINE_FILE.read_text(encoding='utf8'))['results'])
+        for regression in regressions:
+            print(f'Regression: {regression}')
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import abc
+import itertools
+import random
+import time
+from typing import Dict, List, Tuple
+
+from fake_api import FakeBotApi
+
+ADMIN_ID = 1
+FIRST_USER_ID = 1000
+FIRST_CHAT_ID = -1001000000000
+MAX_GREETED_JOINS = 10  # Joins per chat below RaidSettings.JOIN_THRESHOLD, so newbies get questions
+
+ScenarioUpdate = Tuple[dict, bool]  # update and whether a handler is expected to take it
+
+
+class Scenario(abc.ABC):
+    """
+    Update generator of one load pattern
+
+    warm_up() updates are handled before measuring, e.g. joins of users who answer questions later.
+    updates() are measured, each is paired with whether a handler takes it: plain chat text is dropped
+    by handler filters and has no handler latency.
+    """
+    name = ''
+
+    def __init__(self, count: int, chats: int = 1, seed: int = 0):
+        self.count = count
+        self.chat_ids = [FIRST_CHAT_ID - index for index in range(chats)]
+        self._random = random.Random(seed)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._user_ids = itertools.count(FIRST_USER_ID)
+
+    def warm_up(self) -> List[dict]:
+        return []
+
+    @abc.abstractmethod
+    def updates(self, api: FakeBotApi) -> List[ScenarioUpdate]:
+        pass
+
+    def _update(self, **update) -> dict:
+        return dict(update, update_id=next(self._update_ids))
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return dict(id=user_id, is_bot=False, first_name=f'user_{user_id}', username=f'user_{user_id}')
+
+    def _message(self, chat_id: int, user_id: int, **fields) -> dict:
+        return dict(
+            message_id=next(self._message_ids),
+            date=int(time.time()),
+            chat=dict(id=chat_id, type='supergroup'),
+            **{'from': self._user(user_id)},
+            **fields,
+        )
+
+    def join(self, chat_id: int, user_ids: List[int]) -> dict:
+        return self._update(message=self._message(
+            chat_id, user_ids[0], new_chat_members=[self._user(_) for _ in user_ids],
+        ))
+
+    def text(self, chat_id: int, user_id: int, text: str, reply_to: dict = None) -> dict:
+        fields = dict(text=text)
+        if reply_to is not None:
+            fields['reply_to_message'] = reply_to
+        return self._update(message=self._message(chat_id, user_id, **fields))
+
+    def callback(self, chat_id: int, user_id: int, message_id: int, data: str = '0') -> dict:
+        message = dict(message_id=message_id, date=int(time.time()), chat=dict(id=chat_id, type='supergroup'))
+        return self._update(callback_query={
+            'id': str(next(self._message_ids)),
+            'from': self._user(user_id),
+            'chat_instance': str(chat_id),
+            'data': data,
+            'message': message,
+        })
+
+
+class JoinFlood(Scenario):
+    """Users join one chat one by one, raid mode turns on after the first RaidSettings.JOIN_THRESHOLD joins"""
+    name = 'join_flood'
+
+    def updates(self, api: FakeBotApi) -> List[ScenarioUpdate]:
+        chat_id = self.chat_ids[0]
+        return [(self.join(chat_id, [next(self._user_ids)]), True) for _ in range(self.count)]
+
+
+class CommandStorm(Scenario):
+    """Admins restrict and ping, members spam commands they are not allowed to use"""
+    name = 'command_storm'
+
+    def updates(self, api: FakeBotApi) -> List[ScenarioUpdate]:
+        result = []
+        for _ in range(self.count):
+            chat_id = self._random.choice(self.chat_ids)
+            user_id = FIRST_USER_ID + self._random.randrange(self.count)
+            if self._random.random() < 0.3:
+                target = self._message(chat_id, user_id, text='spam')
+                result.append((self.text(chat_id, ADMIN_ID, self._random.choice(['!ro 10m', '!to 1h']), target), True))
+            elif self._random.random() < 0.5:
+                result.append((self.text(chat_id, ADMIN_ID, '/ping'), True))
+            else:
+                result.append((self.text(chat_id, user_id, self._random.choice(['/ping', '/id', '/me hi'])), True))
+        return result
+
+
+class CallbackStorm(Scenario):
+    """Newbies click answers of their questions several times, only the first click is accepted"""
+    name = 'callback_storm'
+    clicks = 5
+
+    def __init__(self, count: int, chats: int = 1, seed: int = 0):
+        newbies = max(count // self.clicks, 1)
+        chats = max(chats, -(-newbies // MAX_GREETED_JOINS))
+        super().__init__(count, chats, seed)
+        self._newbies: Dict[int, List[Tuple[int, int]]] = {chat_id: [] for chat_id in self.chat_ids}
+        for index in range(newbies):
+            self._newbies[self.chat_ids[index % len(self.chat_ids)]].append((next(self._user_ids), 0))
+
+    def warm_up(self) -> List[dict]:
+        result = []
+        for chat_id, newbies in self._newbies.items():
+            for index, (user_id, _) in enumerate(newbies):
+                join = self.join(chat_id, [user_id])
+                newbies[index] = (user_id, join['message']['message_id'])
+                result.append(join)
+        return result
+
+    def updates(self, api: FakeBotApi) -> List[ScenarioUpdate]:
+        greetings = {_['reply_to_message_id']: _['message_id'] for _ in api.sent_messages}
+        clicks = [
+            (chat_id, user_id, greetings.get(join_message_id, 0))
+            for chat_id, newbies in self._newbies.items()
+            for user_id, join_message_id in newbies
+        ] * self.clicks
+        self._random.shuffle(clicks)
+        return [
+            (self.callback(chat_id, user_id, message_id, self._random.choice(['0', '1'])), True)
+            for chat_id, user_id, message_id in clicks[:self.count]
+        ]
+
+
+class MixedTraffic(Scenario):
+    """Chat text in several chats with occasional joins, commands and clicks"""
+    name = 'mixed'
+
+    def __init__(self, count: int, chats: int = 10, seed: int = 0):
+        super().__init__(count, chats, seed)
+
+    def updates(self, api: FakeBotApi) -> List[ScenarioUpdate]:
+        result = []
+        joins = dict.fromkeys(self.chat_ids, 0)
+        for _ in range(self.count):
+            chat_id = self._random.choice(self.chat_ids)
+            user_id = FIRST_USER_ID + self._random.randrange(self.count)
+            kind = self._random.random()
+            if kind < 0.05 and joins[chat_id] < MAX_GREETED_JOINS:
+                joins[chat_id] += 1
+                result.append((self.join(chat_id, [next(self._user_ids)]), True))
+            elif kind < 0.1:
+                result.append((self.callback(chat_id, user_id, next(self._message_ids)), True))
+            elif kind < 0.15:
+                target = self._message(chat_id, user_id, text='spam')
+                result.append((self.text(chat_id, ADMIN_ID, '!ro 10m', target), True))
+            elif kind < 0.2:
+                result.append((self.text(chat_id, user_id, '/me hi'), True))
+            else:
+                result.append((self.text(chat_id, user_id, 'hello'), False))
+        return result
+
+
+SCENARIOS = {_.name: _ for _ in (JoinFlood, CommandStorm, CallbackStorm, MixedTraffic)}
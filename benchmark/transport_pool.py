@@ -0,0 +1,85 @@
+"""
+Keep-alive pool against a connection per request
+
+Sends --burst restrict calls to a local fake Bot API, 20 concurrent ones at a time from short-lived threads as timers
+and handlers do, first through the default telebot transport and then through the ApiTransport keep-alive pool.
+Reports p50 and p99 call latency of both and connections the pool opened. Usage, from the repository root:
+
+    PYTHONPATH=src:benchmark python benchmark/transport_pool.py [--burst 200] [--latency 0]
+"""
+import argparse
+import logging
+import threading
+import time
+from typing import Dict, List
+
+from telebot import TeleBot
+
+from fake_api import FakeBotApi
+from transport import ApiTransport
+
+TOKEN = '123456789:benchmark'
+CONCURRENCY = 20
+
+
+def restrict_burst(bot: TeleBot, burst: int) -> List[float]:
+    """Every call from its own short-lived thread, sorted latencies"""
+    latency = []
+
+    def restrict(user_id: int):
+        started = time.perf_counter()
+        bot.restrict_chat_member(-100, user_id, until_date=0, can_send_messages=False)
+        latency.append(time.perf_counter() - started)
+
+    for chunk in range(0, burst, CONCURRENCY):
+        threads = [threading.Thread(target=restrict, args=(_,)) for _ in range(chunk, min(chunk + CONCURRENCY, burst))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return sorted(latency)
+
+
+def measure(burst: int) -> Dict[str, float]:
+    """Latency in milliseconds against the installed Bot API and pool stats"""
+    bot = TeleBot(TOKEN)
+    default = restrict_burst(bot, burst)
+
+    transport = ApiTransport(logging.getLogger('benchmark'), pool_size=CONCURRENCY)
+    transport.install()
+    try:
+        pooled = restrict_burst(bot, burst)
+    finally:
+        transport.uninstall()
+    stats = transport.stats()
+    return dict(
+        default_p50_ms=round(default[len(default) // 2] * 1000, 2),
+        default_p99_ms=round(default[int(len(default) * 0.99)] * 1000, 2),
+        pooled_p50_ms=round(pooled[len(pooled) // 2] * 1000, 2),
+        pooled_p99_ms=round(pooled[int(len(pooled) * 0.99)] * 1000, 2),
+        requests=stats['requests'],
+        connections=stats['connections'],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Restrict burst latency with and without the keep-alive pool')
+    parser.add_argument('--burst', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per Bot API call')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    api = FakeBotApi(latency=args.latency).start()
+    api.install()
+    try:
+        result = measure(args.burst)
+        print(f'restrict burst p50/p99: default {result["default_p50_ms"]}/{result["default_p99_ms"]}ms, '
+              f'pooled {result["pooled_p50_ms"]}/{result["pooled_p99_ms"]}ms, '
+              f'{result["connections"]} connections for {result["requests"]} requests')
+    finally:
+        api.uninstall()
+        api.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Webhook against long polling ingestion
+
+Posts --updates text messages to the embedded webhook server from 8 client threads, then feeds the same number
+through long polling of a local fake Bot API, and reports updates per second and p99 latency from send to handler
+for both. Usage, from the repository root:
+
+    PYTHONPATH=src:benchmark python benchmark/webhook_latency.py [--updates 500]
+"""
+import argparse
+import json
+import logging
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from bot import RudeBot
+from const import WebhookSettings
+from fake_api import FakeBotApi
+from webhook import WebhookServer
+
+SECRET = 'secret'
+TOKEN = '123456789:benchmark'
+TIMEOUT = 30
+
+
+def make_update(update_id: int) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': -100, 'type': 'supergroup'},
+            'from': {'id': update_id, 'is_bot': False, 'first_name': 'user'},
+            'text': 'hello',
+        },
+    }
+
+
+def post(port: int, body, secret: str = SECRET) -> int:
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{port}/',
+        data=json.dumps(body).encode(),
+        headers={WebhookSettings.SECRET_TOKEN_HEADER: secret, 'Content-Type': 'application/json'},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+class LatencyRecorder:
+    """Handler of the bot recording latency from send time by message id"""
+
+    def __init__(self, bot: RudeBot, count: int):
+        self.sent_at = dict()
+        self.latency = []
+        self.done = threading.Event()
+
+        @bot.message_handler(func=lambda m: True)
+        def handler(message):
+            time.sleep(0.001)
+            self.latency.append(time.perf_counter() - self.sent_at[message.message_id])
+            if len(self.latency) == count:
+                self.done.set()
+
+    def report(self, started: float) -> Dict[str, float]:
+        elapsed = time.perf_counter() - started
+        self.latency.sort()
+        return dict(
+            handled=len(self.latency),
+            updates_per_second=round(len(self.latency) / elapsed),
+            p99_ms=round(self.latency[int(len(self.latency) * 0.99)] * 1000, 1),
+        )
+
+
+def measure_webhook(updates: int) -> Dict[str, float]:
+    bot = RudeBot(TOKEN, num_threads=4)
+    recorder = LatencyRecorder(bot, updates)
+    server = WebhookServer(bot, SECRET, logging.getLogger('benchmark'), host='127.0.0.1', port=0)
+    server.start()
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for update_id in range(updates):
+                recorder.sent_at[update_id] = time.perf_counter()
+                executor.submit(post, server.port, make_update(update_id))
+        recorder.done.wait(TIMEOUT)
+        return recorder.report(started)
+    finally:
+        server.drain()
+
+
+def measure_polling(api: FakeBotApi, updates: int) -> Dict[str, float]:
+    """Updates are pushed to installed api"""
+    bot = RudeBot(TOKEN, num_threads=4)
+    recorder = LatencyRecorder(bot, updates)
+    polling = threading.Thread(target=bot.polling, kwargs=dict(none_stop=True, timeout=1), daemon=True)
+
+    started = time.perf_counter()
+    for update_id in range(updates):
+        recorder.sent_at[update_id + 1] = time.perf_counter()
+    api.push_updates([make_update(update_id + 1) for update_id in range(updates)])
+    polling.start()
+    recorder.done.wait(TIMEOUT)
+    result = recorder.report(started)
+    bot.stop_bot()
+    polling.join(5)  # The pending getUpdates returns before the fake API is shut down
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Webhook against long polling updates per second and latency')
+    parser.add_argument('--updates', type=int, default=500)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    api = FakeBotApi().start()
+    api.install()
+    try:
+        for mode, result in ('webhook', measure_webhook(args.updates)), ('polling', measure_polling(api, args.updates)):
+            print(f'{mode}: {result["updates_per_second"]} updates/s, p99 handler latency {result["p99_ms"]}ms')
+    finally:
+        api.uninstall()
+        api.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import logging
+from typing import Dict, FrozenSet, Tuple
+
+from telebot import TeleBot
+from telebot.apihelper import ApiException
+
+from clock import Clock
+from const import AdminCacheSettings, ScheduledTaskKey, TelegramMemberStatus
+from dispatcher import OutboundDispatcher
+from dto import ChatMemberUpdateDto
+from logs import log_fields
+from scheduler import TaskScheduler
+
+
+class AdminCache:
+    """
+    Chat administrators cache
+
+    Admin ids are kept as frozenset per chat and refreshed in background before TTL expires,
+    so admin checks of moderation commands do not call getChatAdministrators in the common case.
+    Promote/demote chat_member updates invalidate the chat immediately. A failed background refresh is retried
+    with exponential backoff, honoring retry_after of 429 errors.
+    """
+    _entries: Dict[int, Tuple[FrozenSet[int], float]]
+
+    def __init__(
+            self,
+            bot: TeleBot,
+            scheduler: TaskScheduler,
+            logger: logging.Logger,
+            ttl: int = AdminCacheSettings.DEFAULT_TTL,
+            clock: Clock = None,
+    ):
+        self._bot = bot
+        self._scheduler = scheduler
+        self._logger = logger
+        self._ttl = ttl
+        self._clock = clock or Clock()
+        self._entries = dict()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    def get(self, chat_id: int) -> FrozenSet[int]:
+        entry = self._entries.get(chat_id)
+        if entry is not None and entry[1] > self._clock.monotonic():
+            self._hits += 1
+            return entry[0]
+
+        self._misses += 1
+        return self.refresh(chat_id)
+
+    def is_admin(self, chat_id: int, user_id: int) -> bool:
+        return user_id in self.get(chat_id)
+
+    def refresh(self, chat_id: int) -> FrozenSet[int]:
+        admins = frozenset(_.user.id for _ in self._bot.get_chat_administrators(chat_id))
+        self._entries[chat_id] = (admins, self._clock.monotonic() + self._ttl)
+        self._schedule_refresh(chat_id, self._ttl * AdminCacheSettings.REFRESH_RATIO)
+        self._logger.debug('Admin list refreshed', extra=log_fields(chat_id=chat_id, admins=len(admins)))
+        return admins
+
+    def warm(self, chat_id: int, attempt: int = 0):
+        try:
+            self.refresh(chat_id)
+        except ApiException as e:
+            pause = min(AdminCacheSettings.RETRY_MIN_PAUSE * 2 ** attempt, AdminCacheSettings.RETRY_MAX_PAUSE)
+            pause = max(pause, OutboundDispatcher.get_retry_after(e) or 0)
+            self._logger.error('Can not warm admin list', extra=log_fields(
+                chat_id=chat_id, attempt=attempt, retry_in=pause,
+            ))
+            self._schedule_refresh(chat_id, pause, attempt + 1)
+
+    def invalidate(self, chat_id: int):
+        self._entries.pop(chat_id, None)
+
+    def process_member_update(self, update: ChatMemberUpdateDto):
+        was_admin = update.old_member.status in TelegramMemberStatus.ADMINS
+        is_admin = update.new_member.status in TelegramMemberStatus.ADMINS
+        if was_admin == is_admin:
+            return
+
+        self._logger.info('Admin list changed', extra=log_fields(chat_id=update.chat_id, user_id=update.user_id))
+        self.invalidate(update.chat_id)
+        self._schedule_refresh(update.chat_id, 0)
+
+    def _schedule_refresh(self, chat_id: int, pause: float, attempt: int = 0):
+        self._scheduler.schedule(
+            pause=pause,
+            action=self.warm,
+            args=(chat_id, attempt),
+            key=(chat_id, ScheduledTaskKey.ADMIN_REFRESH),
+        )
@@ -0,0 +1,827 @@
+import logging
+import signal
+import threading
+from concurrent.futures import Future
+from functools import partial
+from multiprocessing import Queue
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from telebot.apihelper import ApiException
+from telebot.types import Message, CallbackQuery, User
+
+from admin_cache import AdminCache
+from async_api import AsyncTelegramApi
+from async_runtime import AsyncBotRuntime
+from async_utils import AsyncBotUtils
+from bot import RudeBot
+from capture import UpdateRecorder
+from clock import Clock
+from const import EnvVar, TelegramParseMode, Command, MessageSettings, TelegramMemberStatus, \
+    ScheduledTaskKey, AdminCacheSettings, PersistenceSettings, RunMode, WebhookSettings, \
+    OutboundSettings, SchedulerSettings, WorkerSettings, MetricsSettings, TracingSettings, HandlerSettings, \
+    FloodSettings, OutboundPriority
+from dispatcher import OutboundDispatcher
+from dto import ChatMemberUpdateDto, ChatConfigDto, GreetingQuestionDto
+from env_loader import EnvLoader
+from error import ParseBanDurationError, UserAlreadyInStorageError, UserStorageUpdateError, \
+    InvalidCommandError, InvalidConditionError, UserNotFoundInStorageError, UnauthorizedCommandError, StorageFullError
+from greeting import QuestionProvider, QuestionWatcher
+from logs import log_fields
+from member_cache import MemberCache
+from metrics import MetricsRegistry, MetricsServer
+from persistence import StateJournal
+from router import CommandRouter
+from scheduler import TaskScheduler
+from startup import StartupProfiler
+from tenancy import ChatConfigLoader, ChatContext
+from tracing import Tracer
+from transport import ApiTransport
+from webhook import WebhookServer
+from workers import WorkerSupervisor
+
+
+class Application:
+    """
+    Bot application
+
+    Components are constructed on first access, so tools and tests can build only the parts they need.
+    Prebuilt components replace the default ones, e.g. the virtual clock and stub transport of replays.
+    start() brings background workers up in dependency order, stop() shuts them down in reverse.
+    """
+    _components: Dict[str, object]
+
+    def __init__(
+            self,
+            env_loader: EnvLoader,
+            logger: logging.Logger,
+            version: str = '',
+            profiler: StartupProfiler = None,
+            chat_filter: Callable[[int], bool] = None,
+            components: Dict[str, object] = None,
+    ):
+        self._env_loader = env_loader
+        self._logger = logger
+        self._version = version
+        self._chat_filter = chat_filter  # Chats of the worker process partition
+        self._profile = profiler is not None
+        self._profiler = profiler or StartupProfiler()
+        self._components = dict(components or {})
+        self._lock = threading.RLock()
+        self._metrics_server = None
+
+    def _get_component(self, name: str, factory: Callable):
+        component = self._components.get(name)
+        if component is None:
+            with self._lock:
+                component = self._components.get(name)
+                if component is None:
+                    with self._profiler.component(name):
+                        component = factory()
+                    self._components[name] = component
+        return component
+
+    @property
+    def bot(self) -> RudeBot:
+        def create():
+            bot = RudeBot(
+                token=self._env_loader.get_required(EnvVar.TELEGRAM_TOKEN, sensitive=True),
+                skip_pending=True,
+                num_threads=int(self._env_loader.get(EnvVar.HANDLER_WORKERS, str(HandlerSettings.WORKER_COUNT))),
+            )
+            bot.dispatcher = self.dispatcher
+            capture_file = self._env_loader.get(EnvVar.CAPTURE_FILE)
+            if capture_file:
+                bot.recorder = UpdateRecorder(Path(capture_file), self.clock)
+            return bot
+
+        return self._get_component('bot', create)
+
+    @property
+    def dispatcher(self) -> OutboundDispatcher:
+        return self._get_component('dispatcher', lambda: OutboundDispatcher(self._logger))
+
+    @property
+    def clock(self) -> Clock:
+        return self._get_component('clock', Clock)
+
+    @property
+    def transport(self) -> ApiTransport:
+        return self._get_component('transport', lambda: ApiTransport(
+            self._logger,
+            # Handler workers, outbound dispatcher workers, scheduled task workers and polling thread
+            pool_size=(self.bot.worker_pool.num_threads + OutboundSettings.WORKER_COUNT
+                       + SchedulerSettings.WORKER_COUNT + 1),
+            metrics=self.metrics,
+        ))
+
+    @property
+    def journal(self) -> StateJournal:
+        return self._get_component('journal', lambda: StateJournal(
+            Path(self._env_loader.get(EnvVar.STATE_FILE, PersistenceSettings.DEFAULT_STATE_FILE)),
+            self._logger,
+        ))
+
+    @property
+    def scheduler(self) -> TaskScheduler:
+        return self._get_component('scheduler', lambda: TaskScheduler(self._logger, metrics=self.metrics, clock=self.clock))
+
+    @property
+    def metrics(self) -> MetricsRegistry:
+        return self._get_component('metrics', MetricsRegistry)
+
+    @property
+    def tracer(self) -> Tracer:
+        def create():
+            trace_file = self._env_loader.get(EnvVar.TRACE_FILE)
+            return Tracer(
+                self._logger,
+                file_path=Path(trace_file) if trace_file else None,
+                sample_rate=float(self._env_loader.get(
+                    EnvVar.TRACE_SAMPLE_RATE, str(TracingSettings.DEFAULT_SAMPLE_RATE))),
+                budget=float(self._env_loader.get(EnvVar.HANDLER_BUDGET, str(TracingSettings.DEFAULT_BUDGET))),
+            )
+
+        return self._get_component('tracer', create)
+
+    @property
+    def admin_cache(self) -> AdminCache:
+        return self._get_component('admin_cache', lambda: AdminCache(
+            self.bot,
+            self.scheduler,
+            self._logger,
+            ttl=int(self._env_loader.get(EnvVar.ADMIN_CACHE_TTL, str(AdminCacheSettings.DEFAULT_TTL))),
+            clock=self.clock,
+        ))
+
+    @property
+    def member_cache(self) -> MemberCache:
+        def create():
+            member_cache = MemberCache(self.bot, self._logger, clock=self.clock)
+            self.bot.member_cache = member_cache
+            return member_cache
+
+        return self._get_component('member_cache', create)
+
+    @property
+    def chat_configs(self) -> List[ChatConfigDto]:
+        def create():
+            chats_file = self._env_loader.get(EnvVar.CHATS_FILE)
+            if chats_file:
+                configs = ChatConfigLoader.load(Path(chats_file))
+            else:
+                configs = [ChatConfigLoader.default(int(self._env_loader.get_required(EnvVar.TELEGRAM_CHAT_ID)))]
+            if self._chat_filter is not None:
+                configs = [config for config in configs if self._chat_filter(config.chat_id)]
+            return configs
+
+        return self._get_component('chat_configs', create)
+
+    @property
+    def question_providers(self) -> Dict[Path, QuestionProvider]:
+        """Question banks by questions file, chats with the same file share one bank"""
+        return self._get_component('question_providers', lambda: {
+            config.questions_file: QuestionProvider(config.questions_file) for config in self.chat_configs
+        })
+
+    @property
+    def question_watchers(self) -> List[QuestionWatcher]:
+        return self._get_component('question_watchers', lambda: [
+            QuestionWatcher(self.scheduler, self._logger, provider) for provider in self.question_providers.values()
+        ])
+
+    @property
+    def chats(self) -> Dict[int, ChatContext]:
+        return self._get_component('chats', lambda: {
+            config.chat_id: ChatContext(
+                config,
+                self.bot,
+                self.scheduler,
+                self.admin_cache,
+                self.journal,
+                self.question_providers[config.questions_file],
+                self._logger,
+                self.clock,
+                self.member_cache,
+                self.metrics,
+            ) for config in self.chat_configs
+        })
+
+    @property
+    def router(self) -> CommandRouter:
+        return self._get_component('router', lambda: CommandRouter(self.chats))
+
+    def _instrument(self, handler: Callable) -> Callable:
+        return self.tracer.handler(self.metrics.timed(MetricsSettings.HANDLER_LATENCY, handler.__name__)(handler))
+
+    def register_handlers(self):
+        router = self.router
+        router.command(Command.PING, Command.ID, Command.VER)(self._instrument(self.test_handler))
+        router.command(Command.ME)(self._instrument(self.me_handler))
+        router.command(Command.RO, Command.TO)(self._instrument(self.restrict_handler))
+        router.command(Command.RW)(self._instrument(self.permit_handler))
+        router.command(Command.BAN)(self._instrument(self.ban_handler))
+        router.command(Command.PASS)(self._instrument(self.pass_handler))
+
+        bot = self.bot
+        bot.set_update_listener(self.flood_listener)
+        bot.message_handler(func=router.accepts)(self.tracer.handler(router.dispatch))
+        bot.message_handler(
+            content_types=['new_chat_members'],
+            func=lambda message: message.chat.id in self.chats,
+        )(self._instrument(self.greeting_handler))
+        bot.callback_query_handler(func=lambda call: True)(self._instrument(self.greeting_callback))
+        bot.chat_member_handler(self._instrument(self.chat_member_handler))
+
+    def start_metrics_server(self):
+        """Serve /metrics on METRICS_PORT, nothing is served without it"""
+        port = self._env_loader.get(EnvVar.METRICS_PORT)
+        if not port:
+            return
+        metrics = self.metrics
+        metrics.gauge(MetricsSettings.NEWBIES, lambda: {
+            (chat.chat_id,): len(chat.newbie_storage) for chat in self.chats.values()
+        })
+        metrics.gauge(MetricsSettings.RESTRICTIONS, lambda: {
+            (chat.chat_id,): len(chat.restriction_storage) for chat in self.chats.values()
+        })
+        metrics.gauge(MetricsSettings.MEMBER_CACHE_LOOKUPS, lambda: {
+            ('hit',): self.member_cache.hits, ('miss',): self.member_cache.misses,
+        })
+        metrics.gauge(MetricsSettings.ADMIN_CACHE_LOOKUPS, lambda: {
+            ('hit',): self.admin_cache.hits, ('miss',): self.admin_cache.misses,
+        })
+        for name, key in (
+                (MetricsSettings.OUTBOUND_DEPTH, 'depth'),
+                (MetricsSettings.OUTBOUND_SENT, 'sent'),
+                (MetricsSettings.OUTBOUND_WAIT_AVG, 'wait_avg'),
+                (MetricsSettings.OUTBOUND_WAIT_MAX, 'wait_max'),
+        ):
+            metrics.gauge(name, partial(self._outbound_stats, key))
+        metrics.gauge(MetricsSettings.OUTBOUND_RETRIES, lambda: {(): self.dispatcher.stats()['retries']})
+        if isinstance(self.transport, ApiTransport):  # Stub transports of replays open no connections
+            metrics.gauge(MetricsSettings.TRANSPORT_REQUESTS, lambda: {(): self.transport.stats()['requests']})
+            metrics.gauge(MetricsSettings.TRANSPORT_CONNECTIONS, lambda: {(): self.transport.stats()['connections']})
+        self._metrics_server = MetricsServer(metrics, self._logger, port=int(port))
+        self._metrics_server.start()
+
+    def _outbound_stats(self, key: str) -> Dict[tuple, float]:
+        """Dispatcher stats of one kind by priority name"""
+        return {
+            (OutboundPriority.NAMES[priority],): value for priority, value in self.dispatcher.stats()[key].items()
+        }
+
+    def start(self):
+        self.transport.install()
+        with self._profiler.component('questions'):
+            for provider in self.question_providers.values():
+                provider.get_questions()
+        with self._profiler.component('state'):
+            for chat in self.chats.values():
+                self._logger.info(
+                    f'Chat {chat.chat_id}: loaded {chat.newbie_storage.load()} newbies '
+                    f'and {chat.restriction_storage.load()} restrictions.'
+                )
+        self.journal.start()
+        self.tracer.start()
+        self.bot.dispatcher.start()
+        self.scheduler.start()
+        with self._profiler.component('admin_cache_warm'):
+            for chat in self.chats.values():
+                chat.methods.evict_expired()
+                chat.methods.restore_scheduled_threats()
+                self.admin_cache.warm(chat.chat_id)
+        for watcher in self.question_watchers:
+            watcher.start()
+        self.start_metrics_server()
+
+    def stop(self):
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
+        for watcher in self.question_watchers:
+            watcher.stop()
+        self.scheduler.stop()
+        self.bot.dispatcher.stop()
+        self.tracer.stop()
+        self.journal.stop()
+        self.transport.uninstall()
+        if self.bot.recorder is not None:
+            self.bot.recorder.close()
+
+    def run(self, mode: str = RunMode.POLLING):
+        self.start()
+        try:
+            if mode == RunMode.WEBHOOK:
+                self.run_webhook()
+            elif mode == RunMode.ASYNC:
+                self.bot.remove_webhook()
+                self._ready()
+                self.run_async()
+            else:
+                self.bot.remove_webhook()
+                self.bot.startup_listener = self._ready
+                self.bot.polling(none_stop=True)  # Handler errors, e.g. 429 of getChatMember, must not stop the bot
+        finally:
+            self.stop()
+
+    def run_workers(self, mode: str, workers: int):
+        """Receive updates in this process and handle them in worker processes partitioned by chat"""
+        self.journal  # State file tables are created once, before workers open it
+        supervisor = WorkerSupervisor(self.bot, self._logger, workers, args=(self._version,))
+        supervisor.start()
+        try:
+            if mode == RunMode.WEBHOOK:
+                self.run_webhook(supervisor.dispatch)
+            else:
+                self.bot.remove_webhook()
+                self._ready()
+                supervisor.poll()
+        finally:
+            supervisor.stop()
+
+    def run_partition(self, updates: Queue):
+        """Worker process loop: handle update batches from the supervisor until None"""
+        self.start()
+        try:
+            for json_updates in iter(updates.get, None):
+                self.bot.process_new_updates(self.bot.de_json_updates(json_updates))
+            self.bot.drain(WorkerSettings.STOP_TIMEOUT, WebhookSettings.DRAIN_POLL_INTERVAL)
+        finally:
+            self.stop()
+
+    def _ready(self):
+        ready_time = self._profiler.ready()
+        if self._profile:
+            self._logger.info(self._profiler.report())
+        else:
+            self._logger.info(f'Bot is ready in {ready_time * 1000:.1f}ms')
+
+    def test_handler(self, message: Message):
+        chat = self.chats[message.chat.id]
+        response_list = {
+            Command.PING: 'pong',
+            Command.ID: message.chat.id,
+            Command.VER: self._version,
+        }
+
+        try:
+            if not chat.methods.is_admin(message.from_user):
+                raise InvalidConditionError()
+
+            def self_destruct(response: Future):
+                for current_message in (message,) if response.exception() else (message, response.result()):
+                    chat.methods.create_scheduled_threat(
+                        pause=MessageSettings.SELF_DESTRUCT_TIMEOUT,
+                        action=chat.methods.delete_chat_message,
+                        args=(current_message,)
+                    )
+
+            self.bot.enqueue(
+                'send_message', message.chat.id, response_list[self.router.get_command(message)],
+            ).add_done_callback(self_destruct)
+        except InvalidConditionError:
+            chat.methods.delete_chat_message(message)
+
+    def me_handler(self, message: Message):
+        chat = self.chats[message.chat.id]
+        try:
+            query = chat.methods.prepare_query(message.text)
+
+            if query:
+                self.bot.enqueue('send_message', message.chat.id,
+                                 '*{}* _{}_'.format(message.from_user.first_name, query),
+                                 parse_mode=TelegramParseMode.MARKDOWN)
+            chat.methods.delete_chat_message(message)
+        except (ApiException, IndexError):
+            self.bot.enqueue('send_message', message.chat.id, 'Братиш, наебнулось. Посмотри логи.')
+
+    def restrict_handler(self, message: Message):
+        chat = self.chats[message.chat.id]
+        try:
+            if message.forward_from:
+                raise InvalidConditionError()
+            if not chat.methods.is_admin(message.from_user):
+                raise UnauthorizedCommandError(message=message, service=chat.methods, bot=self.bot, logger=self._logger)
+
+            command = self.router.get_command(message)
+            task_list = {
+                Command.RO: chat.methods.set_read_only,
+                Command.TO: chat.methods.set_text_only,
+            }
+
+            try:
+                target_message = message.reply_to_message
+            except AttributeError:
+                raise InvalidConditionError()
+            if chat.methods.is_admin(target_message.from_user):
+                self._logger.warning('Admin trying to restrict another admin. Abort.', extra=log_fields(
+                    chat_id=message.chat.id, username=message.from_user.username,
+                ))
+                raise InvalidConditionError()
+
+            try:
+                query = chat.methods.prepare_query(message.text)
+                restrict_duration = chat.methods.get_duration(text=query, duration_class=chat.restrict_duration)
+            except ParseBanDurationError:
+                raise InvalidCommandError
+
+            target_user = target_message.from_user
+            try:
+                self._logger.info('Try to restrict chat member', extra=log_fields(
+                    chat_id=message.chat.id, username=target_user.username, command=command.bot_command, query=query,
+                ))
+                try:
+                    restrict_task = task_list.get(command)
+                    restriction_text = restrict_task(
+                        user=target_user,
+                        message=message,
+                        duration=restrict_duration
+                    )
+                except (KeyError, TypeError):
+                    raise InvalidCommandError()
+
+                self.bot.enqueue(
+                    'send_message',
+                    chat_id=message.chat.id,
+                    text=f'*{restriction_text}*',
+                    reply_to_message_id=message.message_id,
+                    parse_mode=TelegramParseMode.MARKDOWN,
+                )
+            except ApiException:
+                self._logger.error('Can not restrict chat member', extra=log_fields(
+                    chat_id=message.chat.id, user_id=target_user.id, username=target_user.username,
+                ))
+
+        except InvalidCommandError:
+            self._logger.warning('Can not execute command', extra=log_fields(
+                chat_id=message.chat.id, text=message.text, username=message.from_user.username,
+            ))
+            chat.methods.delete_chat_message(message)
+        except InvalidConditionError:
+            pass
+
+    def flood_listener(self, messages: List[Message]):
+        """Count every chat message by sender, a flood is restricted by flood_handler"""
+        for message in messages:
+            chat = self.chats.get(message.chat.id)
+            if chat is None or message.from_user is None or message.content_type not in FloodSettings.CONTENT_TYPES:
+                continue
+            content_type = chat.flood_detector.register(
+                message.from_user.id,
+                message.content_type in FloodSettings.MEDIA_CONTENT_TYPES,
+                message.date,
+            )
+            if content_type is not None:
+                self.bot.submit(self._instrument(self.flood_handler), message, content_type)
+
+    def flood_handler(self, message: Message, content_type: str):
+        chat = self.chats[message.chat.id]
+        user = message.from_user
+        if chat.methods.is_admin(user):
+            return
+
+        restrict_task = chat.methods.set_read_only if content_type == FloodSettings.MESSAGES \
+            else chat.methods.set_text_only
+        try:
+            self._logger.info('Try to restrict flooding chat member', extra=log_fields(
+                chat_id=message.chat.id, user_id=user.id, username=user.username, content_type=content_type,
+            ))
+            restriction_text = restrict_task(user=user, message=message, duration=FloodSettings.DURATION)
+            self.bot.enqueue(
+                'send_message',
+                chat_id=message.chat.id,
+                text=f'*{restriction_text}*',
+                reply_to_message_id=message.message_id,
+                parse_mode=TelegramParseMode.MARKDOWN,
+            )
+        except ApiException:
+            self._logger.error('Can not restrict chat member', extra=log_fields(
+                chat_id=message.chat.id, user_id=user.id, username=user.username,
+            ))
+
+    def permit_handler(self, message: Message):
+        chat = self.chats[message.chat.id]
+        try:
+            if message.forward_from:
+                raise InvalidConditionError()
+            if not chat.methods.is_admin(message.from_user):
+                raise UnauthorizedCommandError(message=message, service=chat.methods, bot=self.bot, logger=self._logger)
+
+            try:
+                target_message = message.reply_to_message
+            except AttributeError:
+                raise InvalidCommandError()
+
+            target_user = target_message.from_user
+
+            try:
+                chat_member = self.member_cache.get(message.chat.id, target_user.id)
+                if chat_member.status != TelegramMemberStatus.RESTRICTED:
+                    raise InvalidConditionError()
+
+                self._logger.info('Try to permit chat member', extra=log_fields(
+                    chat_id=message.chat.id, username=target_user.username,
+                ))
+                permission_text = chat.methods.set_read_write(user=target_user, message=message)
+
+                self.bot.enqueue(
+                    'send_message',
+                    chat_id=message.chat.id,
+                    text=f'*{permission_text}*',
+                    reply_to_message_id=message.message_id,
+                    parse_mode=TelegramParseMode.MARKDOWN,
+                )
+            except ApiException:
+                self._logger.error('Can not permit chat member', extra=log_fields(
+                    chat_id=message.chat.id, user_id=target_user.id, username=target_user.username,
+                ))
+
+        except InvalidCommandError:
+            self._logger.warning('Can not execute command', extra=log_fields(
+                chat_id=message.chat.id, text=message.text, username=message.from_user.username,
+            ))
+            chat.methods.delete_chat_message(message)
+        except InvalidConditionError:
+            pass
+
+    def ban_handler(self, message: Message):
+        chat = self.chats[message.chat.id]
+        try:
+            if message.forward_from:
+                raise InvalidConditionError()
+            if not chat.methods.is_admin(message.from_user):
+                raise UnauthorizedCommandError(message=message, service=chat.methods, bot=self.bot, logger=self._logger)
+
+            try:
+                target_message = message.reply_to_message
+                if chat.methods.is_admin(target_message.from_user):
+                    self._logger.warning('Admin trying to ban another admin. Abort.', extra=log_fields(
+                        chat_id=message.chat.id, username=message.from_user.username,
+                    ))
+                    raise InvalidCommandError()
+            except AttributeError:
+                raise InvalidConditionError()
+
+            try:
+                query = chat.methods.prepare_query(message.text)
+                ban_duration = chat.methods.get_duration(text=query, duration_class=chat.ban_duration)
+            except ParseBanDurationError:
+                raise InvalidCommandError
+
+            target_user = target_message.from_user
+            try:
+                self._logger.info('Try to ban chat member', extra=log_fields(
+                    chat_id=message.chat.id, username=target_user.username, query=query,
+                ))
+                ban_text = chat.methods.ban_kick(
+                    user=target_user,
+                    message=message,
+                    duration=ban_duration
+                )
+                self.bot.enqueue(
+                    'send_message',
+                    chat_id=message.chat.id,
+                    text=f'*{ban_text}*',
+                    reply_to_message_id=message.message_id,
+                    parse_mode=TelegramParseMode.MARKDOWN,
+                )
+            except ApiException:
+                self._logger.error('Can not kick chat member', extra=log_fields(
+                    chat_id=message.chat.id, user_id=target_user.id, username=target_user.username,
+                ))
+
+        except InvalidCommandError:
+            self._logger.warning('Can not execute command', extra=log_fields(
+                chat_id=message.chat.id, text=message.text, username=message.from_user.username,
+            ))
+            chat.methods.delete_chat_message(message)
+        except InvalidConditionError:
+            pass
+
+    def greeting_handler(self, message: Message):
+        chat = self.chats[message.chat.id]
+        if chat.raid_guard.handle(message):
+            return
+
+        join_message_deleted = False
+        for new_user in message.new_chat_members:
+            self._logger.info('New member joined the group', extra=log_fields(
+                chat_id=message.chat.id, user_id=new_user.id, username=new_user.username,
+            ))
+
+            new_chat_member = self.member_cache.get(message.chat.id, new_user.id)
+            if new_chat_member.status == TelegramMemberStatus.RESTRICTED:
+                self._logger.warning('Rejoined user with active restriction', extra=log_fields(
+                    chat_id=message.chat.id, user_id=new_user.id, username=new_user.username,
+                ))
+                if not join_message_deleted:
+                    chat.methods.delete_chat_message(message)
+                    join_message_deleted = True
+                continue
+
+            question = chat.questions.get_question()
+
+            try:
+                chat.newbie_storage.add(user=new_user, timeout=message.date + question.timeout, question=question)
+            except UserAlreadyInStorageError:
+                chat.methods.timeout_kick(chat.newbie_storage.get(new_user))
+                continue
+            except StorageFullError:
+                continue
+
+            self._logger.info('Trying to temporary restrict all user content', extra=log_fields(
+                chat_id=message.chat.id, user_id=new_user.id, username=new_user.username,
+            ))
+            try:
+                self.bot.restrict_chat_member(
+                    chat_id=message.chat.id,
+                    user_id=new_user.id,
+                    until_date=message.date + question.timeout * 2,
+                )
+            except ApiException:
+                self._logger.error('Can not restrict chat member', extra=log_fields(
+                    chat_id=message.chat.id, user_id=new_user.id, username=new_user.username,
+                ))
+                continue
+
+            self.bot.enqueue(
+                'send_message',
+                chat_id=message.chat.id,
+                text=question.text.format(mention=chat.methods.mention(new_user)),
+                reply_markup=question.keyboard_json,
+                reply_to_message_id=message.message_id,
+                parse_mode=TelegramParseMode.MARKDOWN,
+            ).add_done_callback(partial(self._greeting_sent, chat, message, new_user, question))
+
+    def _greeting_sent(self, chat: ChatContext, message: Message, new_user: User, question: GreetingQuestionDto,
+                       future: Future):
+        """
+        Done callback of a greeting question, handler threads do not wait for throttled notifications
+
+        A newbie left without a greeting is never kicked by timeout, so it is removed and its restriction is lifted.
+        """
+        if future.exception() is not None:
+            self._logger.error('Can not send greeting question', extra=log_fields(
+                chat_id=message.chat.id, user_id=new_user.id, username=new_user.username,
+            ))
+            try:
+                newbie = chat.newbie_storage.get(new_user)
+            except UserNotFoundInStorageError:  # Kicked on rejoin meanwhile
+                return
+            if newbie.greeting is None and chat.newbie_storage.take(newbie):
+                self.bot.enqueue(
+                    'restrict_chat_member',
+                    chat_id=message.chat.id,
+                    user_id=new_user.id,
+                    can_send_messages=True,
+                    can_send_media_messages=True,
+                    can_send_other_messages=True,
+                    can_add_web_page_previews=True,
+                ).add_done_callback(partial(self._restriction_lifted, message, new_user))
+            return
+
+        greeting_message = future.result()
+        self.metrics.observe(MetricsSettings.JOIN_TO_QUESTION, (), max(self.clock.time() - message.date, 0))
+        try:
+            chat.newbie_storage.update(
+                user=new_user,
+                greeting=greeting_message
+            )
+            chat.methods.create_scheduled_threat(
+                pause=question.timeout,
+                action=chat.methods.timeout_kick,
+                args=(chat.newbie_storage.get(new_user),),
+                key=chat.methods.task_key(new_user.id, ScheduledTaskKey.TIMEOUT_KICK),
+            )
+        except (UserStorageUpdateError, UserNotFoundInStorageError):
+            chat.methods.delete_chat_message(greeting_message)
+
+    def _restriction_lifted(self, message: Message, new_user: User, future: Future):
+        if future.exception() is not None:
+            self._logger.error('Can not disable restriction for chat member', extra=log_fields(
+                chat_id=message.chat.id, user_id=new_user.id, username=new_user.username,
+            ))
+
+    def pass_handler(self, message: Message):
+        chat = self.chats[message.chat.id]
+        try:
+            if message.forward_from:
+                raise InvalidConditionError()
+            if not chat.methods.is_admin(message.from_user):
+                raise UnauthorizedCommandError(message=message, service=chat.methods, bot=self.bot, logger=self._logger)
+            try:
+                target_message = message.reply_to_message
+            except AttributeError:
+                raise InvalidConditionError()
+            if target_message is None:
+                raise InvalidConditionError()
+            newbie = chat.newbie_storage.find_by_greeting(target_message.message_id)
+            if newbie is None or not chat.newbie_storage.take(newbie):
+                raise InvalidConditionError()
+
+            chat.methods.delete_chat_message(message)
+            chat.methods.delete_chat_message(newbie.greeting)
+            self.bot.restrict_chat_member(
+                chat_id=target_message.chat.id,
+                user_id=newbie.user.id,
+                can_send_messages=True,
+                can_send_media_messages=True,
+                can_send_other_messages=True,
+                can_add_web_page_previews=True
+            )
+            chat.methods.cancel_scheduled_threat(chat.methods.task_key(newbie.user.id, ScheduledTaskKey.TIMEOUT_KICK))
+
+        except ApiException:
+            self._logger.error('Can not pass message', extra=log_fields(chat_id=message.chat.id))
+        except InvalidConditionError:
+            pass
+
+    def greeting_callback(self, call: CallbackQuery):
+        try:
+            if not call.message or call.message.chat.id not in self.chats:
+                raise InvalidConditionError()
+            chat = self.chats[call.message.chat.id]
+            if call.from_user.id not in chat.newbie_storage:
+                raise InvalidConditionError()
+
+            try:
+                newbie = chat.newbie_storage.get(call.from_user)
+            except UserNotFoundInStorageError:  # Timed out after the check
+                raise InvalidConditionError()
+            greeting_message = newbie.greeting
+            if greeting_message is None or call.message.message_id != greeting_message.message_id:
+                raise InvalidConditionError()  # Not greeted yet or an older greeting
+            if not chat.newbie_storage.take(newbie):  # Timed out or answered by another click meanwhile
+                raise InvalidConditionError()
+
+            chat.methods.remove_inline_keyboard(call.message)
+            try:
+                reply = newbie.question.reply[call.data]
+            except (KeyError, TypeError):
+                reply = '*{first_name} ответил "{call_data}".*'
+            self.bot.enqueue(
+                'send_message',
+                chat_id=call.message.chat.id,
+                text=reply.format(first_name=call.from_user.first_name, call_data=call.data),
+                reply_to_message_id=call.message.message_id,
+                parse_mode=TelegramParseMode.MARKDOWN,
+            )
+
+            chat.methods.cancel_scheduled_threat(chat.methods.task_key(newbie.user.id, ScheduledTaskKey.TIMEOUT_KICK))
+            try:
+                self.bot.restrict_chat_member(
+                    chat_id=call.message.chat.id,
+                    user_id=call.from_user.id,
+                    can_send_messages=True,
+                    can_send_media_messages=True,
+                    can_send_other_messages=True,
+                    can_add_web_page_previews=True
+                )
+            except ApiException:
+                self._logger.error('Can not disable restriction for chat member', extra=log_fields(
+                    chat_id=call.message.chat.id, user_id=call.from_user.id, username=call.from_user.username,
+                ))
+        except InvalidConditionError:
+            pass
+
+    def chat_member_handler(self, update: ChatMemberUpdateDto):
+        if update.chat_id in self.chats:
+            self.admin_cache.process_member_update(update)
+
+    def run_webhook(self, consumer: Callable[[list], None] = None):
+        secret_token = self._env_loader.get_required(EnvVar.WEBHOOK_SECRET, sensitive=True)
+        server = WebhookServer(
+            self.bot,
+            secret_token,
+            self._logger,
+            port=int(self._env_loader.get(EnvVar.WEBHOOK_PORT, str(WebhookSettings.DEFAULT_PORT))),
+            consumer=consumer,
+        )
+        server.start()
+        self.bot.set_webhook_with_secret(self._env_loader.get_required(EnvVar.WEBHOOK_URL), secret_token)
+        self._ready()
+
+        stop_event = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+        signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+        stop_event.wait()
+        server.drain()
+
+    def run_async(self):
+        api = AsyncTelegramApi(self.bot.token, self._logger)
+        async_chats = {
+            chat.chat_id: AsyncBotUtils(
+                api, chat.notification, chat.newbie_storage, chat.questions, self._logger, self.member_cache,
+                chat.raid_guard,
+            ) for chat in self.chats.values()
+        }
+        runtime = AsyncBotRuntime(api, self.bot, async_chats, self._logger)
+        runtime.run()
+
+
+def create_app(logger: logging.Logger, version: str = '', profiler: StartupProfiler = None,
+               chat_filter: Callable[[int], bool] = None, components: Dict[str, object] = None) -> Application:
+    """Application with registered handlers, nothing is started until run()"""
+    app = Application(EnvLoader(logger), logger, version, profiler, chat_filter, components)
+    app.register_handlers()
+    return app
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import logging
+import ssl
+from typing import List
+from urllib.parse import urlsplit
+
+from telebot import apihelper
+from telebot.apihelper import ApiException
+from telebot.types import ChatMember, Message
+
+from const import AsyncSettings
+
+
+class AsyncTelegramApi:
+    """
+    Minimal asyncio Bot API client
+
+    Requests are sent as JSON over a pool of keep-alive connections, so thousands of calls
+    can be in flight on one event loop without a thread each.
+    Failed calls raise telebot ApiException to keep error handling the same as in threaded mode.
+    """
+    _DEFAULT_URL = 'https://api.telegram.org/bot{0}/{1}'
+
+    def __init__(self, token: str, logger: logging.Logger, pool_size: int = AsyncSettings.POOL_SIZE,
+                 api_url: str = None):
+        url = urlsplit((api_url or apihelper.API_URL or self._DEFAULT_URL).format(token, '{0}'))
+        self._logger = logger
+        self._host = url.hostname
+        self._ssl = ssl.create_default_context() if url.scheme == 'https' else None
+        self._port = url.port or (443 if self._ssl else 80)
+        self._path = url.path
+        self._pool_size = pool_size
+        self._semaphore = None  # Created inside the running loop
+        self._idle = []
+
+    async def close(self):
+        while self._idle:
+            reader, writer = self._idle.pop()
+            writer.close()
+
+    async def call(self, method: str, params: dict = None, request_timeout: float = AsyncSettings.REQUEST_TIMEOUT):
+        body = json.dumps({k: v for k, v in (params or {}).items() if v is not None}).encode()
+        request = (
+            f'POST {self._path.format(method)} HTTP/1.1\r\n'
+            f'Host: {self._host}\r\n'
+            'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            'Connection: keep-alive\r\n\r\n'
+        ).encode() + body
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._pool_size)
+        async with self._semaphore:
+            if self._idle:
+                reader, writer = self._idle.pop()
+            else:
+                reader, writer = await asyncio.open_connection(self._host, self._port, ssl=self._ssl)
+            try:
+                writer.write(request)
+                await writer.drain()
+                status, keep_alive, response = await asyncio.wait_for(self._read_response(reader), request_timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, IndexError, ValueError) as e:
+                writer.close()
+                raise ApiException(f'Connection error: {e!r}', method, None)
+            if keep_alive:
+                self._idle.append((reader, writer))
+            else:
+                writer.close()
+
+        try:
+            result = json.loads(response.decode('utf8'))
+        except ValueError:
+            raise ApiException(f'The server returned HTTP {status}, invalid JSON: {response!r}', method, None)
+        if not result.get('ok'):
+            raise ApiException(
+                f'Error code: {result.get("error_code")} Description: {result.get("description")}', method, result
+            )
+        return result['result']
+
+    @staticmethod
+    async def _read_response(reader: asyncio.StreamReader):
+        status = int((await reader.readline()).split()[1])
+        headers = dict()
+        while True:
+            line = (await reader.readline()).decode('latin1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                chunk = await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                chunks.append(chunk[:-2])
+            body = b''.join(chunks)
+        else:
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+        return status, headers.get('connection', '').lower() != 'close', body
+
+    async def get_updates(self, offset: int = None, timeout: int = AsyncSettings.POLLING_TIMEOUT,
+                          allowed_updates: List[str] = None) -> list:
+        params = dict(offset=offset, timeout=timeout, allowed_updates=allowed_updates)
+        return await self.call('getUpdates', params, request_timeout=timeout + AsyncSettings.REQUEST_TIMEOUT)
+
+    async def get_chat_member(self, chat_id: int, user_id: int) -> ChatMember:
+        return ChatMember.de_json(await self.call('getChatMember', dict(chat_id=chat_id, user_id=user_id)))
+
+    async def send_message(self, chat_id: int, text: str, reply_to_message_id: int = None, reply_markup: str = None,
+                           parse_mode: str = None) -> Message:
+        return Message.de_json(await self.call('sendMessage', dict(
+            chat_id=chat_id,
+            text=text,
+            reply_to_message_id=reply_to_message_id,
+            reply_markup=reply_markup,
+            parse_mode=parse_mode,
+        )))
+
+    async def restrict_chat_member(self, chat_id: int, user_id: int, until_date: int = None, **permissions) -> bool:
+        return await self.call('restrictChatMember', dict(chat_id=chat_id, user_id=user_id, until_date=until_date,
+                                                          **permissions))
+
+    async def kick_chat_member(self, chat_id: int, user_id: int, until_date: int = None) -> bool:
+        return await self.call('kickChatMember', dict(chat_id=chat_id, user_id=user_id, until_date=until_date))
+
+    async def delete_message(self, chat_id: int, message_id: int) -> bool:
+        return await self.call('deleteMessage', dict(chat_id=chat_id, message_id=message_id))
+
+    async def edit_message_reply_markup(self, chat_id: int, message_id: int) -> bool:
+        return await self.call('editMessageReplyMarkup', dict(chat_id=chat_id, message_id=message_id))
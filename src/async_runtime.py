@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from telebot.apihelper import ApiException
+from telebot.types import Update
+
+from async_api import AsyncTelegramApi
+from async_utils import AsyncBotUtils
+from bot import RudeBot
+from const import AsyncSettings
+from logs import log_fields
+
+
+class AsyncBotRuntime:
+    """
+    Opt-in asyncio execution engine
+
+    Updates are long-polled on the event loop. Joins and greeting callbacks of moderated chats are handled
+    by AsyncBotUtils coroutines of the chat; everything else (admin commands, chat member updates) is passed to
+    the threaded handlers registered on the bot. Fallback batches are passed on by one thread, so they reach
+    the ordered handler pool of the bot in the order they were polled.
+    """
+
+    _chats: Dict[int, AsyncBotUtils]
+
+    def __init__(self, api: AsyncTelegramApi, bot: RudeBot, chats: Dict[int, AsyncBotUtils],
+                 logger: logging.Logger):
+        self._api = api
+        self._bot = bot
+        self._chats = chats
+        self._logger = logger
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='async-fallback')
+        self._tasks = set()
+        self._stopped = None
+
+    def dispatch(self, json_updates: list):
+        loop = asyncio.get_event_loop()
+        fallback = []
+        for update in self._bot.de_json_updates(json_updates):
+            message = update.message
+            call = update.callback_query
+            if message and message.new_chat_members and message.chat.id in self._chats:
+                self._spawn(self._chats[message.chat.id].greeting_handler(message))
+            elif call and call.message and call.message.chat.id in self._chats:
+                self._spawn(self._chats[call.message.chat.id].greeting_callback(call))
+            else:
+                fallback.append(update)
+        if fallback:
+            loop.run_in_executor(self._executor, self._bot.process_new_updates, fallback)
+
+    def _spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._on_task_done)
+
+    def _on_task_done(self, task: asyncio.Future):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self._logger.error('Async handler failed', extra=log_fields(error=task.exception()))
+
+    async def skip_pending(self) -> Optional[int]:
+        """Drop updates received before start as skip_pending polling does, returns the offset after them"""
+        while True:
+            try:
+                json_updates = await self._api.get_updates(-1, timeout=0, allowed_updates=self._bot.allowed_updates)
+            except ApiException as e:
+                self._logger.error(e)
+                await asyncio.sleep(AsyncSettings.ERROR_INTERVAL)
+                continue
+            return json_updates[-1]['update_id'] + 1 if json_updates else None
+
+    async def poll(self):
+        offset = await self.skip_pending()
+        while True:
+            try:
+                json_updates = await self._api.get_updates(offset, allowed_updates=self._bot.allowed_updates)
+            except ApiException as e:
+                self._logger.error(e)
+                await asyncio.sleep(AsyncSettings.ERROR_INTERVAL)
+                continue
+            if json_updates:
+                offset = json_updates[-1]['update_id'] + 1
+                self.dispatch(json_updates)
+
+    async def drain(self):
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+        await self._api.close()
+        self._executor.shutdown(wait=True)
+
+    def stop(self):
+        if self._stopped is not None:
+            self._stopped.set()
+
+    async def _main(self):
+        self._stopped = asyncio.Event()
+        loop = asyncio.get_event_loop()
+        for signal_number in signal.SIGTERM, signal.SIGINT:
+            loop.add_signal_handler(signal_number, self.stop)
+        poll = asyncio.ensure_future(self.poll())
+        await self._stopped.wait()
+        poll.cancel()
+        await self.drain()
+
+    def run(self):
+        self._logger.info('Started async polling.')
+        asyncio.run(self._main())
+        self._logger.info('Stopped async polling.')
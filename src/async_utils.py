@@ -0,0 +1,249 @@
+import asyncio
+import logging
+from typing import Dict, Hashable, Union
+
+from telebot.apihelper import ApiException
+from telebot.types import Message, CallbackQuery, User, ChatMember
+
+from async_api import AsyncTelegramApi
+from const import TelegramMemberStatus, TelegramParseMode, BanDuration, ScheduledTaskKey
+from dto import NewbieDto, MemberStateDto
+from error import UserAlreadyInStorageError, UserStorageUpdateError, UserNotFoundInStorageError, StorageFullError
+from greeting import NewbieStorage, QuestionProvider
+from logs import log_fields
+from member_cache import MemberCache
+from notification import Notification
+from raid import RaidGuard
+from utils import BotUtils
+
+
+class AsyncBotUtils:
+    """
+    Async counterparts of the greeting flow: joins, greeting callbacks and timeout kicks
+
+    Storages are in-memory and never block, so they are shared with threaded handlers as is.
+    Timers are event loop handles instead of TaskScheduler tasks.
+    With a member cache, known member states are not read again and own restrictions and kicks are tracked.
+    With a raid guard, joins are passed to it first and raid batches get no greeting; the guard waits for
+    moderation results, so it runs in the default executor.
+    """
+    _timers: Dict[Hashable, asyncio.TimerHandle]
+
+    def __init__(
+            self,
+            api: AsyncTelegramApi,
+            notification: Notification,
+            newbie_storage: NewbieStorage,
+            questions: QuestionProvider,
+            logger: logging.Logger,
+            member_cache: MemberCache = None,
+            raid_guard: RaidGuard = None,
+    ):
+        self._api = api
+        self._notification = notification
+        self._newbie_storage = newbie_storage
+        self._questions = questions
+        self._logger = logger
+        self._member_cache = member_cache
+        self._raid_guard = raid_guard
+        self._timers = dict()
+
+    def create_scheduled_task(self, pause: float, action, args: tuple, key: Hashable = None):
+        loop = asyncio.get_event_loop()
+        handle = loop.call_later(max(pause, 0), self._run_scheduled_task, key, action, args)
+        if key is not None:
+            self.cancel_scheduled_task(key)
+            self._timers[key] = handle
+
+    def cancel_scheduled_task(self, key: Hashable) -> bool:
+        handle = self._timers.pop(key, None)
+        if handle is None:
+            return False
+        handle.cancel()
+        return True
+
+    def _run_scheduled_task(self, key: Hashable, action, args: tuple):
+        self._timers.pop(key, None)
+        asyncio.ensure_future(action(*args))
+
+    async def _get_chat_member(self, chat_id: int, user_id: int) -> Union[ChatMember, MemberStateDto]:
+        state = self._member_cache.peek(chat_id, user_id) if self._member_cache is not None else None
+        if state is not None:
+            return state
+        chat_member = await self._api.get_chat_member(chat_id, user_id)
+        if self._member_cache is not None:
+            self._member_cache.put(chat_id, user_id, chat_member)
+        return chat_member
+
+    async def _restrict_chat_member(self, **kwargs):
+        return await self._tracked('restrict_chat_member', self._api.restrict_chat_member, kwargs)
+
+    async def _kick_chat_member(self, **kwargs):
+        return await self._tracked('kick_chat_member', self._api.kick_chat_member, kwargs)
+
+    async def _tracked(self, method_name: str, call, kwargs: dict):
+        try:
+            result = await call(**kwargs)
+        except ApiException:
+            if self._member_cache is not None:
+                self._member_cache.record(method_name, (), kwargs, succeeded=False)
+            raise
+        if self._member_cache is not None:
+            self._member_cache.record(method_name, (), kwargs, succeeded=True)
+        return result
+
+    async def delete_chat_message(self, message: Message):
+        try:
+            await self._api.delete_message(message.chat.id, message.message_id)
+        except ApiException:
+            self._logger.error('Can not delete chat message', extra=log_fields(
+                chat_id=message.chat.id, message_id=message.message_id,
+            ))
+
+    async def remove_inline_keyboard(self, message: Message):
+        try:
+            await self._api.edit_message_reply_markup(chat_id=message.chat.id, message_id=message.message_id)
+        except ApiException:
+            self._logger.error('Can not edit chat message', extra=log_fields(
+                chat_id=message.chat.id, message_id=message.message_id,
+            ))
+
+    async def greeting_handler(self, message: Message):
+        if self._raid_guard is not None:
+            loop = asyncio.get_event_loop()
+            if await loop.run_in_executor(None, self._raid_guard.handle, message):
+                return
+
+        rejoined = await asyncio.gather(*[self._greet(message, new_user) for new_user in message.new_chat_members])
+        if any(rejoined):
+            await self.delete_chat_message(message)
+
+    async def _greet(self, message: Message, new_user: User) -> bool:
+        """Returns True if new user is rejoined user with active restriction"""
+        self._logger.info('New member joined the group', extra=log_fields(
+            chat_id=message.chat.id, user_id=new_user.id, username=new_user.username,
+        ))
+
+        new_chat_member = await self._get_chat_member(message.chat.id, new_user.id)
+        if new_chat_member.status == TelegramMemberStatus.RESTRICTED:
+            self._logger.warning('Rejoined user with active restriction', extra=log_fields(
+                chat_id=message.chat.id, user_id=new_user.id, username=new_user.username,
+            ))
+            return True
+
+        question = self._questions.get_question()
+
+        try:
+            self._newbie_storage.add(user=new_user, timeout=message.date + question.timeout, question=question)
+        except UserAlreadyInStorageError:
+            await self.timeout_kick(self._newbie_storage.get(new_user))
+            return False
+        except StorageFullError:
+            return False
+
+        self._logger.info('Trying to temporary restrict all user content', extra=log_fields(
+            chat_id=message.chat.id, user_id=new_user.id, username=new_user.username,
+        ))
+        try:
+            await self._restrict_chat_member(
+                chat_id=message.chat.id,
+                user_id=new_user.id,
+                until_date=message.date + question.timeout * 2,
+            )
+        except ApiException:
+            self._logger.error('Can not restrict chat member', extra=log_fields(
+                chat_id=message.chat.id, user_id=new_user.id, username=new_user.username,
+            ))
+            return False
+
+        greeting_message = await self._api.send_message(
+            chat_id=message.chat.id,
+            text=question.text.format(mention=BotUtils.mention(new_user)),
+            reply_markup=question.keyboard_json,
+            reply_to_message_id=message.message_id,
+            parse_mode=TelegramParseMode.MARKDOWN,
+        )
+        try:
+            self._newbie_storage.update(user=new_user, greeting=greeting_message)
+            self.create_scheduled_task(
+                pause=question.timeout,
+                action=self.timeout_kick,
+                args=(self._newbie_storage.get(new_user),),
+                key=(new_user.id, ScheduledTaskKey.TIMEOUT_KICK),
+            )
+        except (UserStorageUpdateError, UserNotFoundInStorageError):
+            await self.delete_chat_message(greeting_message)
+        return False
+
+    async def greeting_callback(self, call: CallbackQuery):
+        if not call.message or call.from_user.id not in self._newbie_storage:
+            return
+
+        try:
+            newbie = self._newbie_storage.get(call.from_user)
+        except UserNotFoundInStorageError:  # Timed out after the check
+            return
+        greeting_message = newbie.greeting
+        if greeting_message is None or call.message.message_id != greeting_message.message_id:
+            return  # Not greeted yet or an older greeting
+        if not self._newbie_storage.take(newbie):  # Timed out or answered by another click meanwhile
+            return
+
+        try:
+            reply = newbie.question.reply[call.data]
+        except (KeyError, TypeError):
+            reply = '*{first_name} ответил "{call_data}".*'
+        self.cancel_scheduled_task((newbie.user.id, ScheduledTaskKey.TIMEOUT_KICK))
+
+        await asyncio.gather(
+            self.remove_inline_keyboard(call.message),
+            self._api.send_message(
+                chat_id=call.message.chat.id,
+                text=reply.format(first_name=call.from_user.first_name, call_data=call.data),
+                reply_to_message_id=call.message.message_id,
+                parse_mode=TelegramParseMode.MARKDOWN,
+            ),
+        )
+        try:
+            await self._restrict_chat_member(
+                chat_id=call.message.chat.id,
+                user_id=call.from_user.id,
+                can_send_messages=True,
+                can_send_media_messages=True,
+                can_send_other_messages=True,
+                can_add_web_page_previews=True,
+            )
+        except ApiException:
+            self._logger.error('Can not disable restriction for chat member', extra=log_fields(
+                chat_id=call.message.chat.id, user_id=call.from_user.id, username=call.from_user.username,
+            ))
+
+    async def timeout_kick(self, newbie: NewbieDto):
+        greeting_message = newbie.greeting
+        user = newbie.user
+        if not self._newbie_storage.take(newbie):
+            return
+
+        await self.remove_inline_keyboard(greeting_message)
+
+        kick_text = self._notification.timeout_kick(user.first_name)
+        kick_message = await self._api.send_message(
+            chat_id=greeting_message.chat.id,
+            text=f'*{kick_text}*',
+            reply_to_message_id=greeting_message.message_id,
+            parse_mode=TelegramParseMode.MARKDOWN
+        )
+        try:
+            await self._kick_chat_member(
+                chat_id=greeting_message.chat.id,
+                user_id=user.id,
+                until_date=kick_message.date + BanDuration.AUTO_KICK_DURATION_SECONDS,
+            )
+            self._logger.info('Chat member was kicked due greeting timeout', extra=log_fields(
+                chat_id=greeting_message.chat.id, user_id=user.id, username=user.username,
+            ))
+        except ApiException:
+            self._logger.error('Can not kick chat member', extra=log_fields(
+                chat_id=greeting_message.chat.id, user_id=user.id, username=user.username,
+            ))
+            await self.delete_chat_message(kick_message)
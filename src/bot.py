@@ -0,0 +1,165 @@
+import json
+import time
+from functools import partial
+from concurrent.futures import Future
+from typing import Callable, Hashable, List, Optional
+
+from telebot import TeleBot, apihelper
+from telebot.types import Update, Message, CallbackQuery
+
+from capture import UpdateRecorder
+from const import TelegramUpdateType, OutboundSettings, MemberCacheSettings, HandlerSettings
+from dispatcher import OutboundDispatcher
+from dto import ChatMemberUpdateDto
+from handler_pool import KeyedThreadPool
+from member_cache import MemberCache
+from tracing import current_trace
+
+
+class RudeBot(TeleBot):
+    """
+    TeleBot with chat member updates support and prioritized outbound calls
+
+    Locked pyTelegramBotAPI version drops chat_member/my_chat_member updates while parsing,
+    so they are extracted from raw json here and passed to chat_member_handler callbacks.
+    With a dispatcher set, moderation, notification and cleanup calls go through its priority queue.
+    Handlers wait only for moderation results, throttled notifications and cleanups are enqueued with done callbacks.
+    With a recorder set, received raw updates are captured for replays.
+    With a member cache set, chat_member updates and successful restrict and kick calls are tracked in it.
+    Threaded handlers run in a KeyedThreadPool: updates of one chat member in order, different members concurrently.
+    """
+    dispatcher: OutboundDispatcher = None
+    recorder: UpdateRecorder = None
+    member_cache: MemberCache = None
+    startup_listener: Callable = None  # Called once before the first getUpdates request
+
+    def __init__(self, token: str, allowed_updates: List[str] = None, threaded: bool = True,
+                 num_threads: int = HandlerSettings.WORKER_COUNT, **kwargs):
+        super().__init__(token, threaded=False, **kwargs)  # No telebot ThreadPool to replace
+        self.threaded = threaded
+        if threaded:
+            self.worker_pool = KeyedThreadPool(num_threads)
+        self.allowed_updates = allowed_updates or TelegramUpdateType.ALLOWED
+        self.chat_member_handlers = []
+
+    @staticmethod
+    def update_key(update_object) -> Optional[Hashable]:
+        """(chat_id, user_id) of a handler argument"""
+        if isinstance(update_object, Message) and update_object.from_user is not None:
+            return update_object.chat.id, update_object.from_user.id
+        if isinstance(update_object, CallbackQuery) and update_object.message is not None:
+            return update_object.message.chat.id, update_object.from_user.id
+        if isinstance(update_object, ChatMemberUpdateDto):
+            return update_object.chat_id, update_object.user_id
+        return None
+
+    def _exec_task(self, task, *args, **kwargs):
+        if self.threaded:
+            self.worker_pool.submit(self.update_key(args[0]) if args else None, task, *args, **kwargs)
+        else:
+            task(*args, **kwargs)
+
+    def submit(self, handler: Callable, update_object, *args):
+        """Run a handler outside of telebot's dispatch, in order with handlers of the same chat member"""
+        self._exec_task(handler, update_object, *args)
+
+    def enqueue(self, method_name: str, *args, **kwargs) -> Future:
+        """Fire-and-forget API call, e.g. enqueue('delete_message', chat_id, message_id)"""
+        call = getattr(TeleBot, method_name)
+        if self.dispatcher is None:
+            future = Future()
+            try:
+                future.set_result(call(self, *args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            chat_id = kwargs['chat_id'] if 'chat_id' in kwargs else args[0]
+            priority = OutboundSettings.METHOD_PRIORITY[method_name]
+            future = self.dispatcher.submit(priority, chat_id, call, self, *args, **kwargs)
+        if self.member_cache is not None and method_name in MemberCacheSettings.TRACKED_METHODS:
+            future.add_done_callback(partial(self.member_cache.record_call, method_name, args, kwargs))
+        return future
+
+    def _dispatch(self, method_name: str, *args, **kwargs):
+        trace = current_trace()
+        if trace is None:
+            return self.enqueue(method_name, *args, **kwargs).result()
+        started = time.perf_counter()
+        try:
+            return self.enqueue(method_name, *args, **kwargs).result()
+        finally:  # Outbound queue wait included, the call itself is made by a dispatcher thread
+            trace.add(f'bot.{method_name}', started, time.perf_counter())
+
+    def send_message(self, *args, **kwargs):
+        return self._dispatch('send_message', *args, **kwargs)
+
+    def restrict_chat_member(self, *args, **kwargs):
+        return self._dispatch('restrict_chat_member', *args, **kwargs)
+
+    def kick_chat_member(self, *args, **kwargs):
+        return self._dispatch('kick_chat_member', *args, **kwargs)
+
+    def delete_message(self, *args, **kwargs):
+        return self._dispatch('delete_message', *args, **kwargs)
+
+    def edit_message_reply_markup(self, *args, **kwargs):
+        return self._dispatch('edit_message_reply_markup', *args, **kwargs)
+
+    def chat_member_handler(self, handler):
+        self.chat_member_handlers.append(handler)
+        return handler
+
+    def set_webhook_with_secret(self, url: str, secret_token: str):
+        """setWebhook with secret_token, which is not supported by locked pyTelegramBotAPI version"""
+        return apihelper._make_request(self.token, 'setWebhook', method='post', params={
+            'url': url,
+            'secret_token': secret_token,
+            'allowed_updates': json.dumps(self.allowed_updates),
+        })
+
+    def get_updates(self, offset=None, limit=None, timeout=20, allowed_updates=None):
+        if self.startup_listener is not None:
+            listener, self.startup_listener = self.startup_listener, None
+            listener()
+        return self.de_json_updates(self.get_json_updates(offset, limit, timeout, allowed_updates))
+
+    def get_json_updates(self, offset=None, limit=None, timeout=20, allowed_updates=None) -> list:
+        """Raw getUpdates result, for passing updates on without parsing them"""
+        json_updates = apihelper.get_updates(self.token, offset, limit, timeout, allowed_updates or self.allowed_updates)
+        if self.recorder is not None and not (offset and offset < 0):  # Skipped pending updates are not handled
+            self.recorder.record(json_updates)
+        return json_updates
+
+    @staticmethod
+    def de_json_updates(json_updates: list) -> List[Update]:
+        result = []
+        for json_update in json_updates:
+            update = Update.de_json(json_update)
+            update.chat_member_update = None
+            for update_type in TelegramUpdateType.CHAT_MEMBER, TelegramUpdateType.MY_CHAT_MEMBER:
+                if update_type in json_update:
+                    update.chat_member_update = ChatMemberUpdateDto.de_json(json_update[update_type])
+            for update_object in update.message, update.callback_query, update.chat_member_update:
+                if update_object is not None:
+                    update_object.update_id = update.update_id  # Handlers get objects, traces are by update
+            result.append(update)
+        return result
+
+    def drain(self, timeout: float, poll_interval: float):
+        """Wait until handlers of received updates are done and stop handler threads"""
+        if self.threaded:
+            deadline = time.monotonic() + timeout
+            while self.worker_pool.pending and time.monotonic() < deadline:
+                time.sleep(poll_interval)
+            self.stop_bot()
+
+    def process_new_updates(self, updates: List[Update]):
+        for update in updates:
+            member_update = getattr(update, 'chat_member_update', None)
+            if member_update is None:
+                continue
+            if self.member_cache is not None:  # Before handlers, so joins of the same batch find the state
+                self.member_cache.process_member_update(member_update)
+            for handler in self.chat_member_handlers:
+                self._exec_task(handler, member_update)
+        super().process_new_updates(updates)
@@ -0,0 +1,52 @@
+import gzip
+import json
+import threading
+import zlib
+from pathlib import Path
+from typing import Iterator, Tuple
+
+from clock import Clock
+
+
+class UpdateRecorder:
+    """
+    Raw update capture for replays
+
+    Every received update is appended to a gzip compressed JSONL file as {"time": receive time, "update": {...}}.
+    The stream is flushed after every batch, so the file of a killed process is readable up to the last batch.
+    """
+
+    def __init__(self, file_path: Path, clock: Clock = None):
+        self._clock = clock or Clock()
+        self._lock = threading.Lock()
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = gzip.open(str(file_path), 'ab')
+
+    def record(self, json_updates: list):
+        if not json_updates:
+            return
+        received_at = self._clock.time()
+        lines = ''.join(
+            json.dumps(dict(time=received_at, update=json_update), ensure_ascii=False) + '\n'
+            for json_update in json_updates
+        ).encode('utf8')
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(lines)
+            self._file.flush(zlib.Z_SYNC_FLUSH)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    @staticmethod
+    def read(file_path: Path) -> Iterator[Tuple[float, dict]]:
+        """Receive time and update of every captured update, in capture order"""
+        with gzip.open(str(file_path), 'rt', encoding='utf8') as file:
+            try:
+                for line in file:
+                    record = json.loads(line)
+                    yield record['time'], record['update']
+            except EOFError:  # Not closed by a killed process, flushed batches are complete
+                return
@@ -0,0 +1,76 @@
+import threading
+import time
+import weakref
+from typing import Optional
+
+from const import ReplaySettings
+
+
+class Clock:
+    """Wall and monotonic time of the bot, replays use VirtualClock instead"""
+
+    def time(self) -> float:
+        return time.time()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+    def wait(self, condition: threading.Condition, timeout: Optional[float]):
+        """condition.wait() for timeout seconds of this clock, the condition must be held"""
+        condition.wait(timeout)
+
+
+class VirtualClock(Clock):
+    """
+    Replay time starting at start epoch seconds
+
+    With speed, virtual time runs speed times faster than real time. Without speed it stands still
+    and is moved only by advance_to(), which wakes up wait() callers, so timers fire in virtual time.
+    """
+
+    def __init__(self, start: float, speed: float = None):
+        self._start = start
+        self._speed = speed
+        self._origin = time.monotonic()
+        self._offset = 0.0
+        self._lock = threading.Lock()
+        self._conditions = weakref.WeakSet()
+
+    @property
+    def speed(self) -> Optional[float]:
+        return self._speed
+
+    def time(self) -> float:
+        return self._start + self.monotonic()
+
+    def monotonic(self) -> float:
+        if self._speed:
+            return self._offset + (time.monotonic() - self._origin) * self._speed
+        return self._offset
+
+    def sleep(self, seconds: float):
+        if self._speed:
+            time.sleep(max(seconds, 0) / self._speed)
+        else:
+            self.advance_to(self.time() + seconds)
+
+    def wait(self, condition: threading.Condition, timeout: Optional[float]):
+        with self._lock:
+            self._conditions.add(condition)
+        # Bounded, so a waiter which checked time right before advance_to() is late by one interval at most
+        real_timeout = ReplaySettings.CLOCK_WAKE_INTERVAL
+        if timeout is not None and self._speed:
+            real_timeout = min(timeout / self._speed, real_timeout)
+        condition.wait(real_timeout)
+
+    def advance_to(self, epoch: float):
+        """Move virtual time forward to epoch seconds, earlier epochs are ignored"""
+        with self._lock:
+            self._offset += max(epoch - self.time(), 0)
+            conditions = list(self._conditions)
+        for condition in conditions:
+            with condition:
+                condition.notify_all()
@@ -0,0 +1,30 @@
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+from const import GreetingDefaultSettings, LoggingSettings
+from error import GreetingsLoadError
+from greeting import QuestionLoader
+
+logging.basicConfig(
+    format=LoggingSettings.RECORD_FORMAT,
+    datefmt=LoggingSettings.DATE_FORMAT,
+    level=logging.INFO,
+)
+logger = logging.getLogger()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Validate greeting questions and write compiled snapshot')
+    parser.add_argument('source', nargs='?', type=Path, default=GreetingDefaultSettings.GREETING_QUESTIONS_FILE)
+    parser.add_argument('--output', type=Path, default=None, help='snapshot path, next to source by default')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    try:
+        count = QuestionLoader.compile_file(args.source, args.output)
+    except GreetingsLoadError as gle:
+        logger.error(f'Can not compile greeting questions: {gle}')
+        sys.exit(1)
+    logger.info(f'Compiled {count} questions from {args.source} in {time.perf_counter() - started:.2f}s')
@@ -1,3 +1,4 @@
+import re
 from pathlib import Path
 
 from dto import PluralFormsDto, DurationDto, CommandDto
@@ -7,6 +8,21 @@ class TelegramChatType:
     SUPER_GROUP = 'supergroup'
 
 
+class TelegramUpdateType:
+    MESSAGE = 'message'
+    CALLBACK_QUERY = 'callback_query'
+    CHAT_MEMBER = 'chat_member'
+    MY_CHAT_MEMBER = 'my_chat_member'
+
+    ALLOWED = [MESSAGE, CALLBACK_QUERY, CHAT_MEMBER, MY_CHAT_MEMBER]
+    CHAT_UPDATES = [MESSAGE, CHAT_MEMBER, MY_CHAT_MEMBER]  # Update objects with chat field
+
+
+class RouterSettings:
+    COMMAND_PREFIXES = frozenset('!/')
+    BOT_NAME_SEPARATOR = '@'  # /ping@rude_qa_bot
+
+
 class TelegramParseMode:
     MARKDOWN = 'Markdown'
     HTML = 'HTML'
@@ -20,27 +36,55 @@ class TelegramMemberStatus:
     LEFT = 'left'
     KICKED = 'kicked'
 
+    ADMINS = frozenset([CREATOR, ADMINISTRATOR])
+
 
 class LoggingSettings:
     RECORD_FORMAT = '%(asctime)s %(levelname)s %(message)s'
+    WORKER_RECORD_FORMAT = '%(asctime)s %(levelname)s [%(processName)s] %(message)s'
     DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
     DEFAULT_LEVEL = 'INFO'
+    FORMAT_JSON = 'json'
+    FORMAT_TEXT = 'text'
+    DEFAULT_FORMAT = FORMAT_JSON
+    QUEUE_SIZE = 10000  # Records waiting for the writer thread, more are dropped
+    RATE_LIMIT_BURST = 10  # Warnings and errors per message template and interval
+    RATE_LIMIT_INTERVAL = 60
+    RATE_LIMIT_MAX_KEYS = 1000
 
 
 class EnvVar:
     TELEGRAM_TOKEN = 'TELEGRAM_TOKEN'
     TELEGRAM_CHAT_ID = 'TELEGRAM_CHAT_ID'
     LOGGING_LEVEL = 'LOGGING_LEVEL'
+    LOG_FORMAT = 'LOG_FORMAT'
+    ADMIN_CACHE_TTL = 'ADMIN_CACHE_TTL'
+    STATE_FILE = 'STATE_FILE'
+    WEBHOOK_URL = 'WEBHOOK_URL'
+    WEBHOOK_SECRET = 'WEBHOOK_SECRET'
+    WEBHOOK_PORT = 'WEBHOOK_PORT'
+    CHATS_FILE = 'CHATS_FILE'
+    METRICS_PORT = 'METRICS_PORT'
+    TRACE_FILE = 'TRACE_FILE'
+    TRACE_SAMPLE_RATE = 'TRACE_SAMPLE_RATE'
+    HANDLER_BUDGET = 'HANDLER_BUDGET'
+    CAPTURE_FILE = 'CAPTURE_FILE'
+    HANDLER_WORKERS = 'HANDLER_WORKERS'
 
 
 class Command:
-    RO = CommandDto(bot_command='!ro', text_command='read_only')
-    TO = CommandDto(bot_command='!to', text_command='text_only')
-    RW = CommandDto(bot_command='!rw', text_command='read_write')
-    BAN = CommandDto(bot_command='!ban', text_command='ban_kick')
-    PASS = CommandDto(bot_command='!pass', text_command='pass')
+    RO = CommandDto(bot_command='!ro', text_command='read_only', aliases=('/ro',))
+    TO = CommandDto(bot_command='!to', text_command='text_only', aliases=('/to',))
+    RW = CommandDto(bot_command='!rw', text_command='read_write', aliases=('/rw',), takes_arguments=False)
+    BAN = CommandDto(bot_command='!ban', text_command='ban_kick', aliases=('/ban',))
+    PASS = CommandDto(bot_command='!pass', text_command='pass', aliases=('/pass',), takes_arguments=False)
+    PING = CommandDto(bot_command='/ping', text_command='ping')
+    ID = CommandDto(bot_command='/id', text_command='id')
+    VER = CommandDto(bot_command='/ver', text_command='version')
+    ME = CommandDto(bot_command='/me', text_command='me')
     TK = CommandDto(bot_command='', text_command='timeout_kick')
     SR = CommandDto(bot_command='', text_command='unauthorized_punishment')  # Self restrict
+    RAID = CommandDto(bot_command='', text_command='raid_restrict')
 
 
 class BaseDuration:
@@ -64,6 +108,14 @@ class BaseDuration:
     )
 
 
+class DurationSettings:
+    CACHE_SIZE = 1024
+    # One term of compound duration: amount with optional unit, terms may be separated by whitespace
+    TERM_PATTERN = re.compile(r'(\d+)([{}]?)\s*'.format(''.join(BaseDuration.UNITS)))
+    # Sign of the whole duration, only before the first term
+    SIGNS = {'+': 1, '-': -1}
+
+
 class PunishmentDuration(BaseDuration):
     DURATION = DurationDto(300, '5 минут')
 
@@ -92,6 +144,209 @@ class MessageSettings:
     SELF_DESTRUCT_TIMEOUT = 5
 
 
+class StartupSettings:
+    REPORT_LIMIT = 15  # slowest imports and components in startup profile
+
+
+class SchedulerSettings:
+    WORKER_COUNT = 4
+    COMPACT_MIN_CANCELLED = 1024
+
+
+class HandlerSettings:
+    WORKER_COUNT = 8  # Updates of one chat member run in order, members are handled concurrently
+
+
+class ScheduledTaskKey:
+    TIMEOUT_KICK = 'timeout_kick'
+    RESTORE = 'restore'
+    ADMIN_REFRESH = 'admin_refresh'
+    RAID_BATCH = 'raid_batch'
+    QUESTIONS_RELOAD = 'questions_reload'
+    EVICTION = 'eviction'
+
+
+class RaidSettings:
+    JOIN_THRESHOLD = 10  # joins per window
+    WINDOW = 60
+    COOLDOWN = 300
+    BATCH_WINDOW = 5  # Raid joiners are announced by one message per batch window
+    MAX_MENTIONS = 30
+    DURATION = DurationDto(86400, '1 день')  # Raid restrictions end by themselves if admins do not lift them earlier
+
+
+class FloodSettings:
+    MESSAGES = 'messages'
+    MEDIA = 'media'
+    WINDOWS = ((5, 1), (60, 5), (600, 60))  # (window, bucket) seconds, counts expire bucket by bucket
+    THRESHOLDS = {  # Messages per window by content type, more is flood
+        MESSAGES: (8, 30, 150),
+        MEDIA: (4, 12, 50),
+    }
+    MEDIA_CONTENT_TYPES = frozenset([
+        'animation', 'audio', 'document', 'photo', 'sticker', 'video', 'video_note', 'voice',
+    ])
+    CONTENT_TYPES = MEDIA_CONTENT_TYPES | frozenset(['text', 'contact', 'location', 'venue', 'poll', 'game'])
+    DURATION = DurationDto(600, '10 минут')
+    MAX_USERS = 100000  # Users counted per chat, the least recently active are dropped over it
+
+
+class RunMode:
+    POLLING = 'polling'
+    WEBHOOK = 'webhook'
+    ASYNC = 'async'
+
+
+class AsyncSettings:
+    POOL_SIZE = 100
+    REQUEST_TIMEOUT = 30
+    POLLING_TIMEOUT = 20
+    ERROR_INTERVAL = 1
+
+
+class WorkerSettings:
+    START_METHOD = 'spawn'  # Workers do not inherit supervisor threads and sockets
+    POLLING_TIMEOUT = 20
+    ERROR_INTERVAL = 1
+    STOP_TIMEOUT = 30
+
+
+class MetricsSettings:
+    DEFAULT_HOST = '0.0.0.0'
+    DEFAULT_PORT = 9100
+    PATH = '/metrics'
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    HANDLER_LATENCY = 'bot_handler_seconds'
+    API_LATENCY = 'bot_api_request_seconds'
+    API_ERRORS = 'bot_api_errors_total'
+    SCHEDULER_LAG = 'bot_scheduled_task_lag_seconds'
+    JOIN_TO_QUESTION = 'bot_join_to_question_seconds'
+    JOIN_TO_RESTRICT = 'bot_raid_join_to_restrict_seconds'
+    NEWBIES = 'bot_newbies'
+    RESTRICTIONS = 'bot_restrictions'
+    THREADS = 'bot_threads'
+    MEMBER_CACHE_LOOKUPS = 'bot_member_cache_lookups_total'
+    ADMIN_CACHE_LOOKUPS = 'bot_admin_cache_lookups_total'
+    OUTBOUND_DEPTH = 'bot_outbound_queue_depth'
+    OUTBOUND_SENT = 'bot_outbound_sent_total'
+    OUTBOUND_WAIT_AVG = 'bot_outbound_wait_avg_seconds'
+    OUTBOUND_WAIT_MAX = 'bot_outbound_wait_max_seconds'
+    OUTBOUND_RETRIES = 'bot_outbound_retries_total'
+    TRANSPORT_REQUESTS = 'bot_api_transport_requests_total'
+    TRANSPORT_CONNECTIONS = 'bot_api_transport_connections_total'
+
+    # Name: (type, label names, description)
+    METRICS = {
+        HANDLER_LATENCY: ('histogram', ('handler',), 'Update handler duration'),
+        API_LATENCY: ('histogram', ('method',), 'Telegram API request duration'),
+        API_ERRORS: ('counter', ('method', 'code'), 'Failed Telegram API requests by error code'),
+        SCHEDULER_LAG: ('histogram', ('task',), 'Scheduled task start delay after its due time'),
+        JOIN_TO_QUESTION: ('histogram', (), 'Time from join message to greeting question'),
+        JOIN_TO_RESTRICT: ('histogram', (), 'Time from join message to raid mode restriction'),
+        NEWBIES: ('gauge', ('chat_id',), 'Newbies waiting for greeting answer'),
+        RESTRICTIONS: ('gauge', ('chat_id',), 'Restrictions waiting to be restored'),
+        THREADS: ('gauge', (), 'Live threads'),
+        MEMBER_CACHE_LOOKUPS: ('counter', ('result',), 'Chat member state lookups by cache hit or miss'),
+        ADMIN_CACHE_LOOKUPS: ('counter', ('result',), 'Chat administrator list lookups by cache hit or miss'),
+        OUTBOUND_DEPTH: ('gauge', ('priority',), 'Outbound API calls waiting in the dispatcher queue'),
+        OUTBOUND_SENT: ('counter', ('priority',), 'Outbound API calls taken from the dispatcher queue'),
+        OUTBOUND_WAIT_AVG: ('gauge', ('priority',), 'Average outbound API call wait in the dispatcher queue'),
+        OUTBOUND_WAIT_MAX: ('gauge', ('priority',), 'Longest outbound API call wait in the dispatcher queue'),
+        OUTBOUND_RETRIES: ('counter', (), 'Outbound API calls retried after 429 responses'),
+        TRANSPORT_REQUESTS: ('counter', (), 'Telegram API requests sent through the keep-alive pool'),
+        TRANSPORT_CONNECTIONS: ('counter', (), 'Connections opened by the keep-alive pool, the rest reuse them'),
+    }
+
+
+class TracingSettings:
+    DEFAULT_SAMPLE_RATE = 0.01
+    DEFAULT_BUDGET = 5  # Seconds of handler run time before its stack is logged
+    MIN_WATCHDOG_INTERVAL = 0.05
+    MAX_BYTES = 10 * 1024 * 1024
+    BACKUP_COUNT = 3
+
+
+class ReplaySettings:
+    CLOCK_WAKE_INTERVAL = 0.05  # Real seconds, virtual clock waiters re-check time at least this often
+    IDLE_TIMEOUT = 30  # Real seconds to wait for handlers and due timers before the next update
+    DEFAULT_TAIL = 60 * 60  # Virtual seconds after the last update, pending kicks and restores fire within
+    TOKEN = '0:replay'  # Placeholder TELEGRAM_TOKEN, replays never reach the Bot API
+
+
+class WebhookSettings:
+    DEFAULT_HOST = '0.0.0.0'
+    DEFAULT_PORT = 8443
+    SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+    DRAIN_TIMEOUT = 30
+    DRAIN_POLL_INTERVAL = 0.1
+
+
+class OutboundPriority:
+    MODERATION = 0
+    NOTIFICATION = 1
+    CLEANUP = 2
+
+    ALL = [MODERATION, NOTIFICATION, CLEANUP]
+    NAMES = {MODERATION: 'moderation', NOTIFICATION: 'notification', CLEANUP: 'cleanup'}
+
+
+class OutboundSettings:
+    WORKER_COUNT = 8
+    MAX_ATTEMPTS = 5
+
+    GLOBAL_RATE = 30  # messages per second
+    GLOBAL_BURST = 30
+    CHAT_RATE = 20 / 60  # messages per second in one group
+    CHAT_BURST = 20
+
+    METHOD_PRIORITY = dict(
+        restrict_chat_member=OutboundPriority.MODERATION,
+        kick_chat_member=OutboundPriority.MODERATION,
+        send_message=OutboundPriority.NOTIFICATION,
+        edit_message_reply_markup=OutboundPriority.NOTIFICATION,
+        delete_message=OutboundPriority.CLEANUP,
+    )
+
+
+class TransportSettings:
+    DEFAULT_POOL_SIZE = 16
+    COMMAND_CONNECT_TIMEOUT = 3.5
+    COMMAND_READ_TIMEOUT = 15
+    LONG_POLL_CONNECT_TIMEOUT = 10
+    LONG_POLL_READ_EXTRA = 10  # Added to getUpdates timeout
+
+
+class StateSettings:
+    MAX_NEWBIES = 100000  # Per chat, newbies over it are not greeted until expired ones are evicted
+    MAX_RESTRICTIONS = 100000  # Per chat, custom restrictions over it are not restored
+    EXPIRY_GRACE = 60 * 60  # Seconds records outlive their deadline, so late kicks and restores still find them
+    EVICTION_INTERVAL = 5 * 60
+    COMPACT_MIN_STALE = 1024  # Stale expiry entries kept before the expiry heap is rebuilt
+
+
+class PersistenceSettings:
+    DEFAULT_STATE_FILE = 'data/state.sqlite3'
+    BATCH_SIZE = 512
+    BUSY_TIMEOUT = 10  # Seconds to wait for a write lock held by another worker process
+
+
+class AdminCacheSettings:
+    DEFAULT_TTL = 600
+    REFRESH_RATIO = 0.8  # Background refresh starts at this share of TTL
+    RETRY_MIN_PAUSE = 5  # Failed background refresh is retried with doubling pauses up to the max one
+    RETRY_MAX_PAUSE = 300
+
+
+class MemberCacheSettings:
+    TRACKED_TTL = 3600  # States from chat_member updates and own calls, the updates keep them current
+    FALLBACK_TTL = 30  # States read with getChatMember
+    RESTRICTED_TTL = 7 * 24 * 3600  # Known restricted and kicked members, at most until the restriction ends
+    MAX_ENTRIES = 100000
+    TRACKED_METHODS = frozenset(['restrict_chat_member', 'kick_chat_member'])
+
+
 class NotificationTemplateList:
     READ_ONLY = [
         '{first_name} помещен в read-only на {duration_text}.',
@@ -121,6 +376,10 @@ class NotificationTemplateList:
         '{first_name} идёт нахуй из чата {duration_text}.',
     ]
 
+    RAID_RESTRICT = [
+        '*Похоже на рейд. {mentions} посидят в read-only {duration_text}, если админы не снимут ограничение раньше.*',
+    ]
+
     UNAUTHORIZED_PUNISHMENT = [
         '{first_name} нажал не те кнопки и получает пизды в виде read-only.',
         '{first_name} дохуя о себе думает, поэтому теперь завалит ебало.',
@@ -133,3 +392,6 @@ class GreetingDefaultSettings:
     DEFAULT_QUESTION_OPTION = 'Yep'
     DEFAULT_QUESTION_REPLY = 'Sure!'
     DEFAULT_QUESTION_TIMEOUT = 120
+    RELOAD_INTERVAL = 5  # questions file mtime polling
+    SNAPSHOT_SUFFIX = '.snapshot'
+    SNAPSHOT_VERSION = 1
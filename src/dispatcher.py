@@ -0,0 +1,215 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from telebot.apihelper import ApiException
+
+from const import OutboundSettings, OutboundPriority
+from logs import log_fields
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at', 'blocked_until')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def acquire(self, now: float) -> float:
+        """Take one token. Returns 0 on success or seconds to wait until a token is available"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def block(self, until: float):
+        self.blocked_until = max(self.blocked_until, until)
+
+
+class OutboundTask:
+    __slots__ = ('priority', 'seq', 'chat_id', 'call', 'args', 'kwargs', 'future', 'submitted_at', 'attempts')
+
+    def __init__(self, priority: int, seq: int, chat_id, call: Callable, args: tuple, kwargs: dict):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.call = call
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.submitted_at = time.monotonic()
+        self.attempts = 0
+
+    def __lt__(self, other: 'OutboundTask') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundDispatcher:
+    """
+    Central priority queue for outbound Telegram API calls
+
+    Moderation calls (restrict, kick) go first and bypass rate limits, notification texts come next and are limited
+    by global and per-chat token buckets, self-destruct deletes are last and limited globally.
+    429 responses are retried after retry_after seconds instead of being lost.
+    The global limit is per bot, so worker processes of one bot split it evenly.
+    """
+    _ready: List[OutboundTask]
+    _deferred: List[tuple]
+    _chat_buckets: Dict[int, TokenBucket]
+
+    def __init__(self, logger: logging.Logger, workers: int = OutboundSettings.WORKER_COUNT, rate_limits: bool = True,
+                 processes: int = 1):
+        self._logger = logger
+        self._rate_limits = rate_limits  # Off for stub APIs, e.g. in replays
+        self._ready = []
+        self._deferred = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='outbound')
+        self._global_bucket = TokenBucket(
+            OutboundSettings.GLOBAL_RATE / processes, max(OutboundSettings.GLOBAL_BURST / processes, 1),
+        )
+        self._chat_buckets = dict()
+        self._depth = {_: 0 for _ in OutboundPriority.ALL}
+        self._sent = {_: 0 for _ in OutboundPriority.ALL}
+        self._wait_total = {_: 0.0 for _ in OutboundPriority.ALL}
+        self._wait_max = {_: 0.0 for _ in OutboundPriority.ALL}
+        self._retries = 0
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='outbound-dispatcher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def submit(self, priority: int, target_chat_id, call: Callable, *args, **kwargs) -> Future:
+        """target_chat_id selects the chat rate limit, call kwargs may have their own chat_id"""
+        task = OutboundTask(priority, next(self._counter), target_chat_id, call, args, kwargs)
+        with self._condition:
+            heapq.heappush(self._ready, task)
+            self._depth[priority] += 1
+            self._condition.notify()
+        return task.future
+
+    def call(self, priority: int, target_chat_id, call: Callable, *args, **kwargs):
+        """Submit the call and wait for its result. ApiException is raised if all attempts failed"""
+        return self.submit(priority, target_chat_id, call, *args, **kwargs).result()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return dict(
+                depth=dict(self._depth),
+                sent=dict(self._sent),
+                wait_avg={_: self._wait_total[_] / self._sent[_] if self._sent[_] else 0.0 for _ in self._sent},
+                wait_max=dict(self._wait_max),
+                retries=self._retries,
+            )
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(OutboundSettings.CHAT_RATE, OutboundSettings.CHAT_BURST)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _acquire(self, task: OutboundTask, now: float) -> float:
+        if task.priority == OutboundPriority.MODERATION or not self._rate_limits:
+            return 0
+        if task.priority == OutboundPriority.NOTIFICATION:
+            chat_wait = self._chat_bucket(task.chat_id).acquire(now)
+            if chat_wait:
+                return chat_wait
+        global_wait = self._global_bucket.acquire(now)
+        if global_wait and task.priority == OutboundPriority.NOTIFICATION:
+            self._chat_bucket(task.chat_id).tokens += 1  # Give back chat token
+        return global_wait
+
+    def _next_task(self) -> Optional[OutboundTask]:
+        """Pick the most important task allowed by rate limits. Must be called with condition held"""
+        while self._running:
+            now = time.monotonic()
+            while self._deferred and self._deferred[0][0] <= now:
+                heapq.heappush(self._ready, heapq.heappop(self._deferred)[2])
+
+            while self._ready:
+                task = heapq.heappop(self._ready)
+                wait = self._acquire(task, now)
+                if not wait:
+                    return task
+                heapq.heappush(self._deferred, (now + wait, task.seq, task))
+
+            self._condition.wait(self._deferred[0][0] - now if self._deferred else None)
+        return None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                task = self._next_task()
+                if task is None:
+                    return
+                wait = time.monotonic() - task.submitted_at
+                self._depth[task.priority] -= 1
+                self._sent[task.priority] += 1
+                self._wait_total[task.priority] += wait
+                self._wait_max[task.priority] = max(self._wait_max[task.priority], wait)
+            self._executor.submit(self._execute, task)
+
+    def _execute(self, task: OutboundTask):
+        task.attempts += 1
+        try:
+            task.future.set_result(task.call(*task.args, **task.kwargs))
+        except ApiException as e:
+            retry_after = self.get_retry_after(e)
+            if retry_after is None or task.attempts >= OutboundSettings.MAX_ATTEMPTS:
+                self._logger.error('Outbound call failed', extra=log_fields(
+                    call=task.call.__name__, chat_id=task.chat_id, error=e,
+                ))
+                task.future.set_exception(e)
+                return
+            self._logger.warning('Flood limit hit', extra=log_fields(
+                call=task.call.__name__, chat_id=task.chat_id, retry_after=retry_after,
+            ))
+            with self._condition:
+                ready_at = time.monotonic() + retry_after
+                self._chat_bucket(task.chat_id).block(ready_at)
+                heapq.heappush(self._deferred, (ready_at, task.seq, task))
+                self._depth[task.priority] += 1
+                self._retries += 1
+                self._condition.notify()
+        except Exception as e:
+            task.future.set_exception(e)
+
+    @staticmethod
+    def get_retry_after(e: ApiException) -> Optional[int]:
+        result = e.result
+        try:
+            if not isinstance(result, dict):
+                if result is None or result.status_code != 429:
+                    return None
+                result = result.json()
+            return int(result['parameters']['retry_after'])
+        except (ValueError, KeyError, TypeError):
+            return None
@@ -1,6 +1,7 @@
-from typing import Dict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
 
-from telebot.types import ReplyKeyboardMarkup, User, Message
+from telebot.types import ReplyKeyboardMarkup, User, Message, ChatMember
 
 
 class DurationDto:
@@ -46,12 +47,17 @@ class PluralFormsDto:
 class GreetingQuestionDto:
     _text: str
     _keyboard: ReplyKeyboardMarkup
+    _keyboard_json: str
     _timeout: int
     _reply: Dict[str, str]
 
-    def __init__(self, text: str, keyboard: ReplyKeyboardMarkup, timeout: int, reply: Dict[str, str]):
+    def __init__(self, text: str, keyboard: ReplyKeyboardMarkup, timeout: int, reply: Dict[str, str],
+                 keyboard_json: str = None):
         self._text = text
         self._keyboard = keyboard
+        if keyboard_json is None and keyboard is not None:
+            keyboard_json = keyboard.to_json()  # Serialized once per question
+        self._keyboard_json = keyboard_json
         self._timeout = timeout
         self._reply = reply
 
@@ -63,6 +69,10 @@ class GreetingQuestionDto:
     def keyboard(self) -> ReplyKeyboardMarkup:
         return self._keyboard
 
+    @property
+    def keyboard_json(self) -> str:
+        return self._keyboard_json
+
     @property
     def timeout(self) -> int:
         return self._timeout
@@ -72,20 +82,90 @@ class GreetingQuestionDto:
         return self._reply
 
 
+class UserDto:
+    """Ids and names of a telebot User, all that tracked newbies and restrictions need"""
+    __slots__ = ('_id', '_first_name', '_username')
+
+    def __init__(self, user_id: int, first_name: str, username: Optional[str] = None):
+        self._id = user_id
+        self._first_name = first_name
+        self._username = username
+
+    @classmethod
+    def of(cls, user: Union[User, 'UserDto']) -> 'UserDto':
+        if isinstance(user, cls):
+            return user
+        return cls(user.id, user.first_name, user.username)
+
+    @property
+    def id(self) -> int:
+        return self._id
+
+    @property
+    def first_name(self) -> str:
+        return self._first_name
+
+    @property
+    def username(self) -> Optional[str]:
+        return self._username
+
+
+class ChatDto:
+    __slots__ = ('_id',)
+
+    def __init__(self, chat_id: int):
+        self._id = chat_id
+
+    @property
+    def id(self) -> int:
+        return self._id
+
+
+class MessageDto:
+    """Ids and date of a telebot Message, passes for it in delete and edit calls"""
+    __slots__ = ('_chat_id', '_message_id', '_date')
+
+    def __init__(self, chat_id: int, message_id: int, date: int):
+        self._chat_id = chat_id
+        self._message_id = message_id
+        self._date = date
+
+    @classmethod
+    def of(cls, message: Union[Message, 'MessageDto']) -> 'MessageDto':
+        if isinstance(message, cls):
+            return message
+        return cls(message.chat.id, message.message_id, message.date)
+
+    @property
+    def chat(self) -> ChatDto:
+        return ChatDto(self._chat_id)
+
+    @property
+    def message_id(self) -> int:
+        return self._message_id
+
+    @property
+    def date(self) -> int:
+        return self._date
+
+
 class NewbieDto:
-    _user: User
+    """Pending newbie, telebot objects are kept as compact UserDto and MessageDto"""
+    __slots__ = ('_user', '_timeout', '_question', '_greeting')
+    _user: UserDto
     _timeout: int
     _question: GreetingQuestionDto
-    _greeting: Message
+    _greeting: Optional[MessageDto]
 
-    def __init__(self, user: User, timeout: int, question: GreetingQuestionDto, greeting: Message = None):
-        self._user = user
+    def __init__(self, user: Union[User, UserDto], timeout: int, question: GreetingQuestionDto,
+                 greeting: Union[Message, MessageDto] = None):
+        self._user = UserDto.of(user)
         self._timeout = timeout
         self._question = question
-        self._greeting = greeting
+        self._greeting = MessageDto.of(greeting) if greeting is not None else None
 
     @property
-    def user(self) -> User:
+    def user(self) -> UserDto:
         return self._user
 
     @property
@@ -97,11 +177,12 @@ class NewbieDto:
         return self._question
 
     @property
-    def greeting(self) -> Message:
+    def greeting(self) -> Optional[MessageDto]:
         return self._greeting
 
 
 class RestrictionDto:
+    __slots__ = ('_messages', '_media', '_other', '_web_preview')
     _messages: bool
     _media: bool
     _other: bool
@@ -131,21 +212,23 @@ class RestrictionDto:
 
 
 class RestrictedUserDto:
-    _user: User
+    __slots__ = ('_user', '_chat_id', '_until_date', '_restriction', '_restore_at')
+    _user: UserDto
     _chat_id: int
     _until_date: int
     _restriction: RestrictionDto
     _restore_at: int
 
-    def __init__(self, user: User, chat_id: int, until_date: int, restriction: RestrictionDto, restore_at: int):
-        self._user = user
+    def __init__(self, user: Union[User, UserDto], chat_id: int, until_date: int, restriction: RestrictionDto,
+                 restore_at: int):
+        self._user = UserDto.of(user)
         self._chat_id = chat_id
         self._until_date = until_date
         self._restriction = restriction
         self._restore_at = restore_at
 
     @property
-    def user(self) -> User:
+    def user(self) -> UserDto:
         return self._user
 
     @property
@@ -165,18 +248,158 @@ class RestrictedUserDto:
         return self._restore_at
 
 
+class MemberStateDto:
+    """Status and permissions of a telebot ChatMember, under the same names"""
+    __slots__ = (
+        '_status', '_until_date', '_can_send_messages', '_can_send_media_messages', '_can_send_other_messages',
+        '_can_add_web_page_previews',
+    )
+
+    def __init__(self, status: str, until_date: Optional[int] = None, can_send_messages: Optional[bool] = None,
+                 can_send_media_messages: Optional[bool] = None, can_send_other_messages: Optional[bool] = None,
+                 can_add_web_page_previews: Optional[bool] = None):
+        self._status = status
+        self._until_date = until_date
+        self._can_send_messages = can_send_messages
+        self._can_send_media_messages = can_send_media_messages
+        self._can_send_other_messages = can_send_other_messages
+        self._can_add_web_page_previews = can_add_web_page_previews
+
+    @classmethod
+    def of(cls, member: Union[ChatMember, 'MemberStateDto']) -> 'MemberStateDto':
+        if isinstance(member, cls):
+            return member
+        return cls(member.status, member.until_date, member.can_send_messages, member.can_send_media_messages,
+                   member.can_send_other_messages, member.can_add_web_page_previews)
+
+    @property
+    def status(self) -> str:
+        return self._status
+
+    @property
+    def until_date(self) -> Optional[int]:
+        return self._until_date
+
+    @property
+    def can_send_messages(self) -> Optional[bool]:
+        return self._can_send_messages
+
+    @property
+    def can_send_media_messages(self) -> Optional[bool]:
+        return self._can_send_media_messages
+
+    @property
+    def can_send_other_messages(self) -> Optional[bool]:
+        return self._can_send_other_messages
+
+    @property
+    def can_add_web_page_previews(self) -> Optional[bool]:
+        return self._can_add_web_page_previews
+
+
 class CommandDto:
     _bot_command: str
     _text: str
+    _aliases: Tuple[str, ...]
+    _takes_arguments: bool
 
-    def __init__(self, bot_command: str, text_command: str):
+    def __init__(self, bot_command: str, text_command: str, aliases: Tuple[str, ...] = (),
+                 takes_arguments: bool = True):
         self._bot_command = bot_command
         self._text = text_command
+        self._aliases = aliases
+        self._takes_arguments = takes_arguments
 
     @property
     def bot_command(self) -> str:
         return self._bot_command
 
+    @property
+    def aliases(self) -> Tuple[str, ...]:
+        return self._aliases
+
+    @property
+    def takes_arguments(self) -> bool:
+        return self._takes_arguments
+
     @property
     def text(self) -> str:
         return self._text
+
+
+class ChatMemberUpdateDto:
+    _chat_id: int
+    _old_member: ChatMember
+    _new_member: ChatMember
+
+    def __init__(self, chat_id: int, old_member: ChatMember, new_member: ChatMember):
+        self._chat_id = chat_id
+        self._old_member = old_member
+        self._new_member = new_member
+
+    @classmethod
+    def de_json(cls, obj: dict) -> 'ChatMemberUpdateDto':
+        return cls(
+            chat_id=obj['chat']['id'],
+            old_member=ChatMember.de_json(obj['old_chat_member']),
+            new_member=ChatMember.de_json(obj['new_chat_member']),
+        )
+
+    @property
+    def chat_id(self) -> int:
+        return self._chat_id
+
+    @property
+    def user_id(self) -> int:
+        return self._new_member.user.id
+
+    @property
+    def old_member(self) -> ChatMember:
+        return self._old_member
+
+    @property
+    def new_member(self) -> ChatMember:
+        return self._new_member
+
+
+class ChatConfigDto:
+    _chat_id: int
+    _questions_file: Path
+    _restrict_duration: type
+    _ban_duration: type
+    _notifications: Dict[str, List[str]]
+    _flood_thresholds: Optional[Dict[str, Tuple[Optional[int], ...]]]
+
+    def __init__(self, chat_id: int, questions_file: Path, restrict_duration: type, ban_duration: type,
+                 notifications: Dict[str, List[str]],
+                 flood_thresholds: Optional[Dict[str, Tuple[Optional[int], ...]]] = None):
+        self._chat_id = chat_id
+        self._questions_file = questions_file
+        self._restrict_duration = restrict_duration
+        self._ban_duration = ban_duration
+        self._notifications = notifications
+        self._flood_thresholds = flood_thresholds
+
+    @property
+    def chat_id(self) -> int:
+        return self._chat_id
+
+    @property
+    def questions_file(self) -> Path:
+        return self._questions_file
+
+    @property
+    def restrict_duration(self) -> type:
+        return self._restrict_duration
+
+    @property
+    def ban_duration(self) -> type:
+        return self._ban_duration
+
+    @property
+    def notifications(self) -> Dict[str, List[str]]:
+        return self._notifications
+
+    @property
+    def flood_thresholds(self) -> Optional[Dict[str, Tuple[Optional[int], ...]]]:
+        return self._flood_thresholds
@@ -4,6 +4,7 @@ import telebot
 from telebot.types import Message
 
 from const import TelegramParseMode
+from logs import log_fields
 
 
 class ParseBanDurationError(Exception):
@@ -30,11 +31,18 @@ class UserStorageUpdateError(Exception):
     pass
 
 
+class StorageFullError(Exception):
+    pass
+
+
 class UnauthorizedCommandError(InvalidConditionError):
     def __init__(self, message: Message, service, bot: telebot, logger: logging.Logger):
         text = service.set_punishment(user=message.from_user, message=message)
-        logger.warning(f'Non-factor {message.from_user.username} trying to use unauthorized command.')
-        bot.send_message(
+        logger.warning('Non-factor trying to use unauthorized command.', extra=log_fields(
+            chat_id=message.chat.id, user_id=message.from_user.id, username=message.from_user.username,
+        ))
+        bot.enqueue(
+            'send_message',
             chat_id=message.chat.id,
             text=f'*{text}*',
             reply_to_message_id=message.message_id,
@@ -44,3 +52,7 @@ class UnauthorizedCommandError(InvalidConditionError):
         
 class GreetingsLoadError(Exception):
     pass
+
+
+class ChatConfigLoadError(Exception):
+    pass
@@ -0,0 +1,38 @@
+import heapq
+from typing import Iterable, List, Tuple
+
+from const import StateSettings
+
+
+class ExpiryIndex:
+    """
+    Expiry deadlines of storage records by user id, the earliest first
+
+    Entries are not removed with their records or replaced with new deadlines: storages check expired entries
+    against the current record, and the heap is rebuilt from live records once stale entries outnumber them.
+    """
+    _heap: List[Tuple[float, int]]
+
+    def __init__(self):
+        self._heap = []
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, expires_at: float, user_id: int):
+        heapq.heappush(self._heap, (expires_at, user_id))
+
+    def pop_expired(self, now: float) -> List[Tuple[float, int]]:
+        """Entries with deadlines up to now, removed from the index"""
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            expired.append(heapq.heappop(self._heap))
+        return expired
+
+    def compact(self, live: int, entries: Iterable[Tuple[float, int]]) -> bool:
+        """Rebuild the heap from entries of live records, if stale entries outnumber them"""
+        if len(self._heap) - live <= max(live, StateSettings.COMPACT_MIN_STALE):
+            return False
+        self._heap = list(entries)
+        heapq.heapify(self._heap)
+        return True
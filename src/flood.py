@@ -0,0 +1,96 @@
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from const import FloodSettings
+
+
+class FloodCounters:
+    """Ring buckets of one user, a total cell followed by the buckets of every counted window"""
+    __slots__ = ('second', 'counts')
+
+    def __init__(self, second: int, size: int):
+        self.second = second
+        self.counts = array('H', bytes(2 * size))
+
+
+class FloodDetector:
+    """
+    Sliding window message counter by user
+
+    Every window is a ring of buckets with a running total, so counting a message and expiring old ones take
+    constant time. A user sending more messages of a content type than its threshold within a window floods,
+    counts of the user start over then. Users quiet for the longest window are dropped, at most capacity users
+    are counted.
+    """
+    _users: 'OrderedDict[int, FloodCounters]'
+    _rings: List[Tuple[str, int, int, int, int]]
+
+    def __init__(
+            self,
+            thresholds: Dict[str, Tuple[Optional[int], ...]] = None,
+            windows: Tuple[Tuple[int, int], ...] = FloodSettings.WINDOWS,
+            capacity: int = FloodSettings.MAX_USERS,
+    ):
+        thresholds = thresholds or FloodSettings.THRESHOLDS
+        self._rings = []  # (content type, total offset, buckets, bucket seconds, threshold)
+        size = 0
+        for content_type in FloodSettings.MESSAGES, FloodSettings.MEDIA:  # Read only outweighs text only
+            for (window, bucket), threshold in zip(windows, thresholds.get(content_type, ())):
+                if threshold is None:
+                    continue
+                buckets = -(-window // bucket)
+                self._rings.append((content_type, size, buckets, bucket, threshold))
+                size += buckets + 1
+        self._size = size
+        self._span = max(window for window, _ in windows)
+        self._capacity = capacity
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def register(self, user_id: int, media: bool, now: float) -> Optional[str]:
+        """Count a message of user, returns the content type whose threshold it crosses"""
+        second = int(now)
+        with self._lock:
+            counters = self._users.get(user_id)
+            if counters is None:
+                counters = self._users[user_id] = FloodCounters(second, self._size)
+                self._evict(second)
+            else:
+                self._users.move_to_end(user_id)
+                if second > counters.second:
+                    self._expire(counters, second)
+            second = counters.second  # A late message counts as the latest one
+
+            counts = counters.counts
+            crossed = None
+            for content_type, offset, buckets, bucket, threshold in self._rings:
+                if content_type == FloodSettings.MEDIA and not media:
+                    continue
+                counts[offset + 1 + second // bucket % buckets] += 1
+                counts[offset] += 1
+                if crossed is None and counts[offset] > threshold:
+                    crossed = content_type
+            if crossed is not None:
+                del self._users[user_id]
+            return crossed
+
+    def _expire(self, counters: FloodCounters, second: int):
+        counts = counters.counts
+        for _, offset, buckets, bucket, _ in self._rings:
+            last_slot = counters.second // bucket
+            for slot in range(last_slot + 1, min(second // bucket, last_slot + buckets) + 1):
+                index = offset + 1 + slot % buckets
+                counts[offset] -= counts[index]
+                counts[index] = 0
+        counters.second = second
+
+    def _evict(self, second: int):
+        """Drop the least recently active user if there are too many users or it is quiet for the longest window"""
+        user_id, counters = next(iter(self._users.items()))
+        if len(self._users) > self._capacity or counters.second <= second - self._span:
+            del self._users[user_id]
@@ -1,81 +1,202 @@
+import hashlib
 import logging
+import marshal
 import random
+import threading
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, List, Optional
 
 import yaml
 from telebot.types import InlineKeyboardButton, User, InlineKeyboardMarkup, Message
-from yaml.scanner import ScannerError
 
-from const import GreetingDefaultSettings
+from clock import Clock
+from const import GreetingDefaultSettings, ScheduledTaskKey, StateSettings
 from dto import GreetingQuestionDto, NewbieDto
-from error import UserAlreadyInStorageError, UserNotFoundInStorageError, UserStorageUpdateError, GreetingsLoadError
+from error import UserAlreadyInStorageError, UserNotFoundInStorageError, UserStorageUpdateError, GreetingsLoadError, \
+    StorageFullError
+from expiry import ExpiryIndex
+from logs import log_fields
+from persistence import StateJournal
+from scheduler import TaskScheduler
+
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader as YamlLoader
 
 
 class NewbieStorage:
-    _storage: Dict[Any, NewbieDto]
+    """
+    Pending newbies of one chat by user id
+
+    Keeps a greeting message id index, so newbie lookups by user or greeting do not depend on storage size.
+    Newbies are evicted EXPIRY_GRACE seconds after their timeout, and no more than capacity newbies are kept.
+    """
+    _storage: Dict[int, NewbieDto]
+    _greetings: Dict[int, int]
 
-    def __init__(self, logger: logging.Logger):
+    def __init__(self, logger: logging.Logger, journal: StateJournal = None, chat_id: int = None,
+                 clock: Clock = None, capacity: int = StateSettings.MAX_NEWBIES):
         self._storage = dict()
+        self._greetings = dict()
+        self._expiry = ExpiryIndex()
         self._logger = logger
+        self._journal = journal
+        self._chat_id = chat_id
+        self._clock = clock or Clock()
+        self._capacity = capacity
+        self._lock = threading.RLock()
 
     def __iter__(self):
-        for key, value in self._storage.items():
-            yield value
+        with self._lock:
+            newbies = list(self._storage.values())
+        yield from newbies
+
+    def __len__(self) -> int:
+        return len(self._storage)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._storage
+
+    def load(self) -> int:
+        """Restore newbies saved by the journal. Returns loaded newbies count"""
+        if self._journal is None:
+            return 0
+        with self._lock:
+            for newbie in self._journal.load_newbies(self._chat_id):
+                self._put(newbie)
+            return len(self._storage)
+
+    def _put(self, newbie: NewbieDto):
+        previous = self._storage.get(newbie.user.id)
+        if previous is not None and previous.greeting is not None:
+            self._greetings.pop(previous.greeting.message_id, None)
+        self._storage[newbie.user.id] = newbie
+        if newbie.greeting is not None:
+            self._greetings[newbie.greeting.message_id] = newbie.user.id
+        if previous is None or previous.timeout != newbie.timeout:
+            self._expiry.push(self._expires_at(newbie), newbie.user.id)
+
+    @staticmethod
+    def _expires_at(newbie: NewbieDto) -> float:
+        return newbie.timeout + StateSettings.EXPIRY_GRACE
+
+    def _pop(self, user_id: int) -> NewbieDto:
+        newbie = self._storage.pop(user_id)
+        if newbie.greeting is not None:
+            self._greetings.pop(newbie.greeting.message_id, None)
+        if self._journal is not None:
+            self._journal.remove_newbie(self._chat_id, user_id)
+        return newbie
+
+    def evict_expired(self) -> int:
+        """Remove newbies past their timeout and grace. Returns evicted newbies count"""
+        now = self._clock.time()
+        evicted = 0
+        with self._lock:
+            for expires_at, user_id in self._expiry.pop_expired(now):
+                newbie = self._storage.get(user_id)
+                if newbie is not None and self._expires_at(newbie) == expires_at:
+                    self._pop(user_id)
+                    evicted += 1
+            self._expiry.compact(
+                len(self._storage), ((self._expires_at(_), _.user.id) for _ in self._storage.values()),
+            )
+        return evicted
 
     def add(self, user: User, timeout: int, question: GreetingQuestionDto):
         newbie = NewbieDto(user=user, timeout=timeout, question=question)
-        self._logger.debug(f'Trying to add user @{user.username} into newbie list')
-        if user.id in self._storage:
-            self._logger.warning(f'Can not add! User @{user.username} already in newbie list.')
-            raise UserAlreadyInStorageError()
+        self._logger.debug('Trying to add user into newbie list', extra=log_fields(
+            chat_id=self._chat_id, user_id=user.id, username=user.username,
+        ))
+        with self._lock:
+            if user.id in self._storage:
+                self._logger.warning('Can not add! User already in newbie list.', extra=log_fields(
+                    chat_id=self._chat_id, user_id=user.id, username=user.username,
+                ))
+                raise UserAlreadyInStorageError()
+            if len(self._storage) >= self._capacity and not self.evict_expired():
+                self._logger.error('Can not add! Newbie list is full.', extra=log_fields(
+                    chat_id=self._chat_id, user_id=user.id, capacity=self._capacity,
+                ))
+                raise StorageFullError()
 
-        self._storage.update({user.id: newbie})
+            self._put(newbie)
+            if self._journal is not None:
+                self._journal.save_newbie(self._chat_id, newbie)
 
     def remove(self, user: User):
-        try:
-            self._logger.debug(f'Trying to remove newbie {user} from list')
-            del self._storage[user.id]
-        except KeyError:
-            self._logger.warning(f'Can not remove! User @{user.username} not found in newbie list!')
+        self._logger.debug('Trying to remove newbie from list', extra=log_fields(
+            chat_id=self._chat_id, user_id=user.id, username=user.username,
+        ))
+        with self._lock:
+            if user.id not in self._storage:
+                self._logger.warning('Can not remove! User not found in newbie list!', extra=log_fields(
+                    chat_id=self._chat_id, user_id=user.id, username=user.username,
+                ))
+                return
+            self._pop(user.id)
+
+    def take(self, newbie: NewbieDto) -> bool:
+        """Remove the newbie if it is still stored. Of racing callers, e.g. an answer and a timeout, one gets True"""
+        with self._lock:
+            if self._storage.get(newbie.user.id) is not newbie:
+                return False
+            self._pop(newbie.user.id)
+            return True
 
     def update(self, user: User, greeting: Message):
-        self._logger.debug(f'Trying to update greeting {greeting} for newbie @{user.username}')
-        try:
-            current_newbie = self.get(user)
-        except UserNotFoundInStorageError:
-            raise UserStorageUpdateError()
-        self._storage[user.id] = NewbieDto(
-            user=current_newbie.user,
-            timeout=current_newbie.timeout,
-            question=current_newbie.question,
-            greeting=greeting,
-        )
+        self._logger.debug('Trying to update greeting for newbie', extra=log_fields(
+            chat_id=self._chat_id, user_id=user.id, message_id=greeting.message_id,
+        ))
+        with self._lock:
+            try:
+                current_newbie = self.get(user)
+            except UserNotFoundInStorageError:
+                raise UserStorageUpdateError()
+            newbie = NewbieDto(
+                user=current_newbie.user,
+                timeout=current_newbie.timeout,
+                question=current_newbie.question,
+                greeting=greeting,
+            )
+            self._put(newbie)
+            if self._journal is not None:
+                self._journal.save_newbie(self._chat_id, newbie)
 
     def get(self, user: User) -> NewbieDto:
         try:
             return self._storage[user.id]
         except KeyError:
-            self._logger.error(f'Can not get! User @{user.username} not found in newbie list.')
+            self._logger.error('Can not get! User not found in newbie list.', extra=log_fields(
+                chat_id=self._chat_id, user_id=user.id, username=user.username,
+            ))
             raise UserNotFoundInStorageError()
 
-    def get_user_list(self) -> list:
-        return list(self._storage.keys())
+    def find_by_greeting(self, message_id: int) -> Optional[NewbieDto]:
+        with self._lock:
+            user_id = self._greetings.get(message_id)
+            return None if user_id is None else self._storage.get(user_id)
 
 
 class QuestionLoader:
+    """
+    Greeting questions loader
+
+    Questions are validated and compiled to plain tuples (text, keyboard json, timeout, replies) first.
+    Compiled questions are cached in a snapshot next to the yaml file, keyed by yaml content hash.
+    """
     _logger = logging.getLogger('greetings_file_loader')  # Logger from baseConfig settings
 
     @staticmethod
-    def load_questions() -> List[GreetingQuestionDto]:
+    def load_questions(file_path: Path = GreetingDefaultSettings.GREETING_QUESTIONS_FILE) -> List[GreetingQuestionDto]:
         """
         This method loads greeting questions list from yaml file
-        Note: dynamical reload can be added here
         :return: List[GreetingQuestionDto] - list with greeting question dto's
         """
         result = QuestionLoader._set_default_greeting()
         try:
-            result = QuestionLoader._load_questions_from_file()
+            result = QuestionLoader._load_questions_from_file(file_path)
         except GreetingsLoadError as gle:
             QuestionLoader._logger.error(f'Load greeting questions error: {gle}')
         except Exception as e:
@@ -84,83 +205,126 @@ class QuestionLoader:
             return result
 
     @staticmethod
-    def _load_questions_from_file() -> List[GreetingQuestionDto]:
+    def _load_questions_from_file(
+            file_path: Path = GreetingDefaultSettings.GREETING_QUESTIONS_FILE,
+    ) -> List[GreetingQuestionDto]:
         """Main load questions method"""
-        questions_dict = QuestionLoader._load_from_file(GreetingDefaultSettings.GREETING_QUESTIONS_FILE)
+        source = QuestionLoader._read_source(file_path)
+        source_hash = hashlib.sha256(source).hexdigest()
+        compiled = QuestionLoader._load_snapshot(QuestionLoader.get_snapshot_path(file_path), source_hash)
+        if compiled is None:
+            compiled = QuestionLoader.compile_questions(QuestionLoader._parse(source))
+        return [QuestionLoader._build(question) for question in compiled]
+
+    @staticmethod
+    def get_snapshot_path(file_path: Path) -> Path:
+        return file_path.with_name(file_path.name + GreetingDefaultSettings.SNAPSHOT_SUFFIX)
+
+    @staticmethod
+    def compile_file(file_path: Path, snapshot_path: Path = None) -> int:
+        """Validate yaml file and write compiled questions snapshot. Returns compiled questions count"""
+        source = QuestionLoader._read_source(file_path)
+        compiled = QuestionLoader.compile_questions(QuestionLoader._parse(source))
+        snapshot = marshal.dumps((
+            GreetingDefaultSettings.SNAPSHOT_VERSION,
+            hashlib.sha256(source).hexdigest(),
+            compiled,
+        ))
+        snapshot_path = snapshot_path or QuestionLoader.get_snapshot_path(file_path)
+        temp_path = snapshot_path.with_name(snapshot_path.name + '.tmp')
+        temp_path.write_bytes(snapshot)
+        temp_path.replace(snapshot_path)
+        return len(compiled)
+
+    @staticmethod
+    def _load_snapshot(snapshot_path: Path, source_hash: str) -> Optional[tuple]:
+        """Compiled questions from snapshot, None if snapshot is missing or made for another yaml file"""
+        try:
+            version, snapshot_hash, compiled = marshal.loads(snapshot_path.read_bytes())
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError, TypeError) as e:
+            QuestionLoader._logger.warning(f'Can not read questions snapshot {snapshot_path}: {e}')
+            return None
+        if version != GreetingDefaultSettings.SNAPSHOT_VERSION or snapshot_hash != source_hash:
+            QuestionLoader._logger.warning(f'Questions snapshot {snapshot_path} is stale, loading yaml file')
+            return None
+        return compiled
+
+    @staticmethod
+    def compile_questions(questions_dict: Dict) -> tuple:
         questions = questions_dict.get('questions', [])
 
         if not isinstance(questions, list):  # non-list
             raise GreetingsLoadError(f'Questions are not as list! Content: {questions}')
 
+        global_timeout = questions_dict.get('global_question_timeout', GreetingDefaultSettings.DEFAULT_QUESTION_TIMEOUT)
         result = []
         for question in questions:
             # Check question structure
             if not QuestionLoader._validate(question):
                 QuestionLoader._logger.error(f'Malformed question found, skipping it. Question: {question}')
                 continue
-            buttons = []
-            replies = {}
-            timeout = question.get(  # TODO: Int type check for global or move it to config
-                'question_timeout',
-                questions_dict.get('global_question_timeout', GreetingDefaultSettings.DEFAULT_QUESTION_TIMEOUT)
-            )
-            for i, opt in enumerate(question.get('options', [])):
-                buttons.append(
-                    InlineKeyboardButton(
-                        text=opt.get('option_text', GreetingDefaultSettings.DEFAULT_QUESTION_OPTION),
-                        callback_data=str(i),
-                    ))
-                replies[str(i)] = opt.get('reply_text', GreetingDefaultSettings.DEFAULT_QUESTION_REPLY)
-
-            result.append(
-                GreetingQuestionDto(
-                    text=question.get('text', GreetingDefaultSettings.DEFAULT_QUESTION_TEXT),
-                    keyboard=InlineKeyboardMarkup().row(*buttons),
-                    timeout=timeout,
-                    reply=replies,
-                ))
+            options = question['options']
+            keyboard = InlineKeyboardMarkup().row(*[
+                InlineKeyboardButton(
+                    text=opt.get('option_text', GreetingDefaultSettings.DEFAULT_QUESTION_OPTION),
+                    callback_data=str(i),
+                ) for i, opt in enumerate(options)
+            ])
+            result.append((
+                question.get('text', GreetingDefaultSettings.DEFAULT_QUESTION_TEXT),
+                keyboard.to_json(),
+                question.get('question_timeout', global_timeout),  # TODO: Int type check for global or move it to config
+                {
+                    str(i): opt.get('reply_text', GreetingDefaultSettings.DEFAULT_QUESTION_REPLY)
+                    for i, opt in enumerate(options)
+                },
+            ))
 
         # Final questions check
         if not result:
             raise GreetingsLoadError(
                 f'No valid questions were extracted from yaml file! Content: {questions_dict}'
             )
-        return result
+        return tuple(result)
+
+    @staticmethod
+    def _build(compiled_question: tuple) -> GreetingQuestionDto:
+        text, keyboard_json, timeout, replies = compiled_question
+        return GreetingQuestionDto(text=text, keyboard=None, timeout=timeout, reply=replies, keyboard_json=keyboard_json)
 
     @staticmethod
     def _validate(question) -> bool:
         """Super simple validator (no asserts)"""
         if not isinstance(question, dict):
             return False
-        result = True
-        result = result and question.get('name', False)
-        result = result and question.get('text', False)
-        result = result and isinstance(question.get('question_timeout', 0), int)  # Optional field, only type check
-
-        options = question.get('options') if isinstance(question.get('options'), list) else []
-        result = result and bool(options)
-        result = result and len(options) > 0
-
-        for opt in options:
-            if not isinstance(opt, dict):
-                result = False
-                continue
-            result = result and opt.get('option_text', False)
-            result = result and opt.get('reply_text', False)
-        return result
+        if not question.get('name') or not question.get('text'):
+            return False
+        if not isinstance(question.get('question_timeout', 0), int):  # Optional field, only type check
+            return False
+
+        options = question.get('options')
+        if not isinstance(options, list) or not options:
+            return False
+        return all(isinstance(opt, dict) and opt.get('option_text') and opt.get('reply_text') for opt in options)
 
     @staticmethod
-    def _load_from_file(file_path: Path) -> Dict:
-        """Load dict from yaml file"""
-        if not file_path.exists():
+    def _read_source(file_path: Path) -> bytes:
+        try:
+            return file_path.read_bytes()
+        except FileNotFoundError:
             raise GreetingsLoadError(
                 f'Can not found yaml file with greeting questions by location: {file_path.absolute()}'
             )
-        with file_path.open("r", encoding="utf8") as f:
-            try:
-                result = yaml.load(f)
-            except ScannerError as se:
-                raise GreetingsLoadError(f'Malformed questions file: {se}')
+
+    @staticmethod
+    def _parse(source: bytes) -> Dict:
+        """Load dict from yaml file content"""
+        try:
+            result = yaml.load(source, Loader=YamlLoader)
+        except yaml.YAMLError as ye:
+            raise GreetingsLoadError(f'Malformed questions file: {ye}')
         if not isinstance(result, dict):
             raise GreetingsLoadError(f'Malformed (not a dict) questions file: {result}')
         return result
@@ -183,17 +347,101 @@ class QuestionLoader:
 
 
 class QuestionProvider:
-    _questions: List[GreetingQuestionDto] = QuestionLoader.load_questions()
+    """Greeting questions of one questions file, loaded on first use"""
+    _questions: List[GreetingQuestionDto]
 
-    @staticmethod
-    def get_question() -> GreetingQuestionDto:
+    def __init__(self, file_path: Path = GreetingDefaultSettings.GREETING_QUESTIONS_FILE):
+        self._file_path = file_path
+        self._questions = None
+        self._lock = threading.Lock()
+
+    @property
+    def file_path(self) -> Path:
+        return self._file_path
+
+    def get_questions(self) -> List[GreetingQuestionDto]:
+        questions = self._questions
+        if questions is None:
+            with self._lock:
+                if self._questions is None:
+                    self._questions = QuestionLoader.load_questions(self._file_path)
+                questions = self._questions
+        return questions
+
+    def get_question(self) -> GreetingQuestionDto:
         """
         This method return random question from greeting questions list
         :return: GreetingQuestionDto
         """
-        return random.choice(QuestionProvider._questions)
+        return random.choice(self.get_questions())
 
-    @staticmethod
-    def reload_questions_list():
+    def reload_questions_list(self):
         """Reload greeting questions list"""
-        QuestionProvider._questions = QuestionLoader.load_questions()
+        self._questions = QuestionLoader.load_questions(self._file_path)
+
+    def set_questions(self, questions: List[GreetingQuestionDto]):
+        """Swap questions list, greetings already sent keep their own question dto"""
+        self._questions = questions
+
+
+class QuestionWatcher:
+    """
+    Questions file hot reload
+
+    Polls questions file modification time on scheduler workers. Changed file is loaded and validated
+    before the questions list is swapped, a broken file keeps current questions.
+    """
+
+    def __init__(
+            self,
+            scheduler: TaskScheduler,
+            logger: logging.Logger,
+            provider: QuestionProvider,
+            interval: float = GreetingDefaultSettings.RELOAD_INTERVAL,
+    ):
+        self._scheduler = scheduler
+        self._logger = logger
+        self._provider = provider
+        self._file_path = provider.file_path
+        self._interval = interval
+        self._signature = None
+        self._key = (str(self._file_path), ScheduledTaskKey.QUESTIONS_RELOAD)
+
+    def _get_signature(self) -> Optional[tuple]:
+        try:
+            stat = self._file_path.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def start(self):
+        self._signature = self._get_signature()
+        self._schedule()
+
+    def stop(self):
+        self._scheduler.cancel(self._key)
+
+    def _schedule(self):
+        self._scheduler.schedule(pause=self._interval, action=self._poll, key=self._key)
+
+    def _poll(self):
+        try:
+            self.check()
+        finally:
+            self._schedule()
+
+    def check(self) -> bool:
+        """Reload questions if file was changed. Returns True if questions list was swapped"""
+        signature = self._get_signature()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+
+        try:
+            questions = QuestionLoader._load_questions_from_file(self._file_path)
+        except Exception as e:
+            self._logger.error(f'Can not reload greeting questions, current questions are kept: {e}')
+            return False
+        self._provider.set_questions(questions)
+        self._logger.info(f'Reloaded {len(questions)} greeting questions from {self._file_path}')
+        return True
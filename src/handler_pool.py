@@ -0,0 +1,85 @@
+import queue
+import sys
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, Hashable, Optional
+
+from const import HandlerSettings
+
+
+class KeyedThreadPool:
+    """
+    Handler thread pool running tasks of one key strictly in order
+
+    Tasks of different keys, e.g. (chat_id, user_id) of updates, run concurrently. A key with a running task
+    gets the following ones queued behind it, and they are handed to workers one by one in submit order.
+    Tasks without a key run in any order. Exceptions are kept for raise_exceptions() of the polling loop,
+    as telebot's ThreadPool does, so it is a drop-in worker_pool of TeleBot.
+    """
+    _waiting: Dict[Hashable, Deque[tuple]]
+
+    def __init__(self, num_threads: int = HandlerSettings.WORKER_COUNT, name: str = 'handler'):
+        self.num_threads = num_threads
+        self.tasks = queue.Queue()  # Tasks ready to run, one per key at most
+        self.exception_event = threading.Event()
+        self.exc_info = None
+        self._waiting = dict()
+        self._lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._run, name=f'{name}-{_}', daemon=True) for _ in range(num_threads)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    @property
+    def pending(self) -> int:
+        """Tasks not started yet"""
+        with self._lock:
+            return self.tasks.qsize() + sum(len(_) for _ in self._waiting.values())
+
+    def put(self, func: Callable, *args, **kwargs):
+        self.submit(None, func, *args, **kwargs)
+
+    def submit(self, key: Optional[Hashable], func: Callable, *args, **kwargs):
+        if key is not None:
+            with self._lock:
+                waiting = self._waiting.get(key)
+                if waiting is not None:  # The key has a running task
+                    waiting.append((func, args, kwargs))
+                    return
+                self._waiting[key] = deque()
+        self.tasks.put((key, func, args, kwargs))
+
+    def _run(self):
+        for key, func, args, kwargs in iter(self.tasks.get, None):
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                self.exc_info = sys.exc_info()
+                self.exception_event.set()
+            finally:
+                if key is not None:
+                    self._next(key)
+
+    def _next(self, key: Hashable):
+        with self._lock:
+            waiting = self._waiting[key]
+            if not waiting:
+                del self._waiting[key]
+                return
+            func, args, kwargs = waiting.popleft()
+        self.tasks.put((key, func, args, kwargs))  # Behind other keys' ready tasks
+
+    def raise_exceptions(self):
+        if self.exception_event.is_set():
+            exc_info = self.exc_info
+            raise exc_info[1].with_traceback(exc_info[2])
+
+    def clear_exceptions(self):
+        self.exception_event.clear()
+
+    def close(self):
+        for _ in self._workers:
+            self.tasks.put(None)
+        for worker in self._workers:
+            worker.join()
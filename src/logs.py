@@ -0,0 +1,158 @@
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Hashable, List, TextIO
+
+from const import LoggingSettings
+
+# Record attributes rendered by the formatters besides the message
+_FIELDS = 'fields'
+_SUPPRESSED = 'suppressed'
+_DROPPED = 'dropped'
+
+
+def log_fields(**values) -> dict:
+    """
+    Structured fields of a record, logger.info('Newbie kicked', extra=log_fields(user_id=user.id))
+
+    Values are rendered by the writer thread and only if the record is emitted, so pass ids rather than
+    whole telebot objects.
+    """
+    return {_FIELDS: values}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, process, message, fields, suppressed duplicates and exception"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = dict(
+            time=self.formatTime(record, self.datefmt),
+            level=record.levelname,
+            process=record.processName,
+            message=record.getMessage(),
+        )
+        entry.update(getattr(record, _FIELDS, None) or {})
+        for name in _SUPPRESSED, _DROPPED:
+            if getattr(record, name, 0):
+                entry[name] = getattr(record, name)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """RECORD_FORMAT line followed by key=value fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        values = dict(getattr(record, _FIELDS, None) or {})
+        for name in _SUPPRESSED, _DROPPED:
+            if getattr(record, name, 0):
+                values[name] = getattr(record, name)
+        if not values:
+            return text
+        return text + ' ' + ' '.join(f'{key}={value}' for key, value in values.items())
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    At most burst warnings and errors per interval seconds for every message template
+
+    Records over the limit are dropped, the first record of the next interval carries their count as suppressed.
+    Message templates rather than rendered messages are counted, so f-string messages are limited separately.
+    """
+    _windows: Dict[Hashable, List]
+
+    def __init__(self, burst: int = LoggingSettings.RATE_LIMIT_BURST,
+                 interval: float = LoggingSettings.RATE_LIMIT_INTERVAL):
+        super().__init__()
+        self._burst = burst
+        self._interval = interval
+        self._windows = dict()  # Template key: [window start, records in window, suppressed records]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True
+        key = (record.name, record.levelno, record.msg if isinstance(record.msg, str) else type(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self._interval:
+                if window is None and len(self._windows) >= LoggingSettings.RATE_LIMIT_MAX_KEYS:
+                    self._prune(now)
+                suppressed = window[2] if window is not None else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    setattr(record, _SUPPRESSED, suppressed)
+                return True
+            if window[1] < self._burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+    def _prune(self, now: float):
+        self._windows = {
+            key: window for key, window in self._windows.items() if now - window[0] < self._interval
+        }
+        if len(self._windows) >= LoggingSettings.RATE_LIMIT_MAX_KEYS:  # A burst of distinct f-string messages
+            self._windows.clear()
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler of a writer thread in the same process
+
+    Records are queued as they are: messages, arguments and fields are rendered by the writer thread.
+    When the queue is full, records are dropped and counted on the next queued record.
+    """
+
+    def __init__(self, records: queue.Queue):
+        super().__init__(records)
+        self._dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if self._dropped:
+            setattr(record, _DROPPED, self._dropped)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._dropped += 1
+        else:
+            self._dropped = 0
+
+
+def configure_logging(record_format: str = LoggingSettings.RECORD_FORMAT,
+                      output_format: str = LoggingSettings.DEFAULT_FORMAT, stream: TextIO = None,
+                      logger: logging.Logger = None) -> QueueListener:
+    """
+    Route logger records, of the root logger by default, through a queue to a writer thread
+
+    Replaces logging.basicConfig(): the started listener is returned and must be stopped to flush the queue.
+    """
+    handler = logging.StreamHandler(stream or sys.stderr)
+    if output_format == LoggingSettings.FORMAT_TEXT:
+        handler.setFormatter(TextFormatter(record_format, LoggingSettings.DATE_FORMAT))
+    else:
+        handler.setFormatter(JsonFormatter(datefmt=LoggingSettings.DATE_FORMAT))
+
+    records = queue.Queue(LoggingSettings.QUEUE_SIZE)
+    queue_handler = LazyQueueHandler(records)
+    queue_handler.addFilter(RateLimitFilter())
+    logger = logger or logging.getLogger()
+    for existing in list(logger.handlers):
+        logger.removeHandler(existing)
+    logger.addHandler(queue_handler)
+    logger.setLevel(logging.DEBUG)
+
+    listener = QueueListener(records, handler)
+    listener.start()
+    return listener
@@ -0,0 +1,139 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Optional, Tuple, Union
+
+from telebot import TeleBot
+from telebot.types import ChatMember
+
+from clock import Clock
+from const import MemberCacheSettings, TelegramMemberStatus
+from dto import ChatMemberUpdateDto, MemberStateDto
+from logs import log_fields
+
+
+class MemberCache:
+    """
+    Chat member states by chat and user
+
+    States from chat_member updates and from successful restrict and kick calls of the bot itself are kept
+    until the next update changes them, so moderation commands and joins do not call getChatMember in the common
+    case. Misses are read with getChatMember and kept for a short TTL. A restricted member who leaves stays
+    restricted here until the restriction ends, so a rejoin is recognized without a read.
+    """
+    _entries: 'OrderedDict[Tuple[int, int], Tuple[MemberStateDto, float]]'
+
+    def __init__(
+            self,
+            bot: TeleBot,
+            logger: logging.Logger,
+            ttl: int = MemberCacheSettings.FALLBACK_TTL,
+            clock: Clock = None,
+            capacity: int = MemberCacheSettings.MAX_ENTRIES,
+    ):
+        self._bot = bot
+        self._logger = logger
+        self._ttl = ttl
+        self._clock = clock or Clock()
+        self._capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def peek(self, chat_id: int, user_id: int) -> Optional[MemberStateDto]:
+        with self._lock:
+            entry = self._entries.get((chat_id, user_id))
+            if entry is not None and entry[1] > self._clock.time():
+                self._hits += 1
+                return entry[0]
+            self._misses += 1
+            return None
+
+    def get(self, chat_id: int, user_id: int) -> MemberStateDto:
+        state = self.peek(chat_id, user_id)
+        if state is None:
+            state = MemberStateDto.of(self._bot.get_chat_member(chat_id, user_id))
+            self.put(chat_id, user_id, state)
+        return state
+
+    def put(self, chat_id: int, user_id: int, member: Union[ChatMember, MemberStateDto], ttl: float = None):
+        """Keep a state for ttl seconds, getChatMember results for the fallback TTL by default"""
+        state = MemberStateDto.of(member)
+        expires_at = self._clock.time() + (self._ttl if ttl is None else ttl)
+        if state.until_date and state.status in (TelegramMemberStatus.RESTRICTED, TelegramMemberStatus.KICKED):
+            expires_at = min(expires_at, state.until_date)  # Telegram lifts it without an update
+        key = (chat_id, user_id)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (state, expires_at)
+            if len(self._entries) > self._capacity:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, chat_id: int, user_id: int):
+        with self._lock:
+            self._entries.pop((chat_id, user_id), None)
+
+    def track(self, chat_id: int, user_id: int, state: MemberStateDto):
+        """Keep a state known from an update or an own call"""
+        if state.status in (TelegramMemberStatus.RESTRICTED, TelegramMemberStatus.KICKED):
+            self.put(chat_id, user_id, state, MemberCacheSettings.RESTRICTED_TTL)
+        else:
+            self.put(chat_id, user_id, state, MemberCacheSettings.TRACKED_TTL)
+
+    def process_member_update(self, update: ChatMemberUpdateDto):
+        state = MemberStateDto.of(update.new_member)
+        if state.status == TelegramMemberStatus.LEFT and update.old_member.status == TelegramMemberStatus.RESTRICTED:
+            state = MemberStateDto.of(update.old_member)  # The restriction is back on rejoin
+        self.track(update.chat_id, update.user_id, state)
+
+    def record_restriction(self, chat_id: int, user_id: int, until_date: int = None, can_send_messages: bool = None,
+                           can_send_media_messages: bool = None, can_send_other_messages: bool = None,
+                           can_add_web_page_previews: bool = None):
+        """restrictChatMember succeeded, omitted permissions are denied and media ones need the previous one"""
+        messages = bool(can_send_messages)
+        media = messages and bool(can_send_media_messages)
+        other = media and bool(can_send_other_messages)
+        web_preview = media and bool(can_add_web_page_previews)
+        if messages and media and other and web_preview:
+            state = MemberStateDto(TelegramMemberStatus.MEMBER)
+        else:
+            state = MemberStateDto(TelegramMemberStatus.RESTRICTED, until_date or 0, messages, media, other, web_preview)
+        self.track(chat_id, user_id, state)
+
+    def record_kick(self, chat_id: int, user_id: int, until_date: int = None):
+        """kickChatMember succeeded"""
+        self.track(chat_id, user_id, MemberStateDto(TelegramMemberStatus.KICKED, until_date or 0))
+
+    def record(self, method_name: str, args: tuple, kwargs: dict, succeeded: bool):
+        """Track a restrict or kick call, a failed call leaves the state unknown"""
+        if succeeded:
+            record = self.record_kick if method_name == 'kick_chat_member' else self.record_restriction
+            record(*args, **kwargs)
+            return
+
+        chat_id, user_id = self._call_target(*args, **kwargs)
+        self.invalidate(chat_id, user_id)
+        self._logger.debug('Member state invalidated', extra=log_fields(
+            chat_id=chat_id, user_id=user_id, method=method_name,
+        ))
+
+    def record_call(self, method_name: str, args: tuple, kwargs: dict, future: Future):
+        """Done callback of an enqueued call"""
+        self.record(method_name, args, kwargs, future.exception() is None)
+
+    @staticmethod
+    def _call_target(chat_id: int, user_id: int, *_, **__) -> Tuple[int, int]:
+        return chat_id, user_id
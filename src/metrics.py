@@ -0,0 +1,162 @@
+import bisect
+import logging
+import threading
+import time
+from functools import wraps
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Dict, List, Tuple
+
+from const import MetricsSettings
+
+
+class MetricsRegistry:
+    """
+    Counters, latency histograms and gauges in Prometheus text format
+
+    Every thread records into its own shard, so observe() and inc() take no lock; shards are summed
+    on scrape. Gauges are callbacks evaluated on scrape, e.g. storage sizes and live thread count.
+    Metric types, label names and descriptions are listed in MetricsSettings.METRICS.
+    """
+    _shards: List[Dict[Tuple[str, tuple], list]]
+    _gauges: Dict[str, Callable[[], Dict[tuple, float]]]
+
+    def __init__(self, buckets: Tuple[float, ...] = MetricsSettings.LATENCY_BUCKETS):
+        self._buckets = buckets
+        self._shards = []
+        self._gauges = dict()
+        self._local = threading.local()
+        self._lock = threading.Lock()  # Taken once per thread, on its first record
+        self.gauge(MetricsSettings.THREADS, lambda: {(): threading.active_count()})
+
+    def gauge(self, name: str, callback: Callable[[], Dict[tuple, float]]):
+        """callback returns gauge values by label values tuple"""
+        self._gauges[name] = callback
+
+    def _shard(self) -> Dict[Tuple[str, tuple], list]:
+        shard = self._local.__dict__.get('shard')
+        if shard is None:
+            shard = self._local.shard = dict()
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def inc(self, name: str, labels: tuple = (), amount: float = 1):
+        shard = self._shard()
+        series = shard.get((name, labels))
+        if series is None:
+            series = shard[(name, labels)] = [0]
+        series[0] += amount
+
+    def observe(self, name: str, labels: tuple, value: float):
+        shard = self._shard()
+        series = shard.get((name, labels))
+        if series is None:
+            series = shard[(name, labels)] = [0] * (len(self._buckets) + 3)
+        series[bisect.bisect_left(self._buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def timed(self, name: str, *labels):
+        """Decorator observing call duration, failed calls included"""
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(name, labels, time.perf_counter() - started)
+
+            return wrapper
+
+        return decorator
+
+    def collect(self) -> Dict[Tuple[str, tuple], list]:
+        with self._lock:
+            shards = list(self._shards)
+        result = dict()
+        for shard in shards:
+            for key, series in list(shard.items()):
+                total = result.get(key)
+                if total is None:
+                    result[key] = list(series)
+                else:
+                    result[key] = [a + b for a, b in zip(total, series)]
+        return result
+
+    def render(self) -> str:
+        series_by_name = dict()
+        for (name, labels), series in self.collect().items():
+            series_by_name.setdefault(name, []).append((labels, series))
+        for name, callback in self._gauges.items():
+            series_by_name[name] = [(labels, [value]) for labels, value in callback().items()]
+
+        lines = []
+        for name in sorted(series_by_name):
+            metric_type, label_names, description = MetricsSettings.METRICS[name]
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for labels, series in sorted(series_by_name[name], key=lambda _: _[0]):
+                label_pairs = [f'{label}="{value}"' for label, value in zip(label_names, labels)]
+                if metric_type != 'histogram':
+                    lines.append(f'{name}{self._format_labels(label_pairs)} {series[0]}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(self._buckets + ('+Inf',), series):
+                    cumulative += count
+                    bucket_labels = self._format_labels(label_pairs + ['le="{}"'.format(bound)])
+                    lines.append(f'{name}_bucket{bucket_labels} {cumulative}')
+                lines.append(f'{name}_sum{self._format_labels(label_pairs)} {series[-2]}')
+                lines.append(f'{name}_count{self._format_labels(label_pairs)} {series[-1]}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _format_labels(label_pairs: List[str]) -> str:
+        return '{' + ','.join(label_pairs) + '}' if label_pairs else ''
+
+
+class MetricsServer:
+    """HTTP endpoint for Prometheus scrapes: GET /metrics"""
+
+    def __init__(self, metrics: MetricsRegistry, logger: logging.Logger,
+                 host: str = MetricsSettings.DEFAULT_HOST, port: int = MetricsSettings.DEFAULT_PORT):
+        self._metrics = metrics
+        self._logger = logger
+        self._server = ThreadingHTTPServer((host, port), self._request_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-server', daemon=True)
+        self._thread.start()
+        self._logger.info(f'Metrics are served on port {self.port}')
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _request_handler(self):
+        server = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != MetricsSettings.PATH:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = server._metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', MetricsSettings.CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return MetricsRequestHandler
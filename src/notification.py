@@ -1,3 +1,4 @@
+import threading
 from copy import copy
 from random import shuffle
 from typing import Dict, List
@@ -8,9 +9,12 @@ from dto import CommandDto
 
 class Notification:
     _notification: Dict[str, List[str]]
+    _templates: Dict[str, List[str]]
 
-    def __init__(self):
+    def __init__(self, templates: Dict[str, List[str]] = None):
         self._notification = dict()
+        self._templates = templates or dict()  # Chat specific template lists by command text name
+        self._lock = threading.Lock()  # Handler and timer threads of the chat pop templates
 
     def _init_list(self, list_name: str, source_list: list):
         self._notification[list_name] = copy(source_list)
@@ -31,10 +35,11 @@ class Notification:
         )
 
     def _get_notification(self, command_name: str, source_list: list) -> str:
-        self._notification.setdefault(command_name, list())
-        if len(self._notification[command_name]) == 0:
-            self._init_list(command_name, source_list)
-        return self._notification[command_name].pop()
+        with self._lock:
+            self._notification.setdefault(command_name, list())
+            if len(self._notification[command_name]) == 0:
+                self._init_list(command_name, self._templates.get(command_name, source_list))
+            return self._notification[command_name].pop()
 
     def read_only(self, first_name: str, duration_text: str) -> str:
         return self._get_restrict_notification_text(first_name=first_name, duration_text=duration_text,
@@ -62,3 +67,7 @@ class Notification:
     def unauthorized_punishment(self, first_name: str) -> str:
         return self._get_simple_notification_text(first_name=first_name, command=Command.SR,
                                                   notification_list=NotificationTemplateList.UNAUTHORIZED_PUNISHMENT)
+
+    def raid_restrict(self, mentions: str, duration_text: str) -> str:
+        template_text = self._get_notification(Command.RAID.text, NotificationTemplateList.RAID_RESTRICT)
+        return template_text.format(mentions=mentions, duration_text=duration_text)
@@ -0,0 +1,185 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+from contextlib import closing
+from pathlib import Path
+from typing import List, Optional
+
+from const import PersistenceSettings
+from dto import NewbieDto, RestrictedUserDto, GreetingQuestionDto, RestrictionDto, UserDto, MessageDto
+from logs import log_fields
+
+
+class StateJournal:
+    """
+    SQLite (WAL) backend for NewbieStorage and RestrictionStorage
+
+    Only compact records (ids, names, deadlines) are stored. Storages enqueue changes and return immediately,
+    writer thread applies them in batches with one commit per batch. Records are keyed by (chat_id, user_id),
+    so worker processes handling different chats share one state file.
+    """
+    _SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS newbie ('
+        'user_id INTEGER, first_name TEXT, username TEXT, timeout INTEGER, question_timeout INTEGER, '
+        'reply TEXT, chat_id INTEGER, greeting_id INTEGER, greeting_date INTEGER, PRIMARY KEY (chat_id, user_id))',
+        'CREATE TABLE IF NOT EXISTS restriction ('
+        'user_id INTEGER, first_name TEXT, username TEXT, chat_id INTEGER, until_date INTEGER, '
+        'messages INTEGER, media INTEGER, other INTEGER, web_preview INTEGER, restore_at INTEGER, '
+        'PRIMARY KEY (chat_id, user_id))',
+    )
+    _STOP = object()
+
+    def __init__(self, path: Path, logger: logging.Logger, batch_size: int = PersistenceSettings.BATCH_SIZE):
+        self._path = path
+        self._logger = logger
+        self._batch_size = batch_size
+        self._queue = queue.Queue()
+        self._thread = None
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            for statement in self._SCHEMA:
+                connection.execute(statement)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(str(self._path), timeout=PersistenceSettings.BUSY_TIMEOUT, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='state-journal', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._queue.put(self._STOP)
+        self._thread.join()
+        self._thread = None
+
+    def flush(self):
+        """Block until all enqueued changes are committed"""
+        self._queue.join()
+
+    def save_newbie(self, chat_id: int, newbie: NewbieDto):
+        self._queue.put(('newbie', chat_id, newbie.user.id, newbie))
+
+    def remove_newbie(self, chat_id: int, user_id: int):
+        self._queue.put(('newbie', chat_id, user_id, None))
+
+    def save_restriction(self, restricted: RestrictedUserDto):
+        self._queue.put(('restriction', restricted.chat_id, restricted.user.id, restricted))
+
+    def remove_restriction(self, chat_id: int, user_id: int):
+        self._queue.put(('restriction', chat_id, user_id, None))
+
+    def _run(self):
+        connection = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = self._STOP in batch
+            try:
+                with connection:
+                    for change in batch:
+                        if change is not self._STOP:
+                            self._apply(connection, *change)
+            except Exception:  # The writer must outlive bad records, or every later change is lost and flush() hangs
+                self._logger.error('Can not write state changes', exc_info=True, extra=log_fields(changes=len(batch)))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+            if stop:
+                connection.close()
+                return
+
+    def _apply(self, connection: sqlite3.Connection, table: str, chat_id: int, user_id: int, record):
+        if record is None:
+            connection.execute(f'DELETE FROM {table} WHERE chat_id = ? AND user_id = ?', (chat_id, user_id))
+        elif table == 'newbie':
+            connection.execute('INSERT OR REPLACE INTO newbie VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               self._newbie_row(chat_id, record))
+        else:
+            connection.execute('INSERT OR REPLACE INTO restriction VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               self._restriction_row(record))
+
+    @staticmethod
+    def _newbie_row(chat_id: int, newbie: NewbieDto) -> tuple:
+        greeting = newbie.greeting
+        return (
+            newbie.user.id,
+            newbie.user.first_name,
+            newbie.user.username,
+            newbie.timeout,
+            newbie.question.timeout,
+            json.dumps(newbie.question.reply, ensure_ascii=False),
+            chat_id,
+            greeting.message_id if greeting else None,
+            greeting.date if greeting else None,
+        )
+
+    @staticmethod
+    def _restriction_row(restricted: RestrictedUserDto) -> tuple:
+        restriction = restricted.restriction
+        return (
+            restricted.user.id,
+            restricted.user.first_name,
+            restricted.user.username,
+            restricted.chat_id,
+            restricted.until_date,
+            restriction.messages,
+            restriction.media,
+            restriction.other,
+            restriction.web_preview,
+            restricted.restore_at,
+        )
+
+    def load_newbies(self, chat_id: int) -> List[NewbieDto]:
+        with closing(self._connect()) as connection:
+            rows = connection.execute('SELECT * FROM newbie WHERE chat_id = ?', (chat_id,)).fetchall()
+
+        result = []
+        for user_id, first_name, username, timeout, question_timeout, reply, chat_id, greeting_id, greeting_date \
+                in rows:
+            result.append(NewbieDto(
+                user=self._user(user_id, first_name, username),
+                timeout=timeout,
+                question=GreetingQuestionDto(text='', keyboard=None, timeout=question_timeout, reply=json.loads(reply)),
+                greeting=self._message(chat_id, greeting_id, greeting_date),
+            ))
+        return result
+
+    def load_restrictions(self, chat_id: int) -> List[RestrictedUserDto]:
+        with closing(self._connect()) as connection:
+            rows = connection.execute('SELECT * FROM restriction WHERE chat_id = ?', (chat_id,)).fetchall()
+
+        result = []
+        for user_id, first_name, username, chat_id, until_date, messages, media, other, web_preview, restore_at \
+                in rows:
+            result.append(RestrictedUserDto(
+                user=self._user(user_id, first_name, username),
+                chat_id=chat_id,
+                until_date=until_date,
+                restriction=RestrictionDto(bool(messages), bool(media), bool(other), bool(web_preview)),
+                restore_at=restore_at,
+            ))
+        return result
+
+    @staticmethod
+    def _user(user_id: int, first_name: str, username: str) -> UserDto:
+        return UserDto(user_id, first_name, username)
+
+    @staticmethod
+    def _message(chat_id: int, message_id: int, date: int) -> Optional[MessageDto]:
+        if message_id is None:
+            return None
+        return MessageDto(chat_id, message_id, date)
@@ -0,0 +1,140 @@
+import logging
+import threading
+from collections import deque
+from typing import Deque, Dict, List
+
+from telebot.types import Message, User
+
+from bot import RudeBot
+from clock import Clock
+from const import RaidSettings, ScheduledTaskKey, TelegramParseMode, MetricsSettings
+from logs import log_fields
+from metrics import MetricsRegistry
+from notification import Notification
+from scheduler import TaskScheduler
+from utils import BotUtils
+
+
+class JoinRateDetector:
+    """
+    Sliding window join counter
+
+    Raid mode is on while more than threshold users joined within window seconds
+    and stays on for cooldown seconds after the rate drops.
+    """
+    _joins: Deque[float]
+
+    def __init__(self, threshold: int = RaidSettings.JOIN_THRESHOLD, window: float = RaidSettings.WINDOW,
+                 cooldown: float = RaidSettings.COOLDOWN):
+        self._threshold = threshold
+        self._window = window
+        self._cooldown = cooldown
+        self._joins = deque()
+        self._active_until = 0.0
+        self._lock = threading.Lock()
+
+    def register(self, count: int, now: float) -> bool:
+        """Register count joins, returns True if raid mode is active"""
+        with self._lock:
+            self._joins.extend([now] * count)
+            while self._joins and self._joins[0] <= now - self._window:
+                self._joins.popleft()
+            if len(self._joins) > self._threshold:
+                self._active_until = now + self._cooldown
+            return now < self._active_until
+
+
+class RaidGuard:
+    """
+    Raid mode for mass joins
+
+    New members are restricted right away and concurrently without captcha for a day, admins review them
+    and may lift restrictions earlier.
+    Joined users are announced by one message per batch instead of a question per user.
+    """
+    _batches: Dict[int, List[User]]
+    _latency: Dict[int, List[float]]
+
+    def __init__(
+            self,
+            bot: RudeBot,
+            scheduler: TaskScheduler,
+            notification: Notification,
+            logger: logging.Logger,
+            detector: JoinRateDetector = None,
+            clock: Clock = None,
+            metrics: MetricsRegistry = None,
+    ):
+        self._bot = bot
+        self._scheduler = scheduler
+        self._notification = notification
+        self._logger = logger
+        self._detector = detector or JoinRateDetector()
+        self._clock = clock or Clock()
+        self._metrics = metrics or MetricsRegistry()
+        self._batches = dict()
+        self._latency = dict()
+        self._lock = threading.Lock()
+
+    def handle(self, message: Message) -> bool:
+        """Returns False if raid mode is off and the join should get the usual greeting"""
+        if not self._detector.register(len(message.new_chat_members), self._clock.time()):
+            return False
+
+        restrictions = [
+            (new_user, self._bot.enqueue(
+                'restrict_chat_member',
+                chat_id=message.chat.id,
+                user_id=new_user.id,
+                until_date=message.date + RaidSettings.DURATION.seconds,
+            ))
+            for new_user in message.new_chat_members
+        ]
+        restricted = []
+        for new_user, future in restrictions:
+            if future.exception() is None:
+                restricted.append(new_user)
+            else:
+                self._logger.error('Raid mode: can not restrict chat member', extra=log_fields(
+                    chat_id=message.chat.id, user_id=new_user.id, username=new_user.username,
+                ))
+        latency = self._clock.time() - message.date
+        self._bot.enqueue('delete_message', message.chat.id, message.message_id)
+
+        with self._lock:
+            batch = self._batches.setdefault(message.chat.id, [])
+            if not batch:
+                self._scheduler.schedule(
+                    pause=RaidSettings.BATCH_WINDOW,
+                    action=self._flush,
+                    args=(message.chat.id,),
+                    key=(message.chat.id, ScheduledTaskKey.RAID_BATCH),
+                )
+            batch.extend(restricted)
+            self._latency.setdefault(message.chat.id, []).extend([latency] * len(restricted))
+        return True
+
+    def _flush(self, chat_id: int):
+        with self._lock:
+            batch = self._batches.pop(chat_id, [])
+            latency = self._latency.pop(chat_id, [])
+        if not batch:
+            return
+
+        self._logger.warning('Raid mode: users restricted', extra=log_fields(
+            chat_id=chat_id,
+            restricted=len(batch),
+            latency_avg=round(sum(latency) / len(latency), 3),
+            latency_max=round(max(latency), 3),
+        ))
+        for value in latency:
+            self._metrics.observe(MetricsSettings.JOIN_TO_RESTRICT, (), value)
+        mentions = ', '.join(BotUtils.mention(_) for _ in batch[:RaidSettings.MAX_MENTIONS])
+        if len(batch) > RaidSettings.MAX_MENTIONS:
+            mentions = f'{mentions} и ещё {len(batch) - RaidSettings.MAX_MENTIONS}'
+        self._bot.enqueue(
+            'send_message',
+            chat_id=chat_id,
+            text=self._notification.raid_restrict(mentions=mentions, duration_text=RaidSettings.DURATION.text),
+            parse_mode=TelegramParseMode.MARKDOWN,
+        )
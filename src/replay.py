@@ -0,0 +1,185 @@
+import argparse
+import itertools
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, Tuple
+
+from telebot import apihelper
+
+from application import create_app
+from capture import UpdateRecorder
+from clock import VirtualClock
+from const import EnvVar, LoggingSettings, ReplaySettings, TelegramChatType, TelegramMemberStatus
+from dispatcher import OutboundDispatcher
+from env_loader import EnvLoader
+from logs import configure_logging
+
+
+class StubTransport:
+    """
+    In-process Bot API of replays
+
+    Installed like ApiTransport. Messages are sent at clock time, chat members are not restricted,
+    admin_ids are administrators of every chat and other calls succeed. Calls are counted by method.
+    """
+    calls: Counter
+
+    def __init__(self, clock: VirtualClock, admin_ids: Tuple[int, ...] = ()):
+        self._clock = clock
+        self._admin_ids = frozenset(admin_ids)
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._original_make_request = None
+        self.calls = Counter()
+
+    def install(self):
+        self._original_make_request = apihelper._make_request
+        apihelper._make_request = self.make_request
+
+    def uninstall(self):
+        if self._original_make_request is not None:
+            apihelper._make_request = self._original_make_request
+            self._original_make_request = None
+
+    def make_request(self, token: str, method_name: str, method: str = 'get', params: dict = None, files=None):
+        params = params or dict()
+        with self._lock:
+            self.calls[method_name] += 1
+            message_id = next(self._message_ids)
+
+        if method_name == 'sendMessage':
+            return dict(
+                message_id=message_id,
+                date=int(self._clock.time()),
+                chat=dict(id=int(params['chat_id']), type=TelegramChatType.SUPER_GROUP),
+                text=params.get('text', ''),
+            )
+        if method_name == 'getChatMember':
+            user_id = int(params['user_id'])
+            is_admin = user_id in self._admin_ids
+            return self._member(user_id, TelegramMemberStatus.ADMINISTRATOR if is_admin else TelegramMemberStatus.MEMBER)
+        if method_name == 'getChatAdministrators':
+            return [self._member(user_id, TelegramMemberStatus.ADMINISTRATOR) for user_id in self._admin_ids]
+        if method_name == 'getUpdates':
+            return []
+        return True
+
+    @staticmethod
+    def _member(user_id: int, status: str) -> dict:
+        return dict(user=dict(id=user_id, is_bot=False, first_name=str(user_id)), status=status)
+
+
+class Replayer:
+    """
+    Captured updates fed through the application handlers in virtual time
+
+    Handlers run in the replay thread, one update after another. With clock speed, updates are fed at their
+    capture time scaled by speed. Without it, the clock jumps to the next due timer or update, and due timers
+    finish before the replay goes on, so a day of traffic with its kicks and restores replays in seconds.
+    """
+
+    def __init__(self, app, clock: VirtualClock, logger: logging.Logger):
+        self._app = app
+        self._clock = clock
+        self._logger = logger
+
+    def run(self, records: Iterable[Tuple[float, dict]], tail: float = ReplaySettings.DEFAULT_TAIL) -> int:
+        """Replay records of UpdateRecorder.read(), then run timers for tail virtual seconds"""
+        bot = self._app.bot
+        bot.threaded = False
+        count = 0
+        for received_at, json_update in records:
+            self._move_to(received_at)
+            try:
+                bot.process_new_updates(bot.de_json_updates([json_update]))
+            except Exception as e:
+                self._logger.error(f'Update {json_update.get("update_id")} failed: {e!r}')
+            count += 1
+        self._move_to(self._clock.time() + tail)
+        return count
+
+    def _move_to(self, epoch: float):
+        if self._clock.speed:
+            self._clock.sleep(epoch - self._clock.time())
+            return
+
+        scheduler = self._app.scheduler
+        while True:
+            run_at = scheduler.next_run_at()
+            if run_at is None:
+                break
+            due_at = self._clock.time() + run_at - self._clock.monotonic()
+            if due_at > epoch:
+                break
+            self._clock.advance_to(due_at)
+            self._wait_idle()
+        self._clock.advance_to(epoch)
+        self._wait_idle()
+
+    def _wait_idle(self):
+        if not self._app.scheduler.wait_idle(ReplaySettings.IDLE_TIMEOUT):
+            self._logger.warning(f'Scheduled tasks are still running after {ReplaySettings.IDLE_TIMEOUT}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay captured updates through the bot handlers in virtual time')
+    parser.add_argument('capture', type=Path, help='CAPTURE_FILE of the bot')
+    parser.add_argument('--speed', type=float, default=None,
+                        help='virtual seconds per real second, as fast as possible without it')
+    parser.add_argument('--admin', type=int, action='append', default=[], help='admin user id, may be repeated')
+    parser.add_argument('--tail', type=float, default=ReplaySettings.DEFAULT_TAIL,
+                        help='virtual seconds to run timers after the last update')
+    args = parser.parse_args()
+
+    logger = logging.getLogger()
+    env_loader = EnvLoader(logger)
+    listener = configure_logging(output_format=env_loader.get(EnvVar.LOG_FORMAT, LoggingSettings.DEFAULT_FORMAT))
+    try:
+        replay(args, logger, env_loader)
+    finally:
+        listener.stop()
+
+
+def replay(args: argparse.Namespace, logger: logging.Logger, env_loader: EnvLoader):
+    logger.setLevel(env_loader.get(EnvVar.LOGGING_LEVEL, LoggingSettings.DEFAULT_LEVEL))
+    records = list(UpdateRecorder.read(args.capture))
+    if not records:
+        logger.error(f'No updates in {args.capture}')
+        sys.exit(1)
+
+    clock = VirtualClock(records[0][0], args.speed)
+    transport = StubTransport(clock, tuple(args.admin))
+    with tempfile.TemporaryDirectory() as state_dir:
+        # Production state, metrics port and capture are not touched by replays
+        os.environ[EnvVar.STATE_FILE] = str(Path(state_dir) / 'state.sqlite3')
+        os.environ.setdefault(EnvVar.TELEGRAM_TOKEN, ReplaySettings.TOKEN)
+        for name in EnvVar.METRICS_PORT, EnvVar.CAPTURE_FILE:
+            os.environ.pop(name, None)
+
+        app = create_app(logger, components=dict(
+            clock=clock,
+            transport=transport,
+            dispatcher=OutboundDispatcher(logger, rate_limits=False),
+        ))
+        app.start()
+        started = time.perf_counter()
+        try:
+            count = Replayer(app, clock, logger).run(records, args.tail)
+        finally:
+            app.stop()
+
+    elapsed = time.perf_counter() - started
+    virtual = clock.time() - records[0][0]
+    logger.info(f'Replayed {count} updates: {virtual:.0f}s of virtual time in {elapsed:.1f}s, '
+                f'{virtual / elapsed:.0f}x')
+    logger.info('API calls: ' + ', '.join(f'{name} {count}' for name, count in sorted(transport.calls.items())))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,26 +1,118 @@
 import logging
-from typing import Dict, Any
+import threading
+from typing import Dict
 
 from telebot.types import User
 
+from clock import Clock
+from const import StateSettings
 from dto import RestrictedUserDto
-from error import UserNotFoundInStorageError
+from error import UserNotFoundInStorageError, StorageFullError
+from expiry import ExpiryIndex
+from logs import log_fields
+from persistence import StateJournal
 
 
 class RestrictionStorage:
-    _storage: Dict[Any, RestrictedUserDto]
+    """
+    Custom restrictions of one chat by user id
 
-    def __init__(self, logger: logging.Logger):
+    Restrictions are evicted EXPIRY_GRACE seconds after their restore time, restored or not,
+    and no more than capacity restrictions are kept.
+    """
+    _storage: Dict[int, RestrictedUserDto]
+
+    def __init__(self, logger: logging.Logger, journal: StateJournal = None, chat_id: int = None,
+                 clock: Clock = None, capacity: int = StateSettings.MAX_RESTRICTIONS):
         self._storage = dict()
+        self._expiry = ExpiryIndex()
         self._logger = logger
+        self._journal = journal
+        self._chat_id = chat_id
+        self._clock = clock or Clock()
+        self._capacity = capacity
+        self._lock = threading.RLock()
+
+    def __iter__(self):
+        with self._lock:
+            restrictions = list(self._storage.values())
+        yield from restrictions
+
+    def __len__(self) -> int:
+        return len(self._storage)
+
+    def load(self) -> int:
+        """Restore restrictions saved by the journal. Returns loaded restrictions count"""
+        if self._journal is None:
+            return 0
+        with self._lock:
+            for restricted in self._journal.load_restrictions(self._chat_id):
+                self._put(restricted)
+            return len(self._storage)
+
+    def _put(self, restricted: RestrictedUserDto):
+        previous = self._storage.get(restricted.user.id)
+        self._storage[restricted.user.id] = restricted
+        if previous is None or previous.restore_at != restricted.restore_at:
+            self._expiry.push(self._expires_at(restricted), restricted.user.id)
+
+    @staticmethod
+    def _expires_at(restricted: RestrictedUserDto) -> float:
+        return restricted.restore_at + StateSettings.EXPIRY_GRACE
+
+    def evict_expired(self) -> int:
+        """Remove restrictions past their restore time and grace. Returns evicted restrictions count"""
+        now = self._clock.time()
+        evicted = 0
+        with self._lock:
+            for expires_at, user_id in self._expiry.pop_expired(now):
+                restricted = self._storage.get(user_id)
+                if restricted is not None and self._expires_at(restricted) == expires_at:
+                    del self._storage[user_id]
+                    if self._journal is not None:
+                        self._journal.remove_restriction(self._chat_id, user_id)
+                    evicted += 1
+            self._expiry.compact(
+                len(self._storage), ((self._expires_at(_), _.user.id) for _ in self._storage.values()),
+            )
+        return evicted
 
     def add(self, restricted: RestrictedUserDto):
-        self._logger.debug(f'Trying to add user @{restricted.user.username} into restricted users list')
-        self._storage.update({restricted.user.id: restricted})
+        self._logger.debug('Trying to add user into restricted users list', extra=log_fields(
+            chat_id=self._chat_id, user_id=restricted.user.id, username=restricted.user.username,
+        ))
+        with self._lock:
+            full = restricted.user.id not in self._storage and len(self._storage) >= self._capacity
+            if full and not self.evict_expired():
+                self._logger.error('Can not add! Restricted users list is full.', extra=log_fields(
+                    chat_id=self._chat_id, user_id=restricted.user.id, capacity=self._capacity,
+                ))
+                raise StorageFullError()
+
+            self._put(restricted)
+            if self._journal is not None:
+                self._journal.save_restriction(restricted)
+
+    def remove(self, user: User):
+        with self._lock:
+            if self._storage.pop(user.id, None) is not None and self._journal is not None:
+                self._journal.remove_restriction(self._chat_id, user.id)
+
+    def take(self, restricted: RestrictedUserDto) -> bool:
+        """Remove the restriction if it is still stored, not replaced by a newer one"""
+        with self._lock:
+            if self._storage.get(restricted.user.id) is not restricted:
+                return False
+            del self._storage[restricted.user.id]
+            if self._journal is not None:
+                self._journal.remove_restriction(self._chat_id, restricted.user.id)
+            return True
 
     def get(self, user: User) -> RestrictedUserDto:
         try:
             return self._storage[user.id]
         except KeyError:
-            self._logger.error(f'Can not get! User @{user.username} not found in restricted users list.')
+            self._logger.error('Can not get! User not found in restricted users list.', extra=log_fields(
+                chat_id=self._chat_id, user_id=user.id, username=user.username,
+            ))
             raise UserNotFoundInStorageError()
@@ -0,0 +1,66 @@
+from typing import Callable, Dict, FrozenSet, Iterable, Optional, Tuple
+
+from telebot.types import Message
+
+from const import RouterSettings, TelegramChatType
+from dto import CommandDto
+from tracing import traced
+
+_UNROUTED = object()
+
+
+class CommandRouter:
+    """
+    Single dispatch stage for chat commands
+
+    Ordinary chat text is rejected by the first character, chat and supergroup checks are done once per message,
+    then the first word is looked up in a dict built from Command constants and their aliases. Commands without
+    arguments, e.g. !rw, match only the command alone. The route is kept on the message, so the filter, the dispatch
+    and get_command() of the handler look it up once.
+    """
+    _chat_ids: FrozenSet[int]
+    _routes: Dict[str, Tuple[CommandDto, Callable]]
+
+    def __init__(self, chat_ids: Iterable[int]):
+        self._chat_ids = frozenset(chat_ids)
+        self._routes = dict()
+
+    def command(self, *commands: CommandDto):
+        def decorator(handler):
+            for command in commands:
+                for name in (command.bot_command,) + command.aliases:
+                    self._routes[name] = (command, handler)
+            return handler
+
+        return decorator
+
+    def _route(self, message: Message) -> Optional[Tuple[CommandDto, Callable]]:
+        route = getattr(message, 'command_route', _UNROUTED)
+        if route is _UNROUTED:
+            route = message.command_route = self._match(message)
+        return route
+
+    @traced
+    def _match(self, message: Message) -> Optional[Tuple[CommandDto, Callable]]:
+        text = message.text
+        if not text or text[0] not in RouterSettings.COMMAND_PREFIXES:
+            return None
+        if message.chat.id not in self._chat_ids or message.chat.type != TelegramChatType.SUPER_GROUP:
+            return None
+        words = text.split(None, 1)
+        route = self._routes.get(words[0].split(RouterSettings.BOT_NAME_SEPARATOR, 1)[0])
+        if route is not None and len(words) > 1 and not route[0].takes_arguments:
+            return None
+        return route
+
+    def get_command(self, message: Message) -> Optional[CommandDto]:
+        route = self._route(message)
+        return route[0] if route else None
+
+    def accepts(self, message: Message) -> bool:
+        return self._route(message) is not None
+
+    def dispatch(self, message: Message):
+        route = self._route(message)
+        if route is not None:
+            return route[1](message)
@@ -0,0 +1,170 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List, Optional
+
+from clock import Clock
+from const import SchedulerSettings, MetricsSettings
+from logs import log_fields
+from metrics import MetricsRegistry
+
+
+class ScheduledTask:
+    __slots__ = ('run_at', 'seq', 'key', 'action', 'args', 'cancelled')
+
+    def __init__(self, run_at: float, seq: int, key: Optional[Hashable], action: Callable, args: tuple):
+        self.run_at = run_at
+        self.seq = seq
+        self.key = key
+        self.action = action
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other: 'ScheduledTask') -> bool:
+        return (self.run_at, self.seq) < (other.run_at, other.seq)
+
+
+class TaskScheduler:
+    """
+    Single-thread timer queue for delayed bot actions
+
+    All pending tasks live in one heap ordered by deadline, so a join flood costs heap entries, not sleeping threads.
+    Tasks scheduled with a key replace the pending task with the same key, e.g. (user_id, 'restore').
+    Due actions are executed by a small worker pool to keep a slow API call from delaying other timers.
+    With metrics, the delay of every action start after its due time is recorded by action name.
+    Deadlines are taken from the clock, so replays with a virtual clock fire timers in virtual time.
+    """
+    _heap: List[ScheduledTask]
+    _keyed: Dict[Hashable, ScheduledTask]
+
+    def __init__(self, logger: logging.Logger, workers: int = SchedulerSettings.WORKER_COUNT,
+                 metrics: MetricsRegistry = None, clock: Clock = None):
+        self._logger = logger
+        self._metrics = metrics
+        self._clock = clock or Clock()
+        self._heap = []
+        self._keyed = dict()
+        self._cancelled = 0
+        self._active = 0  # Tasks submitted to the executor and not finished yet
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scheduled-task')
+        self._thread = None
+        self._running = False
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._heap) - self._cancelled
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._condition:
+            return key in self._keyed
+
+    def idle(self) -> bool:
+        """No task is due or running"""
+        with self._condition:
+            return self._idle_locked()
+
+    def wait_idle(self, timeout: float) -> bool:
+        """Block for up to timeout real seconds until idle(). Returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while not self._idle_locked():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _idle_locked(self) -> bool:
+        return not self._active and not (self._heap and self._heap[0].run_at <= self._clock.monotonic())
+
+    def next_run_at(self) -> Optional[float]:
+        """Clock monotonic time of the nearest pending task, None if nothing is pending"""
+        with self._condition:
+            while self._heap and self._heap[0].cancelled:
+                heapq.heappop(self._heap)
+                self._cancelled -= 1
+            return self._heap[0].run_at if self._heap else None
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='task-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self, wait: bool = True):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if wait and self._thread is not None:
+            self._thread.join()
+        self._executor.shutdown(wait=wait)
+
+    def schedule(self, pause: float, action: Callable, args: tuple = (), key: Hashable = None) -> ScheduledTask:
+        """
+        Run action(*args) after pause seconds
+
+        If key is given, the pending task with the same key (if any) is cancelled and replaced.
+        """
+        with self._condition:
+            task = ScheduledTask(self._clock.monotonic() + max(pause, 0), next(self._counter), key, action, args)
+            if key is not None:
+                self._cancel_locked(key)
+                self._keyed[key] = task
+            heapq.heappush(self._heap, task)
+            if self._heap[0] is task:
+                self._condition.notify()
+        return task
+
+    def cancel(self, key: Hashable) -> bool:
+        """Cancel pending task by key. Returns False if nothing was pending"""
+        with self._condition:
+            return self._cancel_locked(key)
+
+    def _cancel_locked(self, key: Hashable) -> bool:
+        task = self._keyed.pop(key, None)
+        if task is None:
+            return False
+        task.cancelled = True
+        self._cancelled += 1
+        if self._cancelled > SchedulerSettings.COMPACT_MIN_CANCELLED and self._cancelled * 2 > len(self._heap):
+            self._heap = [_ for _ in self._heap if not _.cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled = 0
+        return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and (not self._heap or self._heap[0].run_at > self._clock.monotonic()):
+                    timeout = self._heap[0].run_at - self._clock.monotonic() if self._heap else None
+                    self._clock.wait(self._condition, timeout)
+                if not self._running:
+                    return
+                task = heapq.heappop(self._heap)
+                if task.cancelled:
+                    self._cancelled -= 1
+                    continue
+                if task.key is not None:
+                    del self._keyed[task.key]
+                self._active += 1
+            self._executor.submit(self._execute, task)
+
+    def _execute(self, task: ScheduledTask):
+        if self._metrics is not None:
+            lag = self._clock.monotonic() - task.run_at
+            self._metrics.observe(MetricsSettings.SCHEDULER_LAG, (getattr(task.action, '__name__', 'task'),), lag)
+        try:
+            task.action(*task.args)
+        except Exception as e:
+            self._logger.error('Scheduled task failed', extra=log_fields(action=task.action, error=e))
+        finally:
+            with self._condition:
+                self._active -= 1
+                self._condition.notify_all()
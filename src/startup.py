@@ -0,0 +1,80 @@
+import builtins
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+from const import StartupSettings
+
+
+class StartupProfiler:
+    """
+    Import and startup time report
+
+    install() times every first import of a module from the main thread, component() times
+    application components construction. Both are reported with inclusive and self time.
+    """
+    _imports: Dict[str, Tuple[float, float]]
+    _components: Dict[str, Tuple[float, float]]
+
+    def __init__(self):
+        self._started = time.perf_counter()
+        self._imports = dict()
+        self._components = dict()
+        self._local = threading.local()
+        self._original_import = None
+        self._ready_time = None
+
+    @property
+    def ready_time(self) -> float:
+        """Seconds from profiler creation to ready(), None before it"""
+        return self._ready_time
+
+    def install(self):
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules or threading.current_thread() is not threading.main_thread():
+            return self._original_import(name, globals, locals, fromlist, level)
+        with self._measure(self._imports, name):
+            return self._original_import(name, globals, locals, fromlist, level)
+
+    def component(self, name: str):
+        return self._measure(self._components, name)
+
+    @contextmanager
+    def _measure(self, timings: Dict[str, Tuple[float, float]], name: str):
+        stack = self._local.__dict__.setdefault('stack', [])
+        nested = [0.0]
+        stack.append(nested)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            stack.pop()
+            if stack:
+                stack[-1][0] += elapsed
+            timings[name] = (elapsed, elapsed - nested[0])
+
+    def ready(self) -> float:
+        """Mark bot as ready to receive updates. Returns seconds since profiler creation"""
+        if self._ready_time is None:
+            self._ready_time = time.perf_counter() - self._started
+            self.uninstall()
+        return self._ready_time
+
+    def report(self, limit: int = StartupSettings.REPORT_LIMIT) -> str:
+        lines = [f'Startup profile, ready in {(self._ready_time or 0) * 1000:.1f}ms']
+        for title, timings in ('imports', self._imports), ('components', self._components):
+            lines.append(f'{title}: {len(timings)}, total self {sum(_[1] for _ in timings.values()) * 1000:.1f}ms')
+            for name, (total, own) in sorted(timings.items(), key=lambda _: _[1][1], reverse=True)[:limit]:
+                lines.append(f'  {own * 1000:8.1f}ms self {total * 1000:8.1f}ms total  {name}')
+        return '\n'.join(lines)
@@ -0,0 +1,203 @@
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import yaml
+
+from admin_cache import AdminCache
+from bot import RudeBot
+from clock import Clock
+from const import GreetingDefaultSettings, RestrictDuration, BanDuration, DurationSettings, BaseDuration, FloodSettings
+from dto import ChatConfigDto, DurationDto
+from error import ChatConfigLoadError
+from flood import FloodDetector
+from greeting import NewbieStorage, QuestionProvider, YamlLoader
+from member_cache import MemberCache
+from metrics import MetricsRegistry
+from notification import Notification
+from persistence import StateJournal
+from raid import RaidGuard
+from restriction import RestrictionStorage
+from scheduler import TaskScheduler
+from utils import BotUtils
+
+
+class ChatConfigLoader:
+    """
+    Moderated chats settings
+
+    Chats file lists chats with optional questions file, restrict/ban duration limits, notification
+    template lists and flood thresholds. Without chats file the bot moderates TELEGRAM_CHAT_ID chat
+    with default settings.
+    """
+
+    @staticmethod
+    def default(chat_id: int) -> ChatConfigDto:
+        return ChatConfigDto(
+            chat_id=chat_id,
+            questions_file=GreetingDefaultSettings.GREETING_QUESTIONS_FILE,
+            restrict_duration=RestrictDuration,
+            ban_duration=BanDuration,
+            notifications=dict(),
+        )
+
+    @staticmethod
+    def load(file_path: Path) -> List[ChatConfigDto]:
+        try:
+            source = yaml.load(file_path.read_bytes(), Loader=YamlLoader)
+        except (OSError, yaml.YAMLError) as e:
+            raise ChatConfigLoadError(f'Can not read chats file {file_path}: {e}')
+
+        chats = source.get('chats') if isinstance(source, dict) else None
+        if not isinstance(chats, list) or not chats:
+            raise ChatConfigLoadError(f'No chats in chats file {file_path}')
+
+        result = [ChatConfigLoader._parse_chat(chat) for chat in chats]
+        if len({_.chat_id for _ in result}) != len(result):
+            raise ChatConfigLoadError(f'Duplicate chat ids in chats file {file_path}')
+        return result
+
+    @staticmethod
+    def _parse_chat(chat) -> ChatConfigDto:
+        if not isinstance(chat, dict) or not isinstance(chat.get('chat_id'), int):
+            raise ChatConfigLoadError(f'Malformed chat settings: {chat}')
+
+        notifications = chat.get('notifications', dict())
+        if not isinstance(notifications, dict) or not all(
+                isinstance(templates, list) and templates for templates in notifications.values()):
+            raise ChatConfigLoadError(f'Malformed notifications of chat {chat["chat_id"]}: {notifications}')
+
+        return ChatConfigDto(
+            chat_id=chat['chat_id'],
+            questions_file=Path(chat.get('questions_file', GreetingDefaultSettings.GREETING_QUESTIONS_FILE)),
+            restrict_duration=ChatConfigLoader._duration_class(RestrictDuration, chat.get('restrict_duration')),
+            ban_duration=ChatConfigLoader._duration_class(BanDuration, chat.get('ban_duration')),
+            notifications=notifications,
+            flood_thresholds=ChatConfigLoader._flood_thresholds(chat.get('flood')),
+        )
+
+    @staticmethod
+    def _flood_thresholds(settings) -> Optional[Dict[str, Tuple[Optional[int], ...]]]:
+        """Messages per flood window by content type, e.g. {messages: [8, 30, null]}, null turns a window off"""
+        if not settings:
+            return None
+        if not isinstance(settings, dict) or not set(settings) <= set(FloodSettings.THRESHOLDS):
+            raise ChatConfigLoadError(f'Malformed flood settings: {settings}')
+
+        thresholds = dict(FloodSettings.THRESHOLDS)
+        for content_type, values in settings.items():
+            if not isinstance(values, list) or len(values) != len(FloodSettings.WINDOWS) or not all(
+                    _ is None or isinstance(_, int) and 0 < _ < 0xFFFF for _ in values):
+                raise ChatConfigLoadError(f'Malformed flood thresholds of {content_type}: {values}')
+            thresholds[content_type] = tuple(values)
+        return thresholds
+
+    @staticmethod
+    def _duration_class(base: type, settings) -> type:
+        """Subclass of base duration with chat specific default and max durations, e.g. {default: 10m, max: 1d}"""
+        if not settings:
+            return base
+        if not isinstance(settings, dict):
+            raise ChatConfigLoadError(f'Malformed duration settings: {settings}')
+
+        attributes = dict()
+        if 'default' in settings:
+            amount, unit_name = ChatConfigLoader._parse_term(settings['default'], base.DEFAULT_UNIT)
+            attributes.update(DEFAULT_DURATION=amount, DEFAULT_UNIT=unit_name)
+        if 'max' in settings:
+            amount, unit_name = ChatConfigLoader._parse_term(settings['max'], base.DEFAULT_UNIT)
+            unit = BaseDuration.UNITS[unit_name]
+            attributes['MAX_DURATION'] = DurationDto(
+                seconds=amount * unit['rate'],
+                text=BotUtils.render_amount(amount, unit_name, unit['plural_forms']),
+            )
+            if attributes['MAX_DURATION'].seconds < base.MIN_DURATION.seconds:
+                raise ChatConfigLoadError(f'Max duration {settings["max"]} is less than {base.MIN_DURATION.text}')
+        return type(base.__name__, (base,), attributes)
+
+    @staticmethod
+    def _parse_term(value, default_unit: str) -> tuple:
+        term = DurationSettings.TERM_PATTERN.fullmatch(str(value).strip())
+        if term is None:
+            raise ChatConfigLoadError(f'Malformed duration: {value}')
+        return int(term.group(1)), term.group(2) or default_unit
+
+
+class ChatContext:
+    """
+    One moderated chat
+
+    Storages, notifications, durations, raid and flood detection belong to the chat. Bot, scheduler, admin and member
+    caches and journal are shared by all chats of the process, their records are keyed by chat id.
+    """
+
+    def __init__(
+            self,
+            config: ChatConfigDto,
+            bot: RudeBot,
+            scheduler: TaskScheduler,
+            admin_cache: AdminCache,
+            journal: StateJournal,
+            questions: QuestionProvider,
+            logger: logging.Logger,
+            clock: Clock = None,
+            member_cache: MemberCache = None,
+            metrics: MetricsRegistry = None,
+    ):
+        self._config = config
+        self._questions = questions
+        self._notification = Notification(config.notifications)
+        self._methods = BotUtils(
+            bot,
+            config.chat_id,
+            self._notification,
+            NewbieStorage(logger, journal, config.chat_id, clock),
+            RestrictionStorage(logger, journal, config.chat_id, clock),
+            scheduler,
+            admin_cache,
+            logger,
+            clock,
+            member_cache,
+        )
+        self._raid_guard = RaidGuard(bot, scheduler, self._notification, logger, clock=clock, metrics=metrics)
+        self._flood_detector = FloodDetector(config.flood_thresholds)
+
+    @property
+    def chat_id(self) -> int:
+        return self._config.chat_id
+
+    @property
+    def methods(self) -> BotUtils:
+        return self._methods
+
+    @property
+    def notification(self) -> Notification:
+        return self._notification
+
+    @property
+    def newbie_storage(self) -> NewbieStorage:
+        return self._methods.newbie_storage
+
+    @property
+    def restriction_storage(self) -> RestrictionStorage:
+        return self._methods.restriction_storage
+
+    @property
+    def raid_guard(self) -> RaidGuard:
+        return self._raid_guard
+
+    @property
+    def flood_detector(self) -> FloodDetector:
+        return self._flood_detector
+
+    @property
+    def questions(self) -> QuestionProvider:
+        return self._questions
+
+    @property
+    def restrict_duration(self) -> type:
+        return self._config.restrict_duration
+
+    @property
+    def ban_duration(self) -> type:
+        return self._config.ban_duration
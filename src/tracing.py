@@ -0,0 +1,202 @@
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+from functools import wraps
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from const import TracingSettings
+
+_local = threading.local()
+
+
+class Trace:
+    """Spans of one update handled by one thread"""
+    __slots__ = ('update_id', 'thread_id', 'spans')
+
+    def __init__(self, update_id: Optional[int]):
+        self.update_id = update_id
+        self.thread_id = threading.get_ident()
+        self.spans = []  # (name, started, ended)
+
+    def add(self, name: str, started: float, ended: float):
+        self.spans.append((name, started, ended))
+
+
+def current_trace() -> Optional[Trace]:
+    """Sampled trace of the update handled by the current thread, None if there is none"""
+    return _local.__dict__.get('trace')
+
+
+def traced(function: Callable, name: str = None) -> Callable:
+    """
+    Record a span for every call made while a sampled trace is active
+
+    Without an active trace the wrapper costs one thread-local lookup.
+    """
+    span_name = name or function.__qualname__
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        trace = _local.__dict__.get('trace')
+        if trace is None:
+            return function(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            trace.add(span_name, started, time.perf_counter())
+
+    return wrapper
+
+
+class Tracer:
+    """
+    Sampled per-update traces and slow handler watchdog
+
+    handler() wraps update handlers: a sampled share of updates gets a trace, which collects spans of traced
+    functions called by the handler thread, and is written to a rotating file in Chrome trace event format
+    (chrome://tracing, Perfetto). Every handler running longer than budget gets its stack logged once.
+    """
+    _running: Dict[int, Tuple[float, str, Optional[int]]]
+
+    def __init__(
+            self,
+            logger: logging.Logger,
+            file_path: Path = None,
+            sample_rate: float = TracingSettings.DEFAULT_SAMPLE_RATE,
+            budget: float = TracingSettings.DEFAULT_BUDGET,
+            max_bytes: int = TracingSettings.MAX_BYTES,
+            backup_count: int = TracingSettings.BACKUP_COUNT,
+    ):
+        self._logger = logger
+        self._file_path = file_path
+        self._sample_rate = sample_rate if file_path is not None else 0.0
+        self._budget = budget
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._running = dict()
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._stopped.clear()
+        self._threads = [threading.Thread(target=self._watch, name='slow-handler-watchdog', daemon=True)]
+        if self._sample_rate:
+            self._threads.append(threading.Thread(target=self._write, name='trace-writer', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def handler(self, function: Callable) -> Callable:
+        """Update handler wrapper, update id is taken from update_id attribute of the first argument"""
+        name = function.__name__
+        nested = traced(function, name)
+
+        @wraps(function)
+        def wrapper(update_object, *args, **kwargs):
+            ident = threading.get_ident()
+            if ident in self._running:  # Nested handler, e.g. command handler called by the router
+                return nested(update_object, *args, **kwargs)
+
+            update_id = getattr(update_object, 'update_id', None)
+            started = time.perf_counter()
+            self._running[ident] = (started, name, update_id)
+            trace = None
+            if self._sample_rate and random.random() < self._sample_rate:
+                trace = _local.trace = Trace(update_id)
+            try:
+                return function(update_object, *args, **kwargs)
+            finally:
+                ended = time.perf_counter()
+                del self._running[ident]
+                if trace is not None:
+                    _local.trace = None
+                    trace.add(name, started, ended)
+                    self._queue.put(trace)
+
+        return wrapper
+
+    def _watch(self):
+        reported = set()
+        interval = max(self._budget / 4, TracingSettings.MIN_WATCHDOG_INTERVAL)
+        while not self._stopped.wait(interval):
+            running = list(self._running.items())
+            reported &= {(ident, started) for ident, (started, _, _) in running}
+            now = time.perf_counter()
+            frames = None
+            for ident, (started, name, update_id) in running:
+                if now - started < self._budget or (ident, started) in reported:
+                    continue
+                frames = frames or sys._current_frames()
+                frame = frames.get(ident)
+                stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+                self._logger.warning(
+                    f'Handler {name} of update {update_id} runs for {now - started:.1f}s, '
+                    f'budget {self._budget}s:\n{stack}'
+                )
+                reported.add((ident, started))
+
+    def _write(self):
+        file = None
+        while True:
+            trace = self._queue.get()
+            if trace is None:
+                break
+            try:
+                if file is None:
+                    file = self._open()
+                file.write(''.join(json.dumps(event) + ',\n' for event in self.events(trace)))
+                if self._queue.empty():
+                    file.flush()
+                if file.tell() > self._max_bytes:
+                    file.close()
+                    file = self._open()
+            except OSError as e:
+                self._logger.error(f'Can not write trace to {self._file_path}: {e}')
+                file = None
+        if file is not None:
+            file.close()
+
+    def _open(self):
+        """New trace file, previous files are shifted to .1, .2, ..."""
+        path = self._file_path
+        if path.exists() and path.stat().st_size:
+            for index in range(self._backup_count - 1, 0, -1):
+                backup = path.with_name(f'{path.name}.{index}')
+                if backup.exists():
+                    backup.replace(path.with_name(f'{path.name}.{index + 1}'))
+            if self._backup_count:
+                path.replace(path.with_name(f'{path.name}.1'))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        file = path.open('w', encoding='utf8')
+        file.write('[\n')  # Trace viewers accept the array without closing bracket
+        return file
+
+    @staticmethod
+    def events(trace: Trace) -> List[dict]:
+        pid = os.getpid()
+        return [
+            dict(
+                name=name,
+                ph='X',
+                ts=round(started * 1e6),
+                dur=round((ended - started) * 1e6),
+                pid=pid,
+                tid=trace.thread_id,
+                args=dict(update_id=trace.update_id),
+            ) for name, started, ended in trace.spans
+        ]
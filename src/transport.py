@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from telebot import apihelper
+from telebot.apihelper import ApiException
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+
+from const import TransportSettings, MetricsSettings
+from metrics import MetricsRegistry
+from tracing import current_trace
+
+
+class ApiTransport:
+    """
+    Shared keep-alive HTTP session for Telegram API calls
+
+    Locked pyTelegramBotAPI version opens a session per thread with global timeouts. install() replaces
+    apihelper._make_request, so all bot threads share one connection pool, and getUpdates long polling
+    uses its own timeouts instead of the ones for short command calls. With metrics, request duration
+    and failures by error code are recorded per API method.
+    """
+
+    def __init__(
+            self,
+            logger: logging.Logger,
+            pool_size: int = TransportSettings.DEFAULT_POOL_SIZE,
+            command_timeout: tuple = (TransportSettings.COMMAND_CONNECT_TIMEOUT, TransportSettings.COMMAND_READ_TIMEOUT),
+            long_poll_connect_timeout: float = TransportSettings.LONG_POLL_CONNECT_TIMEOUT,
+            metrics: MetricsRegistry = None,
+    ):
+        self._logger = logger
+        self._metrics = metrics
+        self._command_timeout = command_timeout
+        self._long_poll_connect_timeout = long_poll_connect_timeout
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._connections = 0
+        self._original_make_request = None
+
+        transport = self
+
+        def counting_pool(pool_class):
+            class CountingPool(pool_class):
+                def _new_conn(self):
+                    with transport._lock:
+                        transport._connections += 1
+                    return super()._new_conn()
+
+            return CountingPool
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        adapter.poolmanager.pool_classes_by_scheme = dict(
+            http=counting_pool(HTTPConnectionPool),
+            https=counting_pool(HTTPSConnectionPool),
+        )
+        self._session = requests.Session()
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                requests=self._requests,
+                connections=self._connections,
+                reuse_ratio=1 - self._connections / self._requests if self._requests else 0.0,
+            )
+
+    def install(self):
+        self._original_make_request = apihelper._make_request
+        apihelper._make_request = self.make_request
+
+    def uninstall(self):
+        if self._original_make_request is not None:
+            apihelper._make_request = self._original_make_request
+            self._original_make_request = None
+
+    def make_request(self, token: str, method_name: str, method: str = 'get', params: dict = None, files=None):
+        if files:
+            return self._original_make_request(token, method_name, method, params, files)
+
+        if apihelper.API_URL is None:
+            request_url = 'https://api.telegram.org/bot{0}/{1}'.format(token, method_name)
+        else:
+            request_url = apihelper.API_URL.format(token, method_name)
+
+        timeout = self._command_timeout
+        if params and 'timeout' in params:  # Long polling
+            timeout = (self._long_poll_connect_timeout, params['timeout'] + TransportSettings.LONG_POLL_READ_EXTRA)
+
+        with self._lock:
+            self._requests += 1
+        started = time.perf_counter()
+        try:
+            result = self._session.request(method, request_url, params=params, timeout=timeout, proxies=apihelper.proxy)
+            return apihelper._check_result(method_name, result)['result']
+        except ApiException as e:
+            self._count_error(method_name, str(e.result.status_code))
+            raise
+        except requests.RequestException:
+            self._count_error(method_name, 'network')
+            raise
+        finally:
+            ended = time.perf_counter()
+            if self._metrics is not None:
+                self._metrics.observe(MetricsSettings.API_LATENCY, (method_name,), ended - started)
+            trace = current_trace()
+            if trace is not None:
+                trace.add(f'api.{method_name}', started, ended)
+
+    def _count_error(self, method_name: str, code: str):
+        if self._metrics is not None:
+            self._metrics.inc(MetricsSettings.API_ERRORS, (method_name, code))
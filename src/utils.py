@@ -1,49 +1,80 @@
 import logging
-import threading
-import time
+from concurrent.futures import Future
+from functools import lru_cache
 
-from telebot import TeleBot
 from telebot.apihelper import ApiException
 from telebot.types import User, Message
 
-from const import RestrictDuration, TelegramParseMode, Command, BanDuration, TelegramChatType, PunishmentDuration, \
-    BaseDuration
+from admin_cache import AdminCache
+from bot import RudeBot
+from clock import Clock
+from const import RestrictDuration, TelegramParseMode, Command, BanDuration, PunishmentDuration, \
+    BaseDuration, ScheduledTaskKey, DurationSettings, StateSettings
 from dto import DurationDto, PluralFormsDto, RestrictedUserDto, NewbieDto, RestrictionDto, CommandDto
-from error import ParseBanDurationError, InvalidConditionError, UserNotFoundInStorageError
+from error import ParseBanDurationError, InvalidConditionError, StorageFullError
 from greeting import NewbieStorage
+from logs import log_fields
+from member_cache import MemberCache
 from notification import Notification
 from restriction import RestrictionStorage
+from scheduler import TaskScheduler
+from tracing import traced
 
 
 class BotUtils:
-    _bot: TeleBot
+    _bot: RudeBot
     _chat_id: int
     _notification: Notification
     _newbie_storage: NewbieStorage
     _restriction_storage: RestrictionStorage
+    _scheduler: TaskScheduler
+    _admin_cache: AdminCache
     _logger: logging.Logger
+    _clock: Clock
+    _member_cache: MemberCache
 
     def __init__(
             self,
-            bot: TeleBot,
-            chat_id: str,
+            bot: RudeBot,
+            chat_id: int,
             notification: Notification,
             newbie_storage: NewbieStorage,
             restriction_storage: RestrictionStorage,
+            scheduler: TaskScheduler,
+            admin_cache: AdminCache,
             logger: logging.Logger,
+            clock: Clock = None,
+            member_cache: MemberCache = None,
     ):
         self._bot = bot
         self._chat_id = int(chat_id)
         self._notification = notification
         self._newbie_storage = newbie_storage
         self._restriction_storage = restriction_storage
+        self._scheduler = scheduler
+        self._admin_cache = admin_cache
         self._logger = logger
+        self._clock = clock or Clock()
+        self._member_cache = member_cache or MemberCache(bot, logger, clock=self._clock)
 
     @property
     def chat_id(self) -> int:
         return self._chat_id
 
+    @property
+    def newbie_storage(self) -> NewbieStorage:
+        return self._newbie_storage
+
+    @property
+    def restriction_storage(self) -> RestrictionStorage:
+        return self._restriction_storage
+
+    def task_key(self, user_id: int, task_name: str) -> tuple:
+        """Scheduled task key of a chat member, the same user may have pending tasks in several chats"""
+        return self._chat_id, user_id, task_name
+
     @staticmethod
+    @traced
     def prepare_query(text: str) -> str:
         """
         Get text without command
@@ -52,36 +83,55 @@ class BotUtils:
         """
         return ' '.join(text.split()[1:])
 
+    @traced
     def get_duration(self, text: str, duration_class: BaseDuration) -> DurationDto:
-        if text == '':
-            return self.get_duration(f'{duration_class.DEFAULT_DURATION}{duration_class.DEFAULT_UNIT}', duration_class)
-
-        try:
-            amount = int(text)
-            return self.get_duration(f'{amount}{duration_class.DEFAULT_UNIT}', duration_class)
-        except ValueError:
-            pass
+        """
+        Parse duration like "30", "5m", "1h30m" or "2d 4h"
 
-        try:
-            amount = int(text[:-1])
-            unit = duration_class.UNITS[text[-1]]
+        Amount without unit is counted in DEFAULT_UNIT, result is clamped to MIN_DURATION and MAX_DURATION.
+        """
+        if not isinstance(duration_class, type):
+            duration_class = type(duration_class)
+        return self._parse_duration(text.strip(), duration_class)
 
-            duration_seconds = int(amount * unit['rate'])
+    @staticmethod
+    @lru_cache(maxsize=DurationSettings.CACHE_SIZE)
+    def _parse_duration(text: str, duration_class: type) -> DurationDto:
+        if text == '':
+            text = f'{duration_class.DEFAULT_DURATION}{duration_class.DEFAULT_UNIT}'
+
+        sign = DurationSettings.SIGNS.get(text[0], 1)
+        duration_seconds = 0
+        duration_text = []
+        position = 1 if text[0] in DurationSettings.SIGNS else 0
+        while position < len(text):
+            term = DurationSettings.TERM_PATTERN.match(text, position)
+            if term is None:
+                raise ParseBanDurationError
+            amount, unit_name = int(term.group(1)), term.group(2) or duration_class.DEFAULT_UNIT
+            unit = duration_class.UNITS[unit_name]
+            duration_seconds += amount * unit['rate']
+            duration_text.append(BotUtils.render_amount(amount, unit_name, unit['plural_forms']))
+            position = term.end()
+        if not duration_text:  # A sign alone
+            raise ParseBanDurationError
+        duration_seconds *= sign
 
-            if duration_seconds < duration_class.MIN_DURATION.seconds:
-                return duration_class.MIN_DURATION
+        if duration_seconds < duration_class.MIN_DURATION.seconds:
+            return duration_class.MIN_DURATION
 
-            if duration_seconds > duration_class.MAX_DURATION.seconds:
-                return duration_class.MAX_DURATION
+        if duration_seconds > duration_class.MAX_DURATION.seconds:
+            return duration_class.MAX_DURATION
 
-            duration_unit = self.get_plural(amount, unit['plural_forms'])
+        return DurationDto(
+            seconds=duration_seconds,
+            text=' '.join(duration_text),
+        )
 
-            return DurationDto(
-                seconds=duration_seconds,
-                text=f'{amount} {duration_unit}',
-            )
-        except (ValueError, KeyError, IndexError):
-            raise ParseBanDurationError
+    @staticmethod
+    @lru_cache(maxsize=DurationSettings.CACHE_SIZE)
+    def render_amount(amount: int, unit_name: str, plural_forms: PluralFormsDto) -> str:
+        return f'{amount} {BotUtils.get_plural(amount, plural_forms)}'
 
     @staticmethod
     def get_plural(amount: int, plural_forms: PluralFormsDto) -> str:
@@ -94,29 +144,45 @@ class BotUtils:
         return plural_forms.form_3
 
     @staticmethod
+    @traced
     def mention(user: User):
         return f'[{user.first_name}](tg://user?id={user.id})'
 
+    @traced
     def delete_chat_message(self, message: Message):
-        try:
-            self._bot.delete_message(message.chat.id, message.message_id)
-        except ApiException:
-            self._logger.error(f'Can not delete chat message {message}')
+        def check_result(future):
+            if future.exception() is not None:
+                self._logger.error('Can not delete chat message', extra=log_fields(
+                    chat_id=message.chat.id, message_id=message.message_id,
+                ))
+
+        self._bot.enqueue('delete_message', message.chat.id, message.message_id).add_done_callback(check_result)
+
+    def _delete_sent_message(self, future: Future):
+        """Done callback deleting an enqueued send_message result"""
+        if future.exception() is None:
+            self.delete_chat_message(future.result())
 
+    @traced
     def remove_inline_keyboard(self, message: Message):
-        try:
-            self._logger.debug(f'Trying to edit {message}')
-            self._bot.edit_message_text(
-                message.html_text,
-                chat_id=message.chat.id,
-                message_id=message.message_id,
-                parse_mode=TelegramParseMode.HTML,
-            )
-        except ApiException:
-            self._logger.error(f'Can not edit chat message {message}')
+        def check_result(future):
+            if future.exception() is not None:
+                self._logger.error('Can not edit chat message', extra=log_fields(
+                    chat_id=message.chat.id, message_id=message.message_id,
+                ))
+
+        self._logger.debug('Trying to remove inline keyboard', extra=log_fields(
+            chat_id=message.chat.id, message_id=message.message_id,
+        ))
+        self._bot.enqueue(
+            'edit_message_reply_markup',
+            chat_id=message.chat.id,
+            message_id=message.message_id,
+        ).add_done_callback(check_result)
 
+    @traced
     def check_current_restrictions(self, user: User, message: Message, duration: DurationDto, command: CommandDto):
-        chat_member = self._bot.get_chat_member(message.chat.id, user.id)
+        chat_member = self._member_cache.get(message.chat.id, user.id)
 
         restriction_list = {
             Command.RO: RestrictionDto(
@@ -141,10 +207,17 @@ class BotUtils:
             restore_at=message.date + duration.seconds,
         )
 
-        self._restriction_storage.add(restricted_user)
+        try:
+            self._restriction_storage.add(restricted_user)
+        except StorageFullError:
+            return  # The new restriction is applied anyway, only the custom one is not restored
+        restore_key = self.task_key(user.id, ScheduledTaskKey.RESTORE)
         if not restricted_user.until_date or restricted_user.until_date > message.date + duration.seconds:
-            self.create_scheduled_threat(duration.seconds, self.restore_restriction, (restricted_user,))
+            self.create_scheduled_threat(duration.seconds, self.restore_restriction, (restricted_user,), restore_key)
+        else:
+            self._scheduler.cancel(restore_key)
 
+    @traced
     def set_read_only(self, user: User, message: Message, duration: DurationDto) -> str:
         self.check_current_restrictions(
             user=user,
@@ -165,6 +238,7 @@ class BotUtils:
         )
         return restriction_text
 
+    @traced
     def set_text_only(self, user: User, message: Message, duration: DurationDto) -> str:
         self.check_current_restrictions(
             user=user,
@@ -187,6 +261,7 @@ class BotUtils:
 
         return restriction_text
 
+    @traced
     def set_punishment(self, user: User, message: Message) -> str:
         duration = PunishmentDuration.DURATION
         self.set_read_only(
@@ -201,7 +276,10 @@ class BotUtils:
 
         return restriction_text
 
+    @traced
     def set_read_write(self, user: User, message: Message) -> str:
+        self._scheduler.cancel(self.task_key(user.id, ScheduledTaskKey.RESTORE))
+        self._restriction_storage.remove(user)
         self._bot.restrict_chat_member(
             chat_id=message.chat.id,
             user_id=user.id,
@@ -214,6 +292,7 @@ class BotUtils:
 
         return restriction_text
 
+    @traced
     def ban_kick(self, user: User, message: Message, duration: DurationDto) -> str:
         self._newbie_storage.remove(user)
 
@@ -222,7 +301,9 @@ class BotUtils:
             user_id=user.id,
             until_date=message.date + duration.seconds,
         )
-        self._logger.info(f'@{user.username} was banned by {message.from_user.username} for {duration.text}.')
+        self._logger.info('Chat member was banned', extra=log_fields(
+            chat_id=message.chat.id, username=user.username, admin=message.from_user.username, duration=duration.text,
+        ))
 
         duration_text = duration.text
         if duration.seconds > 0:
@@ -232,49 +313,104 @@ class BotUtils:
 
         return kick_text
 
-    def create_scheduled_threat(self, pause: int, action, args: tuple):
-        threading.Thread(target=self._handle_scheduled_task, args=(pause, action, args,)).start()
+    @traced
+    def create_scheduled_threat(self, pause: int, action, args: tuple, key: tuple = None):
+        """
+        Schedule action(*args) after pause seconds
 
-    @staticmethod
-    def _handle_scheduled_task(pause: int, action, args: tuple):
-        time.sleep(pause)
-        action(*args)
+        Tasks with the same key replace each other, e.g. a new !ro replaces the pending restore of the user.
+        """
+        self._scheduler.schedule(pause=pause, action=action, args=args, key=key)
+
+    @traced
+    def cancel_scheduled_threat(self, key: tuple) -> bool:
+        return self._scheduler.cancel(key)
 
+    @traced
+    def evict_expired(self):
+        """Evict newbies and restrictions past their deadlines, then again every EVICTION_INTERVAL seconds"""
+        try:
+            newbies = self._newbie_storage.evict_expired()
+            restrictions = self._restriction_storage.evict_expired()
+            if newbies or restrictions:
+                self._logger.info('Expired state evicted', extra=log_fields(
+                    chat_id=self._chat_id, newbies=newbies, restrictions=restrictions,
+                ))
+        finally:
+            self.create_scheduled_threat(
+                pause=StateSettings.EVICTION_INTERVAL,
+                action=self.evict_expired,
+                args=(),
+                key=(self._chat_id, ScheduledTaskKey.EVICTION),
+            )
+
+    @traced
+    def restore_scheduled_threats(self):
+        """
+        Re-arm timeout kicks and restriction restores loaded from persistent storages
+
+        Overdue tasks are fired right away.
+        """
+        now = self._clock.time()
+        for newbie in list(self._newbie_storage):
+            if newbie.greeting is None:
+                self._newbie_storage.remove(newbie.user)
+                continue
+            self.create_scheduled_threat(
+                pause=newbie.timeout - now,
+                action=self.timeout_kick,
+                args=(newbie,),
+                key=self.task_key(newbie.user.id, ScheduledTaskKey.TIMEOUT_KICK),
+            )
+
+        for restricted in list(self._restriction_storage):
+            if restricted.until_date and restricted.until_date <= restricted.restore_at:
+                continue
+            self.create_scheduled_threat(
+                pause=restricted.restore_at - now,
+                action=self.restore_restriction,
+                args=(restricted,),
+                key=self.task_key(restricted.user.id, ScheduledTaskKey.RESTORE),
+            )
+
+    @traced
     def timeout_kick(self, newbie: NewbieDto):
+        """Kick a newbie, without a greeting yet (rejoined while it is being sent) the notice replies to nothing"""
         greeting_message = newbie.greeting
         user = newbie.user
-        if user.id not in self._newbie_storage.get_user_list():
+        if not self._newbie_storage.take(newbie):  # Answered, passed or kicked meanwhile
             return
 
-        self._newbie_storage.remove(user)
-        self.remove_inline_keyboard(greeting_message)
+        if greeting_message is not None:
+            self.remove_inline_keyboard(greeting_message)
 
         kick_text = self._notification.timeout_kick(user.first_name)
-        kick_message = self._bot.send_message(
-            chat_id=greeting_message.chat.id,
+        kick_message = self._bot.enqueue(
+            'send_message',
+            chat_id=self._chat_id,
             text=f'*{kick_text}*',
-            reply_to_message_id=greeting_message.message_id,
+            reply_to_message_id=greeting_message.message_id if greeting_message is not None else None,
             parse_mode=TelegramParseMode.MARKDOWN
         )
         try:
             self._bot.kick_chat_member(
-                chat_id=greeting_message.chat.id,
+                chat_id=self._chat_id,
                 user_id=user.id,
-                until_date=kick_message.date + BanDuration.AUTO_KICK_DURATION_SECONDS,
+                until_date=int(self._clock.time()) + BanDuration.AUTO_KICK_DURATION_SECONDS,
             )
-            self._logger.info(f'@{user.username} was kicked from chat due greeting timeout.')
+            self._logger.info('Chat member was kicked due greeting timeout', extra=log_fields(
+                chat_id=self._chat_id, user_id=user.id, username=user.username,
+            ))
         except ApiException:
-            self._logger.error(f'Can not kick chat member @{user.username}')
-            self.delete_chat_message(kick_message)
+            self._logger.error('Can not kick chat member', extra=log_fields(
+                chat_id=self._chat_id, user_id=user.id, username=user.username,
+            ))
+            kick_message.add_done_callback(self._delete_sent_message)
 
+    @traced
     def restore_restriction(self, restricted: RestrictedUserDto):
         try:
-            try:
-                actual_restricted = self._restriction_storage.get(restricted.user)
-            except UserNotFoundInStorageError:
-                raise InvalidConditionError()
-
-            if actual_restricted.restore_at != restricted.restore_at:
+            if not self._restriction_storage.take(restricted):  # Lifted or replaced by a newer one meanwhile
                 raise InvalidConditionError()
 
             self._bot.restrict_chat_member(
@@ -282,38 +418,23 @@ class BotUtils:
                 user_id=restricted.user.id,
                 until_date=max(
                     restricted.until_date,
-                    time.time() + RestrictDuration.UNSAFE_DURATION_SECONDS
+                    self._clock.time() + RestrictDuration.UNSAFE_DURATION_SECONDS
                 ),
                 can_send_messages=restricted.restriction.messages,
                 can_send_media_messages=restricted.restriction.media,
                 can_send_other_messages=restricted.restriction.other,
                 can_add_web_page_previews=restricted.restriction.web_preview,
             )
-            self._logger.info(
-                f'Custom restriction was restored for @{restricted.user.username}. {restricted.restriction.__dict__}'
-            )
+            self._logger.info('Custom restriction was restored', extra=log_fields(
+                chat_id=restricted.chat_id, user_id=restricted.user.id, username=restricted.user.username,
+            ))
         except ApiException:
-            self._logger.error(f'Can not set custom restriction for chat member @{restricted.user.username}')
+            self._logger.error('Can not set custom restriction for chat member', extra=log_fields(
+                chat_id=restricted.chat_id, user_id=restricted.user.id, username=restricted.user.username,
+            ))
         except InvalidConditionError:
             pass
 
-    def rude_qa_only(self, handler):
-        def wrapper(message: Message):
-            if message.chat.id == self.chat_id:
-                return handler(message)
-
-        return wrapper
-
-    @staticmethod
-    def supergroup_only(handler):
-        def wrapper(message: Message):
-            try:
-                if message.chat.type == TelegramChatType.SUPER_GROUP:
-                    return handler(message)
-            except TypeError:
-                pass
-
-        return wrapper
-
+    @traced
     def is_admin(self, user: User):
-        return user.id in [_.user.id for _ in self._bot.get_chat_administrators(self.chat_id)]
+        return self._admin_cache.is_admin(self.chat_id, user.id)
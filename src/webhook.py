@@ -0,0 +1,96 @@
+import hmac
+import json
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable
+
+from bot import RudeBot
+from const import WebhookSettings
+from logs import log_fields
+
+
+class WebhookServer:
+    """
+    Embedded HTTP server receiving Telegram updates
+
+    Requests are checked against the secret token header, decoded and passed to the bot handlers.
+    Both a single update object and a list of updates are accepted as request body.
+    A consumer, e.g. WorkerSupervisor.dispatch, may take decoded json updates instead of the bot.
+    Malformed updates are logged and acknowledged, Telegram redelivers any update answered with an error.
+    """
+
+    def __init__(self, bot: RudeBot, secret_token: str, logger: logging.Logger,
+                 host: str = WebhookSettings.DEFAULT_HOST, port: int = WebhookSettings.DEFAULT_PORT,
+                 consumer: Callable[[list], None] = None):
+        self._bot = bot
+        self._consumer = consumer or self._process_updates
+        self._secret_token = secret_token.encode()
+        self._logger = logger
+        self._server = ThreadingHTTPServer((host, port), self._request_handler())
+        self._server.daemon_threads = False
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='webhook-server', daemon=True)
+        self._thread.start()
+        self._logger.info(f'Webhook server is listening on port {self.port}')
+
+    def drain(self, timeout: float = WebhookSettings.DRAIN_TIMEOUT):
+        """Stop accepting updates and wait until received ones are handled"""
+        self._logger.info('Draining webhook server...')
+        self._server.shutdown()
+        self._server.server_close()  # Waits for request threads
+
+        self._bot.drain(timeout, WebhookSettings.DRAIN_POLL_INTERVAL)
+        self._logger.info('Webhook server stopped.')
+
+    def process_request(self, secret_token: str, body: bytes) -> int:
+        """Returns HTTP status code for the webhook request"""
+        if not hmac.compare_digest((secret_token or '').encode(), self._secret_token):
+            return 403
+        try:
+            json_updates = json.loads(body.decode('utf8'))
+        except ValueError as e:
+            self._logger.error('Malformed webhook request body', extra=log_fields(error=e))
+            return 200
+        if isinstance(json_updates, dict):
+            json_updates = [json_updates]
+        if self._bot.recorder is not None:
+            self._bot.recorder.record(json_updates)
+
+        try:
+            self._consumer(json_updates)
+        except (KeyError, TypeError, AttributeError, ValueError) as e:
+            self._logger.error('Malformed webhook update', extra=log_fields(error=e))
+        return 200
+
+    def _process_updates(self, json_updates: list):
+        self._bot.process_new_updates(self._bot.de_json_updates(json_updates))
+
+    def _request_handler(self):
+        server = self
+
+        class WebhookRequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                except ValueError:
+                    length = -1
+                if length < 0:  # Bad header, the body can not be read
+                    status = 400
+                else:
+                    body = self.rfile.read(length)
+                    status = server.process_request(self.headers.get(WebhookSettings.SECRET_TOKEN_HEADER), body)
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                server._logger.debug('Webhook request: ' + format % args)
+
+        return WebhookRequestHandler
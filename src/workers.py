@@ -0,0 +1,173 @@
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from collections import defaultdict
+from typing import Callable, List, Optional
+
+from telebot.apihelper import ApiException
+
+from bot import RudeBot
+from const import TelegramUpdateType, WorkerSettings, LoggingSettings, EnvVar
+
+
+class UpdatePartitioner:
+    """
+    Update to worker mapping
+
+    Chat updates and callbacks of chat messages are mapped by chat id, so one chat is always handled
+    by one worker. Updates without chat (e.g. callbacks of inline messages) are mapped by user id.
+    """
+
+    def __init__(self, workers: int):
+        self._workers = workers
+
+    @staticmethod
+    def get_key(json_update: dict) -> int:
+        for update_type in TelegramUpdateType.CHAT_UPDATES:
+            if update_type in json_update:
+                return json_update[update_type]['chat']['id']
+        call = json_update.get(TelegramUpdateType.CALLBACK_QUERY)
+        if call is not None:
+            return call['message']['chat']['id'] if call.get('message') else call['from']['id']
+        return json_update['update_id']
+
+    def get_index(self, key: int) -> int:
+        return key % self._workers
+
+    def get_worker(self, json_update: dict) -> int:
+        return self.get_index(self.get_key(json_update))
+
+
+def run_worker(index: int, workers: int, updates: multiprocessing.Queue, version: str):
+    """Worker process entry point: the application of chats of the partition, fed from updates queue"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Supervisor stops workers through their queues
+    logger = logging.getLogger()
+
+    from application import create_app
+    from dispatcher import OutboundDispatcher
+    from env_loader import EnvLoader
+    from logs import configure_logging
+
+    env_loader = EnvLoader(logger)
+    listener = configure_logging(
+        LoggingSettings.WORKER_RECORD_FORMAT, env_loader.get(EnvVar.LOG_FORMAT, LoggingSettings.DEFAULT_FORMAT),
+    )
+    logger.setLevel(env_loader.get(EnvVar.LOGGING_LEVEL, LoggingSettings.DEFAULT_LEVEL))
+    metrics_port = env_loader.get(EnvVar.METRICS_PORT)
+    if metrics_port:  # Every worker serves its own metrics and writes its own traces
+        os.environ[EnvVar.METRICS_PORT] = str(int(metrics_port) + index)
+    os.environ.pop(EnvVar.CAPTURE_FILE, None)  # Updates are captured once, by the supervisor
+    trace_file = env_loader.get(EnvVar.TRACE_FILE)
+    if trace_file:
+        os.environ[EnvVar.TRACE_FILE] = f'{trace_file}.worker-{index}'
+    partitioner = UpdatePartitioner(workers)
+    try:
+        app = create_app(
+            logger,
+            version,
+            chat_filter=lambda chat_id: partitioner.get_index(chat_id) == index,
+            components=dict(dispatcher=OutboundDispatcher(logger, processes=workers)),
+        )
+        app.run_partition(updates)
+    finally:
+        listener.stop()
+
+
+class WorkerSupervisor:
+    """
+    Multi-process update dispatch
+
+    Updates are received once, by polling or webhook, and put to the queue of the worker of their chat,
+    so updates of one chat keep their order while chats are spread over cores. Dead workers are restarted
+    with the same queue.
+    """
+    _processes: List[multiprocessing.Process]
+
+    def __init__(self, bot: RudeBot, logger: logging.Logger, workers: int, target: Callable = run_worker,
+                 args: tuple = ()):
+        self._bot = bot
+        self._logger = logger
+        self._workers = workers
+        self._target = target
+        self._args = args
+        self._partitioner = UpdatePartitioner(workers)
+        self._context = multiprocessing.get_context(WorkerSettings.START_METHOD)
+        self._queues = [self._context.Queue() for _ in range(workers)]
+        self._processes = [None] * workers
+        self._stopped = threading.Event()
+
+    def _start_worker(self, index: int):
+        process = self._context.Process(
+            target=self._target,
+            args=(index, self._workers, self._queues[index]) + self._args,
+            name=f'worker-{index}',
+            daemon=True,
+        )
+        process.start()
+        self._processes[index] = process
+
+    def start(self):
+        for index in range(self._workers):
+            self._start_worker(index)
+        self._logger.info(f'Started {self._workers} worker processes.')
+
+    def check_workers(self):
+        for index, process in enumerate(self._processes):
+            if not process.is_alive():
+                self._logger.error(f'Worker {index} exited with code {process.exitcode}, restarting')
+                self._start_worker(index)
+
+    def dispatch(self, json_updates: list):
+        self.check_workers()
+        batches = defaultdict(list)
+        for json_update in json_updates:
+            batches[self._partitioner.get_worker(json_update)].append(json_update)
+        for index, batch in batches.items():
+            self._queues[index].put(batch)
+
+    def poll(self):
+        """Long polling until SIGTERM or SIGINT"""
+        signal.signal(signal.SIGTERM, lambda *_: self._stopped.set())
+        signal.signal(signal.SIGINT, lambda *_: self._stopped.set())
+        thread = threading.Thread(target=self._poll, name='supervisor-polling', daemon=True)
+        thread.start()
+        self._stopped.wait()
+
+    def skip_pending(self) -> Optional[int]:
+        """Drop updates received before start as skip_pending polling does, returns the offset after them"""
+        while not self._stopped.is_set():
+            try:
+                json_updates = self._bot.get_json_updates(-1, timeout=0)
+            except ApiException as e:
+                self._logger.error(e)
+                self._stopped.wait(WorkerSettings.ERROR_INTERVAL)
+                continue
+            return json_updates[-1]['update_id'] + 1 if json_updates else None
+        return None
+
+    def _poll(self):
+        offset = self.skip_pending()
+        while not self._stopped.is_set():
+            try:
+                json_updates = self._bot.get_json_updates(offset, timeout=WorkerSettings.POLLING_TIMEOUT)
+            except ApiException as e:
+                self._logger.error(e)
+                self._stopped.wait(WorkerSettings.ERROR_INTERVAL)
+                continue
+            if json_updates and not self._stopped.is_set():  # Not acknowledged batch is received again
+                offset = json_updates[-1]['update_id'] + 1
+                self.dispatch(json_updates)
+
+    def stop(self, timeout: float = WorkerSettings.STOP_TIMEOUT):
+        """Let workers handle queued updates and wait for them to exit"""
+        self._stopped.set()
+        for queue in self._queues:
+            queue.put(None)
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout)
+                if process.is_alive():
+                    process.terminate()
+        self._logger.info('Worker processes stopped.')
@@ -0,0 +1,87 @@
+import logging
+import time
+
+import pytest
+from telebot import TeleBot
+from telebot.types import ChatMember, User
+
+from admin_cache import AdminCache
+from const import TelegramMemberStatus, ScheduledTaskKey, AdminCacheSettings
+from dto import ChatMemberUpdateDto
+from scheduler import TaskScheduler
+
+CHAT_ID = -100
+
+
+def chat_member(user_id: int, status: str) -> ChatMember:
+    return ChatMember.de_json({'user': {'id': user_id, 'is_bot': False, 'first_name': 'user'}, 'status': status})
+
+
+@pytest.fixture
+def scheduler():
+    # Not started: background refresh tasks stay pending
+    scheduler = TaskScheduler(logging.getLogger('admin_cache_test'))
+    yield scheduler
+    scheduler.stop()
+
+
+class TestAdminCache:
+    def test_warm_cache_costs_no_api_calls(self, scheduler, fake_api):
+        fake_api.admin_ids = [1, 2]
+        cache = AdminCache(TeleBot('123:token'), scheduler, logging.getLogger('admin_cache_test'))
+        cache.warm(CHAT_ID)
+
+        for _ in range(100):
+            assert cache.is_admin(CHAT_ID, 1)
+            assert not cache.is_admin(CHAT_ID, 3)
+
+        assert fake_api.calls.count('getChatAdministrators') == 1
+        assert (cache.hits, cache.misses) == (200, 0)
+
+    def test_expired_entry_is_refetched(self, scheduler, fake_api):
+        fake_api.admin_ids = [1]
+        cache = AdminCache(TeleBot('123:token'), scheduler, logging.getLogger('admin_cache_test'), ttl=0)
+
+        assert cache.is_admin(CHAT_ID, 1)
+        assert cache.is_admin(CHAT_ID, 1)
+        assert fake_api.calls.count('getChatAdministrators') == 2
+        assert cache.misses == 2
+
+    @pytest.mark.parametrize(
+        'old_status, new_status, invalidated',
+        [
+            (TelegramMemberStatus.MEMBER, TelegramMemberStatus.ADMINISTRATOR, True),
+            (TelegramMemberStatus.ADMINISTRATOR, TelegramMemberStatus.RESTRICTED, True),
+            (TelegramMemberStatus.MEMBER, TelegramMemberStatus.RESTRICTED, False),
+        ]
+    )
+    def test_member_update_invalidation(self, scheduler, fake_api, old_status, new_status, invalidated):
+        fake_api.admin_ids = [1]
+        cache = AdminCache(TeleBot('123:token'), scheduler, logging.getLogger('admin_cache_test'))
+        cache.warm(CHAT_ID)
+
+        fake_api.admin_ids = [1, 3]
+        cache.process_member_update(ChatMemberUpdateDto(CHAT_ID, chat_member(3, old_status), chat_member(3, new_status)))
+
+        assert cache.is_admin(CHAT_ID, 3) is invalidated
+        assert cache.misses == int(invalidated)
+
+    @pytest.mark.parametrize(
+        'error_code, attempt, pause',
+        [
+            (502, 0, AdminCacheSettings.RETRY_MIN_PAUSE),
+            (502, 3, AdminCacheSettings.RETRY_MIN_PAUSE * 8),
+            (502, 20, AdminCacheSettings.RETRY_MAX_PAUSE),
+            (429, 0, 60),
+        ]
+    )
+    def test_failed_refresh_is_retried(self, scheduler, fake_api, error_code, attempt, pause):
+        fake_api.errors['getChatAdministrators'] = error_code
+        fake_api.retry_after = 60
+        cache = AdminCache(TeleBot('123:token'), scheduler, logging.getLogger('admin_cache_test'))
+
+        started = time.monotonic()
+        cache.warm(CHAT_ID, attempt)
+
+        assert (CHAT_ID, ScheduledTaskKey.ADMIN_REFRESH) in scheduler
+        assert scheduler.next_run_at() - started == pytest.approx(pause, abs=1)
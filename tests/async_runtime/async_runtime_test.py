@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import time
+
+from telebot.types import CallbackQuery, Message, User
+
+from async_api import AsyncTelegramApi
+from async_runtime import AsyncBotRuntime
+from async_utils import AsyncBotUtils
+from bot import RudeBot
+from dto import GreetingQuestionDto
+from greeting import NewbieStorage, QuestionProvider
+from notification import Notification
+from raid import JoinRateDetector, RaidGuard
+from scheduler import TaskScheduler
+
+CHAT_ID = -100
+JOIN_COUNT = 100
+logger = logging.getLogger('async_runtime_test')
+
+
+def join_message(user_id: int) -> Message:
+    return Message.de_json({
+        'message_id': user_id,
+        'date': int(time.time()),
+        'chat': {'id': CHAT_ID, 'type': 'supergroup'},
+        'new_chat_members': [{'id': user_id, 'is_bot': False, 'first_name': f'user_{user_id}'}],
+    })
+
+
+class TestAsyncRuntime:
+    def test_concurrent_greetings(self, fake_api):
+        storage = NewbieStorage(logger)
+        methods = AsyncBotUtils(
+            AsyncTelegramApi('123:token', logger), Notification(), storage, QuestionProvider(), logger)
+
+        async def greet_all():
+            await asyncio.gather(*[methods.greeting_handler(join_message(_)) for _ in range(JOIN_COUNT)])
+            for key in list(methods._timers):
+                methods.cancel_scheduled_task(key)
+            await methods._api.close()
+
+        asyncio.run(greet_all())
+        assert len(storage) == JOIN_COUNT
+        assert fake_api.calls.count('restrictChatMember') == JOIN_COUNT
+        assert fake_api.calls.count('sendMessage') == JOIN_COUNT
+
+    def test_pending_updates_are_skipped(self, fake_api):
+        fake_api.push_updates([dict(update_id=_) for _ in range(1, 4)])
+        api = AsyncTelegramApi('123:token', logger)
+        runtime = AsyncBotRuntime(api, RudeBot('123:token', threaded=False), dict(), logger)
+        dispatched = []
+        runtime.dispatch = dispatched.extend
+
+        async def poll():
+            task = asyncio.ensure_future(runtime.poll())
+            while fake_api.calls.count('getUpdates') < 2:  # Pending updates are skipped
+                await asyncio.sleep(0.01)
+            fake_api.push_updates([dict(update_id=4)])
+            while not dispatched:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            await api.close()
+
+        asyncio.run(asyncio.wait_for(poll(), 10))
+        assert [_['update_id'] for _ in dispatched] == [4]
+
+    def test_fallback_batches_keep_order(self):
+        bot = RudeBot('123:token', threaded=False)
+        runtime = AsyncBotRuntime(AsyncTelegramApi('123:token', logger), bot, dict(), logger)
+        processed = []
+
+        def process_new_updates(updates):
+            time.sleep(0.05 if updates[0].update_id == 1 else 0)
+            processed.extend(_.update_id for _ in updates)
+
+        bot.process_new_updates = process_new_updates
+
+        async def dispatch():
+            for update_id in range(1, 4):
+                runtime.dispatch([dict(update_id=update_id)])
+            await runtime.drain()
+
+        asyncio.run(asyncio.wait_for(dispatch(), 10))
+        assert processed == [1, 2, 3]
+
+    def test_callback_before_greeting_is_sent(self, fake_api):
+        storage = NewbieStorage(logger)
+        methods = AsyncBotUtils(
+            AsyncTelegramApi('123:token', logger), Notification(), storage, QuestionProvider(), logger)
+        user = {'id': 2, 'is_bot': False, 'first_name': 'newbie'}
+        storage.add(User.de_json(user), int(time.time()) + 120, GreetingQuestionDto('?', None, 120, {'0': 'ok'}))
+        call = CallbackQuery.de_json({'id': '1', 'from': user, 'chat_instance': '1', 'data': '0',
+                                      'message': {'message_id': 1, 'date': 0,
+                                                  'chat': {'id': CHAT_ID, 'type': 'supergroup'}}})
+
+        async def answer_twice():
+            await methods.greeting_callback(call)  # Greeting is not stored yet
+            storage.remove(User.de_json(user))
+            await methods.greeting_callback(call)  # Kicked meanwhile
+            await methods._api.close()
+
+        asyncio.run(answer_twice())
+        assert fake_api.calls == []
+
+    def test_raid_burst_is_batched(self, fake_api):
+        bot = RudeBot('123:token', threaded=False)
+        scheduler = TaskScheduler(logger)
+        guard = RaidGuard(bot, scheduler, Notification(), logger, JoinRateDetector(threshold=5))
+        api = AsyncTelegramApi('123:token', logger)
+        methods = AsyncBotUtils(
+            api, Notification(), NewbieStorage(logger), QuestionProvider(), logger, raid_guard=guard)
+        runtime = AsyncBotRuntime(api, bot, {CHAT_ID: methods}, logger)
+
+        async def burst():
+            runtime.dispatch([dict(update_id=_, message=join_message(_).json) for _ in range(1, 21)])
+            await runtime.drain()
+            for key in list(methods._timers):
+                methods.cancel_scheduled_task(key)
+
+        asyncio.run(asyncio.wait_for(burst(), 10))
+        guard._flush(CHAT_ID)
+        scheduler.stop()
+
+        assert fake_api.calls.count('getChatMember') == 5
+        assert fake_api.calls.count('restrictChatMember') == 20
+        assert fake_api.calls.count('sendMessage') == 5 + 1
+        assert 'Похоже на рейд' in fake_api.sent_messages[-1]['text']
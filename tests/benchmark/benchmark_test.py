@@ -0,0 +1,171 @@
+import json
+import logging
+import os
+import urllib.error
+import urllib.request
+
+import pytest
+
+from async_greetings import measure as measure_greetings
+from duration_parsing import measure as measure_durations
+from fake_api import FakeBotApi
+from flood_overhead import bytes_per_user as flood_bytes_per_user, measure as measure_flood
+from handler_races import measure as measure_races
+from logging_overhead import measure, ERROR_BURST
+from memory import bytes_per_user, fill_newbies, fill_restrictions, fill_telebot
+from metrics_overhead import measure as measure_metrics
+from question_loading import measure as measure_question_loading
+from routing import measure as measure_routing
+from runner import run_scenario, compare
+from scenarios import SCENARIOS, ADMIN_ID, Scenario
+from transport_pool import measure as measure_transport
+from webhook_latency import measure_polling, measure_webhook
+
+COUNT = 50
+
+
+def call(api: FakeBotApi, method_name: str, **params):
+    request = urllib.request.Request(
+        api.url.format('123:token', method_name),
+        data=json.dumps(params).encode(),
+        headers={'Content-Type': 'application/json'},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+class TestFakeBotApi:
+    def test_methods(self, fake_api):
+        fake_api.admin_ids = (ADMIN_ID,)
+        fake_api.push_updates([{'update_id': 1}, {'update_id': 2}])
+        assert call(fake_api, 'getUpdates', offset=2, timeout=1)[1]['result'] == [{'update_id': 2}]
+        assert call(fake_api, 'getChatMember', chat_id=-100, user_id=ADMIN_ID)[1]['result']['status'] == 'administrator'
+        assert call(fake_api, 'getChatAdministrators', chat_id=-100)[1]['result'][0]['user']['id'] == ADMIN_ID
+        message = call(fake_api, 'sendMessage', chat_id=-100, text='hi', reply_to_message_id=5)[1]['result']
+        assert fake_api.sent_messages == [dict(message, reply_to_message_id=5)]
+
+    def test_error_injection(self, fake_api):
+        fake_api.errors['kickChatMember'] = 403
+        fake_api.flood_rate = 1
+        assert call(fake_api, 'kickChatMember', chat_id=-100, user_id=1)[0] == 403
+        status, response = call(fake_api, 'deleteMessage', chat_id=-100, message_id=1)
+        assert status == 429
+        assert response['parameters']['retry_after'] == fake_api.retry_after
+
+
+class TestRunner:
+    @pytest.mark.parametrize('name', sorted(SCENARIOS))
+    def test_scenario(self, name, fake_api, tmp_path, caplog):
+        fake_api.admin_ids = (ADMIN_ID,)
+        with caplog.at_level(logging.CRITICAL):
+            result = run_scenario(SCENARIOS[name](COUNT), fake_api, tmp_path, timeout=30)
+        print(f'\n{name}: {result}')
+        assert result['handled'] == result['expected'] > 0
+        assert result['updates_per_second'] > 0
+        assert result['p99_ms'] >= result['p50_ms'] > 0
+
+    def test_regressions(self):
+        baseline = {'mixed': dict(updates_per_second=1000, p99_ms=100)}
+        assert compare({'mixed': dict(updates_per_second=900, p99_ms=120)}, baseline) == []
+        assert len(compare({'mixed': dict(updates_per_second=500, p99_ms=200)}, baseline)) == 2
+
+    def test_scenario_without_updates(self):
+        class Idle(Scenario):
+            name = 'idle'
+
+        with pytest.raises(TypeError):
+            Idle(COUNT)
+
+
+class TestLoggingOverhead:
+    def test_measure(self):
+        eager = measure(COUNT, logging.INFO, pipeline=False)
+        lazy = measure(COUNT, logging.INFO, pipeline=True)
+        print(f'\nsync: {eager}, queue: {lazy}')
+        assert eager['us_per_update'] > 0 and lazy['us_per_update'] > 0
+        assert eager['burst_written'] == ERROR_BURST > lazy['burst_written']
+
+
+class TestMemory:
+    def test_records_are_compact(self):
+        telebot = bytes_per_user(fill_telebot, COUNT)
+        newbies = bytes_per_user(fill_newbies, COUNT)
+        restrictions = bytes_per_user(fill_restrictions, COUNT)
+        print(f'\ntelebot {telebot:.0f}, newbies {newbies:.0f}, restrictions {restrictions:.0f} bytes per user')
+        assert newbies * 4 < telebot
+        assert restrictions * 4 < telebot
+
+
+class TestFloodOverhead:
+    def test_register_is_bounded(self):
+        result = measure_flood(users=1000, messages=20000)
+        per_user = flood_bytes_per_user(1000)
+        print(f'\n{result}, {per_user:.0f} bytes per user')
+        assert result['floods'] > 0
+        assert per_user < 1024
+
+
+class TestHandlerRaces:
+    def test_answer_or_kick(self):
+        single = measure_races(COUNT * 4, workers=1)
+        pooled = measure_races(COUNT * 4, workers=8)
+        print(f'\n1 worker {single["races_per_second"]}, 8 workers {pooled["races_per_second"]} races per second')
+        for result in single, pooled:
+            assert result['violations'] == 0
+            assert result['unrestricted'] + result['kicked'] == COUNT * 4
+        if len(os.sched_getaffinity(0)) >= 4:
+            assert pooled['races_per_second'] > single['races_per_second']
+
+
+class TestQuestionLoading:
+    def test_snapshot_has_every_question(self, tmp_path):
+        result = measure_question_loading(100, tmp_path)
+        print(f'\n{result}')
+        assert result['questions'] == 100
+
+
+class TestWebhookLatency:
+    def test_every_update_is_handled(self, fake_api):
+        results = dict(webhook=measure_webhook(COUNT), polling=measure_polling(fake_api, COUNT))
+        print(f'\n{results}')
+        assert all(result['handled'] == COUNT for result in results.values())
+
+
+class TestAsyncGreetings:
+    def test_every_join_is_greeted(self, fake_api):
+        result = measure_greetings(COUNT)
+        print(f'\n{result}')
+        assert result['greeted'] == COUNT
+
+
+class TestTransportPool:
+    def test_pool_reuses_connections(self, fake_api):
+        result = measure_transport(COUNT)
+        print(f'\n{result}')
+        assert result['requests'] == COUNT
+        assert result['connections'] <= COUNT // 2
+
+
+class TestRouting:
+    def test_chat_text_is_not_routed(self):
+        result = measure_routing(COUNT)
+        print(f'\n{result}')
+        assert result['accepted'] == 0
+
+
+class TestDurationParsing:
+    def test_parsers_agree(self):
+        result = measure_durations(COUNT)
+        print(f'\n{result}')
+        assert result['durations'] == COUNT
+        assert result['mismatches'] == 0
+
+
+class TestMetricsOverhead:
+    def test_every_call_is_recorded(self):
+        result = measure_metrics(COUNT)
+        print(f'\n{result}')
+        assert result['observed'] == result['counted'] == COUNT
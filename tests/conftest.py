@@ -0,0 +1,13 @@
+import pytest
+
+from fake_api import FakeBotApi
+
+
+@pytest.fixture
+def fake_api():
+    """Local Bot API of benchmark/fake_api.py installed for telebot, tests set its attributes, e.g. errors"""
+    api = FakeBotApi(seed=0).start()
+    api.install()
+    yield api
+    api.uninstall()
+    api.stop()
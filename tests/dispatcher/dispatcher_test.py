@@ -0,0 +1,165 @@
+import logging
+import time
+
+import pytest
+from telebot.apihelper import ApiException
+from telebot.types import Message, User
+
+from admin_cache import AdminCache
+from application import Application, create_app
+from bot import RudeBot
+from const import OutboundPriority, OutboundSettings
+from dispatcher import OutboundDispatcher
+from dto import GreetingQuestionDto
+from greeting import NewbieStorage
+from notification import Notification
+from restriction import RestrictionStorage
+from scheduler import TaskScheduler
+from utils import BotUtils
+
+CHAT_ID = -100
+logger = logging.getLogger('dispatcher_test')
+
+
+def join_message(message_id: int, user_id: int) -> Message:
+    return Message.de_json({
+        'message_id': message_id,
+        'date': int(time.time()),
+        'chat': {'id': CHAT_ID, 'type': 'supergroup'},
+        'new_chat_members': [{'id': user_id, 'is_bot': False, 'first_name': f'user_{user_id}'}],
+    })
+
+
+def wait_for(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.fixture
+def app(fake_api, tmp_path, monkeypatch) -> Application:
+    monkeypatch.setenv('TELEGRAM_TOKEN', '123:token')
+    monkeypatch.setenv('TELEGRAM_CHAT_ID', str(CHAT_ID))
+    monkeypatch.setenv('STATE_FILE', str(tmp_path / 'state.sqlite3'))
+    for name in 'CHATS_FILE', 'METRICS_PORT', 'CAPTURE_FILE':
+        monkeypatch.delenv(name, raising=False)
+    app = create_app(logger)
+    app.bot.dispatcher.start()
+    yield app
+    app.bot.dispatcher.stop()
+    app.scheduler.stop()
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = OutboundDispatcher(logger, workers=1)
+    yield dispatcher
+    dispatcher.stop()
+
+
+class TestOutboundDispatcher:
+    def test_moderation_goes_first(self, dispatcher):
+        executed = []
+        for priority in OutboundPriority.CLEANUP, OutboundPriority.NOTIFICATION, OutboundPriority.MODERATION:
+            dispatcher.submit(priority, CHAT_ID, executed.append, priority)
+        dispatcher.start()
+        dispatcher.call(OutboundPriority.CLEANUP, CHAT_ID, executed.append, 'last')
+
+        assert executed == [OutboundPriority.MODERATION, OutboundPriority.NOTIFICATION, OutboundPriority.CLEANUP,
+                            'last']
+
+    def test_retry_after_is_honored(self, dispatcher):
+        attempts = []
+
+        def flaky_call():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise ApiException('Too Many Requests', 'restrictChatMember',
+                                   {'ok': False, 'error_code': 429, 'parameters': {'retry_after': 1}})
+            return True
+
+        dispatcher.start()
+        assert dispatcher.call(OutboundPriority.MODERATION, CHAT_ID, flaky_call)
+        assert attempts[1] - attempts[0] >= 1
+        assert dispatcher.stats()['retries'] == 1
+
+    def test_call_kwargs_may_have_chat_id(self, dispatcher):
+        dispatcher.start()
+        assert dispatcher.call(OutboundPriority.MODERATION, CHAT_ID, lambda chat_id: chat_id, chat_id=CHAT_ID) == CHAT_ID
+
+    def test_other_errors_are_raised(self, dispatcher):
+        def failed_call():
+            raise ApiException('Bad Request', 'deleteMessage', {'ok': False, 'error_code': 400})
+
+        dispatcher.start()
+        with pytest.raises(ApiException):
+            dispatcher.call(OutboundPriority.CLEANUP, CHAT_ID, failed_call)
+
+    def test_moderation_is_not_delayed_by_notification_flood(self, dispatcher):
+        sent = []
+        dispatcher.start()
+        for i in range(100):
+            dispatcher.submit(OutboundPriority.NOTIFICATION, CHAT_ID, sent.append, i)
+
+        started = time.monotonic()
+        dispatcher.call(OutboundPriority.MODERATION, CHAT_ID, lambda: None)
+        moderation_latency = time.monotonic() - started
+        stats = dispatcher.stats()
+
+        print(f'\nmoderation latency during flood {moderation_latency * 1000:.1f}ms, stats: {stats}')
+        assert moderation_latency < 0.5
+        assert stats['sent'][OutboundPriority.NOTIFICATION] <= 20
+        assert stats['depth'][OutboundPriority.NOTIFICATION] + stats['sent'][OutboundPriority.NOTIFICATION] == 100
+
+    def test_global_limit_is_split_between_processes(self):
+        dispatcher = OutboundDispatcher(logger, processes=3)
+        bucket = dispatcher._global_bucket
+        assert (bucket.rate, bucket.capacity) == (OutboundSettings.GLOBAL_RATE / 3, OutboundSettings.GLOBAL_BURST / 3)
+        sent = sum(bucket.acquire(bucket.updated_at) == 0 for _ in range(OutboundSettings.GLOBAL_BURST))
+        assert sent == OutboundSettings.GLOBAL_BURST // 3
+
+
+class TestHandlerWaits:
+    def test_timeout_kick_does_not_wait_for_throttled_notifications(self, fake_api):
+        bot = RudeBot('123:token', threaded=False)
+        bot.dispatcher = OutboundDispatcher(logger)
+        scheduler = TaskScheduler(logger)
+        storage = NewbieStorage(logger, chat_id=CHAT_ID)
+        methods = BotUtils(bot, CHAT_ID, Notification(), storage, RestrictionStorage(logger, chat_id=CHAT_ID),
+                           scheduler, AdminCache(bot, scheduler, logger), logger)
+        user = User(id=2, is_bot=False, first_name='newbie')
+        storage.add(user, int(time.time()) + 120, GreetingQuestionDto('?', None, 120, {'0': 'ok'}))
+        storage.update(user, Message.de_json({'message_id': 1, 'date': 0, 'chat': {'id': CHAT_ID, 'type': 'supergroup'}}))
+
+        bot.dispatcher.start()
+        try:
+            for _ in range(OutboundSettings.CHAT_BURST):  # The chat has no notification tokens left
+                bot.enqueue('send_message', CHAT_ID, 'flood')
+            started = time.monotonic()
+            methods.timeout_kick(storage.get(user))
+            elapsed = time.monotonic() - started
+        finally:
+            bot.dispatcher.stop()
+            scheduler.stop()
+
+        assert elapsed < 1
+        assert fake_api.calls.count('kickChatMember') == 1
+
+    def test_rejoin_while_greeting_is_throttled(self, fake_api, app):
+        for _ in range(OutboundSettings.CHAT_BURST):  # The greeting waits for notification tokens
+            app.bot.enqueue('send_message', CHAT_ID, 'flood')
+        app.greeting_handler(join_message(1, 2))
+        app.member_cache.invalidate(CHAT_ID, 2)  # Left and rejoined
+        app.greeting_handler(join_message(2, 2))
+
+        assert fake_api.calls.count('kickChatMember') == 1
+        assert len(app.chats[CHAT_ID].newbie_storage) == 0
+
+    def test_failed_greeting_lifts_restriction(self, fake_api, app):
+        fake_api.errors['sendMessage'] = 400
+        app.greeting_handler(join_message(1, 2))
+
+        assert wait_for(lambda: fake_api.calls.count('restrictChatMember') == 2)
+        assert len(app.chats[CHAT_ID].newbie_storage) == 0
+        assert fake_api.requests[-1][1]['can_send_messages'] == 'True'
@@ -0,0 +1,115 @@
+import logging
+
+import pytest
+from telebot.types import User, Message
+
+from clock import VirtualClock
+from const import StateSettings
+from dto import GreetingQuestionDto, RestrictionDto, RestrictedUserDto, NewbieDto
+from error import StorageFullError
+from expiry import ExpiryIndex
+from greeting import NewbieStorage
+from restriction import RestrictionStorage
+
+START = 1600000000
+CHAT_ID = -100
+logger = logging.getLogger('expiry_test')
+logger.setLevel(logging.CRITICAL)
+question = GreetingQuestionDto(text='?', keyboard=None, timeout=120, reply={'0': 'yes'})
+restriction = RestrictionDto(messages=False, media=True, other=True, web_preview=True)
+
+
+def user(user_id: int) -> User:
+    return User(id=user_id, is_bot=False, first_name=f'user_{user_id}', username=None)
+
+
+def greeting(message_id: int) -> Message:
+    return Message.de_json({'message_id': message_id, 'date': START, 'chat': {'id': CHAT_ID, 'type': 'supergroup'}})
+
+
+def restricted(user_id: int, restore_at: int) -> RestrictedUserDto:
+    return RestrictedUserDto(user(user_id), CHAT_ID, 0, restriction, restore_at)
+
+
+class TestCompactRecords:
+    def test_telebot_objects_are_not_kept(self):
+        newbie = NewbieDto(user(1), START, question, greeting(10))
+        assert not hasattr(newbie, '__dict__')
+        assert not hasattr(newbie.user, '__dict__')
+        assert (newbie.user.id, newbie.user.first_name) == (1, 'user_1')
+        assert (newbie.greeting.chat.id, newbie.greeting.message_id, newbie.greeting.date) == (CHAT_ID, 10, START)
+        assert NewbieDto(newbie.user, START, question, newbie.greeting).greeting is newbie.greeting
+
+
+class TestExpiryIndex:
+    def test_pop_expired(self):
+        index = ExpiryIndex()
+        for expires_at, user_id in (30, 3), (10, 1), (20, 2):
+            index.push(expires_at, user_id)
+        assert index.pop_expired(20) == [(10, 1), (20, 2)]
+        assert len(index) == 1
+
+    def test_compact(self):
+        index = ExpiryIndex()
+        for user_id in range(StateSettings.COMPACT_MIN_STALE * 2):
+            index.push(START, user_id)
+        assert not index.compact(StateSettings.COMPACT_MIN_STALE * 2, [])
+        assert index.compact(1, [(START, 1)])
+        assert len(index) == 1
+
+
+class TestNewbieEviction:
+    def test_expired_newbies_are_evicted(self):
+        clock = VirtualClock(START)
+        storage = NewbieStorage(logger, chat_id=CHAT_ID, clock=clock)
+        storage.add(user=user(1), timeout=START + 120, question=question)
+        storage.update(user=user(1), greeting=greeting(10))
+        storage.add(user=user(2), timeout=START + 600, question=question)
+
+        clock.advance_to(START + 120 + StateSettings.EXPIRY_GRACE)
+        assert storage.evict_expired() == 1
+        assert 1 not in storage and 2 in storage
+        assert storage.find_by_greeting(10) is None
+
+    def test_removed_and_readded_newbie_is_kept(self):
+        clock = VirtualClock(START)
+        storage = NewbieStorage(logger, chat_id=CHAT_ID, clock=clock)
+        storage.add(user=user(1), timeout=START + 120, question=question)
+        storage.remove(user(1))
+        storage.add(user=user(1), timeout=START + 600, question=question)
+
+        clock.advance_to(START + 120 + StateSettings.EXPIRY_GRACE)
+        assert storage.evict_expired() == 0
+        assert 1 in storage
+
+    def test_capacity(self):
+        clock = VirtualClock(START)
+        storage = NewbieStorage(logger, chat_id=CHAT_ID, clock=clock, capacity=2)
+        storage.add(user=user(1), timeout=START, question=question)
+        storage.add(user=user(2), timeout=START + 600, question=question)
+        with pytest.raises(StorageFullError):
+            storage.add(user=user(3), timeout=START + 600, question=question)
+
+        clock.advance_to(START + StateSettings.EXPIRY_GRACE)
+        storage.add(user=user(3), timeout=START + 600, question=question)
+        assert len(storage) == 2 and 1 not in storage
+
+
+class TestRestrictionEviction:
+    def test_unrestored_restrictions_are_evicted(self):
+        clock = VirtualClock(START)
+        storage = RestrictionStorage(logger, chat_id=CHAT_ID, clock=clock)
+        storage.add(restricted(1, START + 60))
+        storage.add(restricted(2, START + 3600))
+        storage.add(restricted(1, START + 7200))  # A new !ro replaces the pending restore
+
+        clock.advance_to(START + 3600 + StateSettings.EXPIRY_GRACE)
+        assert storage.evict_expired() == 1
+        assert [_.user.id for _ in storage] == [1]
+
+    def test_capacity(self):
+        storage = RestrictionStorage(logger, chat_id=CHAT_ID, clock=VirtualClock(START), capacity=1)
+        storage.add(restricted(1, START + 60))
+        storage.add(restricted(1, START + 120))
+        with pytest.raises(StorageFullError):
+            storage.add(restricted(2, START + 60))
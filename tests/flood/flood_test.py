@@ -0,0 +1,104 @@
+import logging
+import tracemalloc
+
+import pytest
+
+from application import create_app
+from clock import VirtualClock
+from const import FloodSettings
+from dispatcher import OutboundDispatcher
+from flood import FloodDetector
+from replay import StubTransport
+
+START = 1600000000
+CHAT_ID = -100
+ADMIN_ID = 1
+USER_ID = 2
+THRESHOLDS = {FloodSettings.MESSAGES: (3, 5, None), FloodSettings.MEDIA: (1, None, None)}
+
+
+def text_update(update_id: int, user_id: int, date: int) -> dict:
+    return dict(update_id=update_id, message=dict(
+        message_id=update_id,
+        date=date,
+        chat=dict(id=CHAT_ID, type='supergroup'),
+        text='flood',
+        **{'from': dict(id=user_id, is_bot=False, first_name=f'user_{user_id}')},
+    ))
+
+
+class TestFloodDetector:
+    def test_threshold_is_crossed_once(self):
+        detector = FloodDetector(THRESHOLDS)
+        crossed = [detector.register(USER_ID, False, START) for _ in range(5)]
+
+        assert crossed == [None, None, None, FloodSettings.MESSAGES, None]
+        assert detector.register(USER_ID + 1, False, START) is None
+
+    def test_counts_expire_with_window(self):
+        detector = FloodDetector(THRESHOLDS)
+        for second in range(0, 15, 3):
+            assert detector.register(USER_ID, False, START + second) is None  # 2 per 5s, 5 per 60s
+        assert detector.register(USER_ID, False, START + 15) == FloodSettings.MESSAGES
+
+    def test_late_message_counts_as_latest(self):
+        detector = FloodDetector(THRESHOLDS)
+        for second in 10, 11, 4:
+            assert detector.register(USER_ID, False, START + second) is None
+        assert detector.register(USER_ID, False, START + 11) == FloodSettings.MESSAGES
+
+    def test_media_threshold(self):
+        detector = FloodDetector(THRESHOLDS)
+        assert detector.register(USER_ID, True, START) is None
+        assert detector.register(USER_ID, False, START) is None
+        assert detector.register(USER_ID, True, START) == FloodSettings.MEDIA
+
+    def test_users_are_bounded(self):
+        detector = FloodDetector(THRESHOLDS, capacity=100)
+        for user_id in range(1000):
+            detector.register(user_id, False, START)
+        assert len(detector) == 100
+
+        detector.register(1000, False, START + 600)  # Quiet users are dropped one per new user
+        detector.register(1001, False, START + 600)
+        assert len(detector) == 100
+
+    def test_memory_per_user(self):
+        tracemalloc.start()
+        detector = FloodDetector(capacity=10000)
+        for user_id in range(10000):
+            detector.register(user_id, False, START)
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        print(f'\n{used / len(detector):.0f} bytes per user')
+        assert used / len(detector) < 1024
+
+
+class TestFloodListener:
+    def test_flooder_is_read_only(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('TELEGRAM_TOKEN', '0:flood')
+        monkeypatch.setenv('TELEGRAM_CHAT_ID', str(CHAT_ID))
+        monkeypatch.setenv('STATE_FILE', str(tmp_path / 'state.sqlite3'))
+        for name in 'CHATS_FILE', 'METRICS_PORT', 'CAPTURE_FILE':
+            monkeypatch.delenv(name, raising=False)
+
+        logger = logging.getLogger('flood_test')
+        clock = VirtualClock(START)
+        transport = StubTransport(clock, (ADMIN_ID,))
+        app = create_app(logger, components=dict(
+            clock=clock,
+            transport=transport,
+            dispatcher=OutboundDispatcher(logger, rate_limits=False),
+        ))
+        count = FloodSettings.THRESHOLDS[FloodSettings.MESSAGES][0] + 1
+        updates = [text_update(index, user_id, START) for index in range(count) for user_id in (ADMIN_ID, USER_ID)]
+        app.start()
+        try:
+            app.bot.process_new_updates(app.bot.de_json_updates(updates))
+            app.bot.drain(10, 0.01)
+        finally:
+            app.stop()
+
+        assert transport.calls['restrictChatMember'] == 1
+        assert len(app.chats[CHAT_ID].restriction_storage) == 1
@@ -0,0 +1,186 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from telebot.types import User, Message, InlineKeyboardMarkup, InlineKeyboardButton
+
+from dto import GreetingQuestionDto
+from greeting import NewbieStorage, QuestionProvider, QuestionWatcher, QuestionLoader
+from scheduler import TaskScheduler
+
+CHAT_ID = -100
+logger = logging.getLogger('greeting_test')
+logger.setLevel(logging.ERROR)
+question = GreetingQuestionDto(text='?', keyboard=None, timeout=120, reply={'0': 'yes'})
+
+
+def newbie_user(user_id: int) -> User:
+    return User(id=user_id, is_bot=False, first_name=f'user_{user_id}', username=None)
+
+
+def greeting(message_id: int) -> Message:
+    return Message.de_json({'message_id': message_id, 'date': 1000, 'chat': {'id': CHAT_ID, 'type': 'supergroup'}})
+
+
+def fill_storage(size: int) -> NewbieStorage:
+    storage = NewbieStorage(logger)
+    for user_id in range(1, size + 1):
+        storage.add(user=newbie_user(user_id), timeout=1120, question=question)
+        storage.update(user=newbie_user(user_id), greeting=greeting(user_id * 10))
+    return storage
+
+
+def callback_cost(storage: NewbieStorage, rounds: int = 2000) -> float:
+    """Best per-click time of greeting_callback and pass_handler lookups"""
+    user, message_id = newbie_user(len(storage) // 2 + 1), (len(storage) // 2 + 1) * 10
+    best = float('inf')
+    for _ in range(5):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            assert user.id in storage
+            assert storage.get(user).greeting.message_id == message_id
+            assert storage.find_by_greeting(message_id).user.id == user.id
+        best = min(best, (time.perf_counter() - started) / rounds)
+    return best
+
+
+class TestNewbieStorage:
+    def test_greeting_index(self):
+        storage = fill_storage(3)
+        assert storage.find_by_greeting(20).user.id == 2
+
+        storage.update(user=newbie_user(2), greeting=greeting(25))
+        assert storage.find_by_greeting(20) is None
+        assert storage.find_by_greeting(25).user.id == 2
+
+        storage.remove(newbie_user(2))
+        assert storage.find_by_greeting(25) is None
+        assert 2 not in storage
+        assert len(storage) == 2
+
+    def test_take_once(self):
+        storage = fill_storage(2)
+        newbie = storage.get(newbie_user(1))
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            taken = list(executor.map(lambda _: storage.take(newbie), range(100)))
+
+        assert taken.count(True) == 1
+        assert 1 not in storage and storage.find_by_greeting(10) is None
+
+    def test_take_skips_replaced_newbie(self):
+        storage = fill_storage(1)
+        newbie = storage.get(newbie_user(1))
+        storage.update(user=newbie_user(1), greeting=greeting(15))
+
+        assert not storage.take(newbie)
+        assert storage.take(storage.get(newbie_user(1)))
+
+    @pytest.mark.parametrize('user_id', [1, 4])
+    def test_newbie_without_greeting(self, user_id):
+        storage = NewbieStorage(logger)
+        storage.add(user=newbie_user(1), timeout=1120, question=question)
+        assert (user_id in storage) is (user_id == 1)
+        assert storage.find_by_greeting(10) is None
+
+    def test_callback_cost_is_flat(self):
+        costs = {size: callback_cost(fill_storage(size)) for size in (10, 1000, 100000)}
+        print('\ncallback cost per click: ' + ', '.join(f'{k} newbies {v * 1e6:.2f}us' for k, v in costs.items()))
+        assert costs[100000] < costs[10] * 3
+
+
+QUESTIONS_YAML = """
+questions:
+  - name: {name}
+    text: '{{mention}}, {name}?'
+    options:
+      - option_text: 'yes'
+        reply_text: 'ok'
+"""
+
+
+@pytest.fixture
+def questions_file(tmp_path):
+    file_path = tmp_path / 'questions.yaml'
+    file_path.write_text(QUESTIONS_YAML.format(name='first'), encoding='utf8')
+    return file_path
+
+
+def touch(file_path, content: str):
+    stat = file_path.stat()
+    file_path.write_text(content, encoding='utf8')
+    os.utime(str(file_path), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+class TestQuestionWatcher:
+    def test_reload(self, questions_file):
+        provider = QuestionProvider(questions_file)
+        watcher = QuestionWatcher(TaskScheduler(logger), logger, provider)
+        watcher.start()
+        in_flight = provider.get_question()
+
+        assert not watcher.check()
+        touch(questions_file, QUESTIONS_YAML.format(name='second'))
+        assert watcher.check()
+        assert provider.get_question().text == '{mention}, second?'
+        assert in_flight is not provider.get_question()
+
+    def test_broken_file_keeps_questions(self, questions_file):
+        provider = QuestionProvider(questions_file)
+        watcher = QuestionWatcher(TaskScheduler(logger), logger, provider)
+        watcher.start()
+        touch(questions_file, QUESTIONS_YAML.format(name='second'))
+        watcher.check()
+
+        touch(questions_file, 'questions: [')
+        assert not watcher.check()
+        assert provider.get_question().text == '{mention}, second?'
+
+    def test_keyboard_is_serialized_once(self):
+        keyboard = InlineKeyboardMarkup().row(InlineKeyboardButton(text='yes', callback_data='0'))
+        question = GreetingQuestionDto(text='?', keyboard=keyboard, timeout=120, reply={'0': 'ok'})
+        assert question.keyboard_json == keyboard.to_json()
+
+
+def question_bank(size: int) -> str:
+    question = """
+  - name: question_{0}
+    text: '{{mention}}, question {0}?'
+    question_timeout: 60
+    options:
+      - option_text: 'yes'
+        reply_text: 'ok {0}'
+      - option_text: 'no'
+        reply_text: 'not ok {0}'"""
+    return 'questions:' + ''.join(question.format(_) for _ in range(size))
+
+
+class TestQuestionLoader:
+    def test_snapshot_matches_yaml(self, tmp_path):
+        file_path = tmp_path / 'questions.yaml'
+        file_path.write_text(question_bank(3) + '\n  - name: malformed', encoding='utf8')
+        from_yaml = QuestionLoader._load_questions_from_file(file_path)
+
+        assert QuestionLoader.compile_file(file_path) == 3
+        from_snapshot = QuestionLoader._load_questions_from_file(file_path)
+        assert [(_.text, _.keyboard_json, _.timeout, _.reply) for _ in from_snapshot] == \
+               [(_.text, _.keyboard_json, _.timeout, _.reply) for _ in from_yaml]
+
+    def test_stale_snapshot_is_ignored(self, tmp_path):
+        file_path = tmp_path / 'questions.yaml'
+        file_path.write_text(question_bank(3), encoding='utf8')
+        QuestionLoader.compile_file(file_path)
+        file_path.write_text(question_bank(5), encoding='utf8')
+        assert len(QuestionLoader._load_questions_from_file(file_path)) == 5
+
+    def test_snapshot_skips_yaml(self, tmp_path, monkeypatch):
+        file_path = tmp_path / 'questions.yaml'
+        file_path.write_text(question_bank(100), encoding='utf8')
+        QuestionLoader.compile_file(file_path)
+
+        def parse(source):
+            raise AssertionError('yaml is parsed')
+
+        monkeypatch.setattr(QuestionLoader, '_parse', staticmethod(parse))
+        assert len(QuestionLoader._load_questions_from_file(file_path)) == 100
@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import defaultdict
+
+import pytest
+from telebot.types import Message, CallbackQuery
+
+from bot import RudeBot
+from handler_pool import KeyedThreadPool
+
+CHAT_ID = -100
+
+
+@pytest.fixture
+def pool():
+    pool = KeyedThreadPool(num_threads=8)
+    yield pool
+    pool.close()
+
+
+def close(pool: KeyedThreadPool):
+    """Close once all tasks are started, close() alone leaves queued ones, as telebot's ThreadPool does"""
+    deadline = time.monotonic() + 10
+    while pool.pending and time.monotonic() < deadline:
+        time.sleep(0.001)
+    pool.close()
+
+
+class TestKeyedThreadPool:
+    def test_tasks_of_key_run_in_order(self, pool):
+        seen = defaultdict(list)
+        running = set()
+        overlaps = []
+        lock = threading.Lock()
+
+        def task(key, index):
+            with lock:
+                if key in running:
+                    overlaps.append(key)
+                running.add(key)
+            time.sleep(0.0005)
+            with lock:
+                running.discard(key)
+                seen[key].append(index)
+
+        for index in range(50):
+            for key in range(20):
+                pool.submit(key, task, key, index)
+        close(pool)
+
+        assert overlaps == []
+        assert all(seen[key] == list(range(50)) for key in range(20))
+
+    def test_keys_run_concurrently(self, pool):
+        barrier = threading.Barrier(4, timeout=5)
+        for key in range(4):
+            pool.submit(key, barrier.wait)
+        close(pool)
+
+        assert not barrier.broken
+
+    def test_exceptions_are_kept_for_polling(self, pool):
+        def fail():
+            raise ValueError('handler')
+
+        pool.submit(1, fail)
+        pool.submit(1, lambda: None)
+        close(pool)
+
+        assert pool.exception_event.is_set()
+        with pytest.raises(ValueError):
+            pool.raise_exceptions()
+        assert pool.pending == 0
+
+
+class TestUpdateKey:
+    def test_keys(self):
+        user = {'id': 7, 'is_bot': False, 'first_name': 'user'}
+        message = Message.de_json({'message_id': 1, 'date': 0, 'chat': {'id': CHAT_ID, 'type': 'supergroup'},
+                                   'from': user, 'text': 'hi'})
+        call = CallbackQuery.de_json({'id': '1', 'from': user, 'chat_instance': '1', 'data': '0',
+                                      'message': {'message_id': 2, 'date': 0,
+                                                  'chat': {'id': CHAT_ID, 'type': 'supergroup'}}})
+
+        assert RudeBot.update_key(message) == RudeBot.update_key(call) == (CHAT_ID, 7)
+        assert RudeBot.update_key(object()) is None
@@ -0,0 +1,82 @@
+import io
+import json
+import logging
+
+import pytest
+
+from const import LoggingSettings
+from logs import JsonFormatter, TextFormatter, RateLimitFilter, configure_logging, log_fields
+
+
+class Rendered:
+    """Field value counting its renders"""
+
+    def __init__(self):
+        self.renders = 0
+
+    def __str__(self):
+        self.renders += 1
+        return 'rendered'
+
+
+@pytest.fixture
+def logger():
+    return logging.Logger('logs_test')
+
+
+def record(message: str = 'Can not delete chat message', level: int = logging.ERROR, **fields) -> logging.LogRecord:
+    return logging.makeLogRecord(dict(name='logs_test', levelno=level, levelname=logging.getLevelName(level),
+                                      msg=message, **log_fields(**fields)))
+
+
+class TestFormatters:
+    def test_json(self):
+        entry = json.loads(JsonFormatter().format(record(chat_id=-100, user=Rendered())))
+        assert entry['level'] == 'ERROR'
+        assert entry['message'] == 'Can not delete chat message'
+        assert entry['chat_id'] == -100
+        assert entry['user'] == 'rendered'
+
+    def test_text(self):
+        assert TextFormatter('%(message)s').format(record(chat_id=-100)) == 'Can not delete chat message chat_id=-100'
+
+
+class TestRateLimitFilter:
+    def test_burst(self):
+        rate_limit = RateLimitFilter(burst=3, interval=60)
+        assert [rate_limit.filter(record()) for _ in range(5)] == [True] * 3 + [False] * 2
+        assert rate_limit.filter(record('Another error'))
+        assert all(rate_limit.filter(record(level=logging.INFO)) for _ in range(5))
+
+    def test_suppressed_count(self):
+        rate_limit = RateLimitFilter(burst=1, interval=60)
+        for _ in range(4):
+            rate_limit.filter(record())
+        rate_limit._interval = 0
+        next_record = record()
+        assert rate_limit.filter(next_record)
+        assert next_record.suppressed == 3
+
+
+class TestPipeline:
+    def test_lazy_fields(self, logger):
+        stream = io.StringIO()
+        listener = configure_logging(stream=stream, logger=logger)
+        logger.setLevel(logging.INFO)
+        skipped, emitted = Rendered(), Rendered()
+        logger.debug('Trying to edit message', extra=log_fields(message=skipped))
+        logger.info('New member joined the group', extra=log_fields(user=emitted))
+        listener.stop()
+
+        assert skipped.renders == 0
+        assert emitted.renders == 1
+        lines = stream.getvalue().splitlines()
+        assert [json.loads(_)['user'] for _ in lines] == ['rendered']
+
+    def test_error_burst_is_rate_limited(self, logger):
+        stream = io.StringIO()
+        listener = configure_logging(stream=stream, logger=logger)
+        for message_id in range(100):
+            logger.error('Can not delete chat message', extra=log_fields(message_id=message_id))
+        listener.stop()
+        assert len(stream.getvalue().splitlines()) == LoggingSettings.RATE_LIMIT_BURST
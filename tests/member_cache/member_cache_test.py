@@ -0,0 +1,151 @@
+import logging
+from concurrent.futures import Future
+
+import pytest
+from telebot import TeleBot
+from telebot.apihelper import ApiException
+from telebot.types import ChatMember
+
+from bot import RudeBot
+from clock import VirtualClock
+from const import TelegramMemberStatus, MemberCacheSettings
+from dto import ChatMemberUpdateDto
+from member_cache import MemberCache
+
+CHAT_ID = -100
+USER_ID = 7
+START = 1600000000
+
+
+def chat_member(status: str, until_date: int = None, **permissions) -> ChatMember:
+    return ChatMember.de_json(dict(
+        user={'id': USER_ID, 'is_bot': False, 'first_name': 'user'},
+        status=status,
+        until_date=until_date,
+        **permissions,
+    ))
+
+
+@pytest.fixture
+def clock():
+    return VirtualClock(START)
+
+
+class TestMemberCache:
+    def test_fallback_read_is_kept_for_ttl(self, fake_api, clock):
+        bot = TeleBot('123:token')
+        cache = MemberCache(bot, logging.getLogger('member_cache_test'), ttl=30, clock=clock)
+
+        for _ in range(10):
+            assert cache.get(CHAT_ID, USER_ID).status == TelegramMemberStatus.MEMBER
+        clock.advance_to(START + 31)
+        cache.get(CHAT_ID, USER_ID)
+
+        assert fake_api.calls.count('getChatMember') == 2
+        assert (cache.hits, cache.misses) == (9, 2)
+
+    def test_member_update_needs_no_read(self, fake_api, clock):
+        bot = TeleBot('123:token')
+        cache = MemberCache(bot, logging.getLogger('member_cache_test'), clock=clock)
+        cache.process_member_update(ChatMemberUpdateDto(
+            CHAT_ID,
+            chat_member(TelegramMemberStatus.MEMBER),
+            chat_member(TelegramMemberStatus.RESTRICTED, START + 600, can_send_messages=True,
+                        can_send_media_messages=False),
+        ))
+
+        state = cache.get(CHAT_ID, USER_ID)
+
+        assert (state.status, state.until_date, state.can_send_media_messages) == \
+               (TelegramMemberStatus.RESTRICTED, START + 600, False)
+        assert fake_api.calls.count('getChatMember') == 0
+
+    def test_restricted_member_who_left_is_restricted_on_rejoin(self, fake_api, clock):
+        bot = TeleBot('123:token')
+        cache = MemberCache(bot, logging.getLogger('member_cache_test'), clock=clock)
+        cache.process_member_update(ChatMemberUpdateDto(
+            CHAT_ID,
+            chat_member(TelegramMemberStatus.RESTRICTED, START + 86400, can_send_messages=False),
+            chat_member(TelegramMemberStatus.LEFT),
+        ))
+
+        clock.advance_to(START + MemberCacheSettings.TRACKED_TTL + 1)
+        assert cache.get(CHAT_ID, USER_ID).status == TelegramMemberStatus.RESTRICTED
+        assert fake_api.calls.count('getChatMember') == 0
+
+        clock.advance_to(START + 86400)
+        assert cache.get(CHAT_ID, USER_ID).status == TelegramMemberStatus.MEMBER
+        assert fake_api.calls.count('getChatMember') == 1
+
+    @pytest.mark.parametrize(
+        'permissions, status, media',
+        [
+            (dict(), TelegramMemberStatus.RESTRICTED, False),
+            (dict(can_send_messages=True, can_send_media_messages=False), TelegramMemberStatus.RESTRICTED, False),
+            (dict(can_send_messages=True, can_send_media_messages=True), TelegramMemberStatus.RESTRICTED, True),
+            (dict(can_send_messages=True, can_send_media_messages=True, can_send_other_messages=True,
+                  can_add_web_page_previews=True), TelegramMemberStatus.MEMBER, None),
+        ]
+    )
+    def test_own_restriction_is_tracked(self, fake_api, clock, permissions, status, media):
+        bot = TeleBot('123:token')
+        cache = MemberCache(bot, logging.getLogger('member_cache_test'), clock=clock)
+        future = Future()
+        future.set_result(True)
+
+        cache.record_call('restrict_chat_member', (), dict(chat_id=CHAT_ID, user_id=USER_ID, **permissions), future)
+        state = cache.get(CHAT_ID, USER_ID)
+
+        assert (state.status, state.can_send_media_messages) == (status, media)
+        assert fake_api.calls.count('getChatMember') == 0
+
+    def test_kick_is_tracked_until_it_ends(self, fake_api, clock):
+        fake_api.member_status = TelegramMemberStatus.LEFT
+        bot = TeleBot('123:token')
+        cache = MemberCache(bot, logging.getLogger('member_cache_test'), clock=clock)
+        future = Future()
+        future.set_result(True)
+
+        cache.record_call('kick_chat_member', (CHAT_ID, USER_ID, START + 60), dict(), future)
+
+        assert cache.get(CHAT_ID, USER_ID).status == TelegramMemberStatus.KICKED
+        clock.advance_to(START + 60)
+        assert cache.get(CHAT_ID, USER_ID).status == TelegramMemberStatus.LEFT
+        assert fake_api.calls.count('getChatMember') == 1
+
+    def test_failed_call_invalidates_state(self, fake_api, clock):
+        bot = TeleBot('123:token')
+        cache = MemberCache(bot, logging.getLogger('member_cache_test'), clock=clock)
+        cache.record_kick(CHAT_ID, USER_ID)
+        future = Future()
+        future.set_exception(ApiException('Bad Request', 'restrictChatMember', None))
+
+        cache.record_call('restrict_chat_member', (CHAT_ID, USER_ID), dict(can_send_messages=True), future)
+
+        assert cache.get(CHAT_ID, USER_ID).status == TelegramMemberStatus.MEMBER
+        assert fake_api.calls.count('getChatMember') == 1
+
+    def test_capacity_drops_oldest_entries(self, fake_api, clock):
+        cache = MemberCache(TeleBot('123:token'), logging.getLogger('member_cache_test'), clock=clock, capacity=2)
+        for user_id in range(1, 4):
+            cache.record_kick(CHAT_ID, user_id)
+
+        assert len(cache) == 2
+        assert cache.peek(CHAT_ID, 1) is None
+        assert cache.peek(CHAT_ID, 3).status == TelegramMemberStatus.KICKED
+
+    def test_bot_tracks_member_updates_before_handlers(self, fake_api, clock):
+        bot = RudeBot('0:test', threaded=False)
+        bot.member_cache = MemberCache(TeleBot('123:token'), logging.getLogger('member_cache_test'), clock=clock)
+        seen = []
+        bot.chat_member_handler(lambda update: seen.append(bot.member_cache.peek(update.chat_id, update.user_id)))
+        user = {'id': USER_ID, 'is_bot': False, 'first_name': 'user'}
+        member_update = dict(
+            chat={'id': CHAT_ID, 'type': 'supergroup'},
+            old_chat_member=dict(user=user, status=TelegramMemberStatus.LEFT),
+            new_chat_member=dict(user=user, status=TelegramMemberStatus.MEMBER),
+        )
+
+        bot.process_new_updates(bot.de_json_updates([{'update_id': 1, 'chat_member': member_update}]))
+
+        assert seen[0].status == TelegramMemberStatus.MEMBER
@@ -0,0 +1,174 @@
+import logging
+import threading
+import urllib.request
+from urllib.error import HTTPError
+
+import pytest
+from telebot import TeleBot
+from telebot.apihelper import ApiException
+
+from application import Application, create_app
+from const import MetricsSettings, OutboundPriority
+from metrics import MetricsRegistry, MetricsServer
+from scheduler import TaskScheduler
+from transport import ApiTransport
+
+CHAT_ID = -100
+logger = logging.getLogger('metrics_test')
+
+
+@pytest.fixture
+def app(fake_api, tmp_path, monkeypatch) -> Application:
+    monkeypatch.setenv('TELEGRAM_TOKEN', '123:token')
+    monkeypatch.setenv('TELEGRAM_CHAT_ID', str(CHAT_ID))
+    monkeypatch.setenv('STATE_FILE', str(tmp_path / 'state.sqlite3'))
+    monkeypatch.setenv('METRICS_PORT', '0')
+    for name in 'CHATS_FILE', 'CAPTURE_FILE':
+        monkeypatch.delenv(name, raising=False)
+    app = create_app(logger)
+    app.start_metrics_server()
+    yield app
+    app._metrics_server.stop()
+
+
+class TestMetricsRegistry:
+    def test_histogram(self):
+        metrics = MetricsRegistry(buckets=(0.1, 1))
+        for value in 0.05, 0.5, 0.5, 5:
+            metrics.observe(MetricsSettings.HANDLER_LATENCY, ('restrict_handler',), value)
+
+        text = metrics.render()
+        assert 'bot_handler_seconds_bucket{handler="restrict_handler",le="0.1"} 1' in text
+        assert 'bot_handler_seconds_bucket{handler="restrict_handler",le="1"} 3' in text
+        assert 'bot_handler_seconds_bucket{handler="restrict_handler",le="+Inf"} 4' in text
+        assert 'bot_handler_seconds_count{handler="restrict_handler"} 4' in text
+        assert '# TYPE bot_handler_seconds histogram' in text
+
+    def test_counter_and_gauges(self):
+        metrics = MetricsRegistry()
+        metrics.inc(MetricsSettings.API_ERRORS, ('kickChatMember', '403'))
+        metrics.inc(MetricsSettings.API_ERRORS, ('kickChatMember', '403'))
+        metrics.gauge(MetricsSettings.NEWBIES, lambda: {(-100,): 3})
+
+        text = metrics.render()
+        assert 'bot_api_errors_total{method="kickChatMember",code="403"} 2' in text
+        assert 'bot_newbies{chat_id="-100"} 3' in text
+        assert f'bot_threads {threading.active_count()}' in text
+
+    def test_threads_record_into_own_shards(self):
+        metrics = MetricsRegistry()
+        count = 20000
+
+        def record():
+            for _ in range(count):
+                metrics.observe(MetricsSettings.HANDLER_LATENCY, ('greeting_handler',), 0.001)
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        series = metrics.collect()[(MetricsSettings.HANDLER_LATENCY, ('greeting_handler',))]
+        assert series[-1] == count * 4
+
+    def test_timed_records_failed_calls(self):
+        metrics = MetricsRegistry()
+
+        @metrics.timed(MetricsSettings.HANDLER_LATENCY, 'failing')
+        def handler(fail: bool):
+            if fail:
+                raise ValueError
+
+        handler(False)
+        with pytest.raises(ValueError):
+            handler(True)
+        metrics.inc(MetricsSettings.API_ERRORS, ('sendMessage', '429'))
+        metrics.inc(MetricsSettings.API_ERRORS, ('sendMessage', '429'))
+
+        series = metrics.collect()
+        assert series[(MetricsSettings.HANDLER_LATENCY, ('failing',))][-1] == 2
+        assert series[(MetricsSettings.API_ERRORS, ('sendMessage', '429'))] == [2]
+
+
+class TestInstrumentation:
+    def test_api_latency_and_errors(self, fake_api):
+        fake_api.errors['restrictChatMember'] = 400
+        metrics = MetricsRegistry()
+        transport = ApiTransport(logger, metrics=metrics)
+        transport.install()
+        bot = TeleBot('123:token')
+        try:
+            bot.delete_message(-100, 1)
+            with pytest.raises(ApiException):
+                bot.restrict_chat_member(-100, 1, until_date=0)
+        finally:
+            transport.uninstall()
+
+        series = metrics.collect()
+        assert series[(MetricsSettings.API_LATENCY, ('deleteMessage',))][-1] == 1
+        assert series[(MetricsSettings.API_LATENCY, ('restrictChatMember',))][-1] == 1
+        assert series[(MetricsSettings.API_ERRORS, ('restrictChatMember', '400'))] == [1]
+
+    def test_scheduled_task_lag(self):
+        metrics = MetricsRegistry()
+        scheduler = TaskScheduler(logger, metrics=metrics)
+        done = threading.Event()
+
+        def timeout_kick():
+            done.set()
+
+        scheduler.start()
+        scheduler.schedule(0.01, timeout_kick)
+        assert done.wait(5)
+        scheduler.stop()
+        lag = metrics.collect()[(MetricsSettings.SCHEDULER_LAG, ('timeout_kick',))]
+        assert lag[-1] == 1
+        assert 0 <= lag[-2] < 1
+
+    def test_server(self):
+        metrics = MetricsRegistry()
+        server = MetricsServer(metrics, logger, host='127.0.0.1', port=0)
+        server.start()
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{server.port}/metrics') as response:
+                assert response.headers['Content-Type'] == MetricsSettings.CONTENT_TYPE
+                assert b'bot_threads' in response.read()
+            with pytest.raises(HTTPError):
+                urllib.request.urlopen(f'http://127.0.0.1:{server.port}/')
+        finally:
+            server.stop()
+
+
+class TestApplicationMetrics:
+    def test_admin_cache_lookups(self, app):
+        app.admin_cache.get(CHAT_ID)
+        app.admin_cache.get(CHAT_ID)
+
+        text = app.metrics.render()
+        assert 'bot_admin_cache_lookups_total{result="hit"} 1' in text
+        assert 'bot_admin_cache_lookups_total{result="miss"} 1' in text
+
+    def test_outbound_queue(self, app):
+        app.dispatcher.start()
+        try:
+            app.dispatcher.call(OutboundPriority.CLEANUP, CHAT_ID, lambda: None)
+        finally:
+            app.dispatcher.stop()
+
+        text = app.metrics.render()
+        assert 'bot_outbound_queue_depth{priority="cleanup"} 0' in text
+        assert 'bot_outbound_sent_total{priority="cleanup"} 1' in text
+        assert 'bot_outbound_wait_max_seconds{priority="moderation"} 0' in text
+        assert 'bot_outbound_retries_total 0' in text
+
+    def test_connection_reuse(self, app):
+        app.transport.install()
+        try:
+            for _ in range(3):
+                app.bot.get_chat_member(CHAT_ID, 1)
+        finally:
+            app.transport.uninstall()
+
+        text = app.metrics.render()
+        assert 'bot_api_transport_requests_total 3' in text
+        assert 'bot_api_transport_connections_total 1' in text
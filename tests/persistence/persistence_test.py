@@ -0,0 +1,101 @@
+import logging
+import time
+
+import pytest
+from telebot.types import User, Message
+
+from dto import GreetingQuestionDto, RestrictionDto, RestrictedUserDto
+from greeting import NewbieStorage
+from persistence import StateJournal
+from restriction import RestrictionStorage
+
+CHAT_ID = -100
+OTHER_CHAT_ID = -200
+logger = logging.getLogger('persistence_test')
+
+
+def greeting(message_id: int) -> Message:
+    return Message.de_json({'message_id': message_id, 'date': 1000, 'chat': {'id': CHAT_ID, 'type': 'supergroup'}})
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = StateJournal(tmp_path / 'state.sqlite3', logger)
+    journal.start()
+    yield journal
+    journal.stop()
+
+
+class TestStateJournal:
+    def test_newbie_roundtrip(self, journal):
+        storage = NewbieStorage(logger, journal, CHAT_ID)
+        question = GreetingQuestionDto(text='?', keyboard=None, timeout=120, reply={'0': 'yes', '1': 'no'})
+        for user_id in 1, 2, 3:
+            user = User(id=user_id, is_bot=False, first_name=f'user_{user_id}', username=None)
+            storage.add(user=user, timeout=1120, question=question)
+            storage.update(user=user, greeting=greeting(user_id * 10))
+        storage.remove(User(id=2, is_bot=False, first_name='user_2'))
+        journal.flush()
+
+        restored = NewbieStorage(logger, journal, CHAT_ID)
+        assert restored.load() == 2
+        newbie = restored.get(User(id=3, is_bot=False, first_name='user_3'))
+        assert newbie.user.first_name == 'user_3'
+        assert newbie.timeout == 1120
+        assert newbie.question.reply == {'0': 'yes', '1': 'no'}
+        assert (newbie.greeting.chat.id, newbie.greeting.message_id) == (CHAT_ID, 30)
+
+    def test_restriction_roundtrip(self, journal):
+        storage = RestrictionStorage(logger, journal, CHAT_ID)
+        user = User(id=1, is_bot=False, first_name='user')
+        storage.add(RestrictedUserDto(user, CHAT_ID, 0, RestrictionDto(True, False, True, False), 2000))
+        journal.flush()
+
+        restored = RestrictionStorage(logger, journal, CHAT_ID)
+        assert restored.load() == 1
+        restricted = restored.get(user)
+        assert restricted.restore_at == 2000
+        assert restricted.restriction.media is False
+        assert restricted.restriction.other is True
+
+    def test_join_flood_write_throughput(self, journal):
+        count = 20000
+        storage = NewbieStorage(logger, journal, CHAT_ID)
+        question = GreetingQuestionDto(text='?', keyboard=None, timeout=120, reply={'0': 'ok'})
+
+        start = time.perf_counter()
+        for user_id in range(count):
+            user = User(id=user_id, is_bot=False, first_name='user')
+            storage.add(user=user, timeout=1120, question=question)
+            storage.update(user=user, greeting=greeting(user_id))
+        enqueued = time.perf_counter() - start
+        journal.flush()
+        committed = time.perf_counter() - start
+
+        print(f'\n{count} joins: {enqueued / count / 2 * 1e6:.1f}us per handler write, '
+              f'{count * 2 / committed:.0f} writes/s committed')
+        assert NewbieStorage(logger, journal, CHAT_ID).load() == count
+
+    def test_writer_survives_bad_record(self, journal):
+        storage = NewbieStorage(logger, journal, CHAT_ID)
+        user = User(id=1, is_bot=False, first_name='user')
+        storage.add(user=user, timeout=1120, question=None)
+        journal.flush()
+        storage.remove(user)
+        storage.add(user=user, timeout=1120, question=GreetingQuestionDto('?', None, 120, {'0': 'ok'}))
+        journal.flush()
+
+        assert NewbieStorage(logger, journal, CHAT_ID).load() == 1
+
+    def test_same_user_in_two_chats(self, journal):
+        question = GreetingQuestionDto(text='?', keyboard=None, timeout=120, reply={'0': 'ok'})
+        user = User(id=1, is_bot=False, first_name='user')
+        storages = [NewbieStorage(logger, journal, chat_id) for chat_id in (CHAT_ID, OTHER_CHAT_ID)]
+        for storage in storages:
+            storage.add(user=user, timeout=1120, question=question)
+        storages[1].remove(user)
+        journal.flush()
+
+        assert NewbieStorage(logger, journal, CHAT_ID).load() == 1
+        assert NewbieStorage(logger, journal, OTHER_CHAT_ID).load() == 0
+
@@ -0,0 +1,68 @@
+import logging
+import time
+
+import pytest
+from telebot.types import Message
+
+from bot import RudeBot
+from const import MetricsSettings, RaidSettings
+from metrics import MetricsRegistry
+from notification import Notification
+from raid import JoinRateDetector, RaidGuard
+from scheduler import TaskScheduler
+
+CHAT_ID = -100
+logger = logging.getLogger('raid_test')
+
+
+def join_message(*user_ids: int) -> Message:
+    return Message.de_json({
+        'message_id': user_ids[0],
+        'date': int(time.time()),
+        'chat': {'id': CHAT_ID, 'type': 'supergroup'},
+        'new_chat_members': [{'id': _, 'is_bot': False, 'first_name': f'user_{_}'} for _ in user_ids],
+    })
+
+
+class TestJoinRateDetector:
+    @pytest.mark.parametrize(
+        'joins, expected',
+        [
+            ([1] * 10, False),
+            ([1] * 11, True),
+            ([5, 6], True),
+        ]
+    )
+    def test_threshold(self, joins, expected):
+        detector = JoinRateDetector(threshold=10, window=60, cooldown=300)
+        active = [detector.register(count, now=1000 + i) for i, count in enumerate(joins)]
+        assert active[-1] is expected
+
+    def test_cooldown(self):
+        detector = JoinRateDetector(threshold=1, window=10, cooldown=30)
+        assert detector.register(2, now=0)
+        assert detector.register(0, now=29)
+        assert not detector.register(0, now=31)
+
+
+class TestRaidGuard:
+    def test_raid_batch_gets_one_message(self, fake_api):
+        bot = RudeBot('123:token', threaded=False)
+        scheduler = TaskScheduler(logger)
+        metrics = MetricsRegistry()
+        guard = RaidGuard(bot, scheduler, Notification(), logger, JoinRateDetector(threshold=5), metrics=metrics)
+
+        handled = [guard.handle(join_message(user_id)) for user_id in range(1, 101)]
+        guard._flush(CHAT_ID)
+        scheduler.stop()
+
+        assert handled == [False] * 5 + [True] * 95
+        assert fake_api.calls.count('restrictChatMember') == 95
+        assert fake_api.calls.count('deleteMessage') == 95
+        assert fake_api.calls.count('sendMessage') == 1
+        assert 'и ещё 65' in fake_api.sent_messages[-1]['text']
+        assert RaidSettings.DURATION.text in fake_api.sent_messages[-1]['text']
+        until_dates = [int(params['until_date']) for method_name, params in fake_api.requests
+                       if method_name == 'restrictChatMember']
+        assert all(0 < until_date - time.time() <= RaidSettings.DURATION.seconds for until_date in until_dates)
+        assert metrics.collect()[(MetricsSettings.JOIN_TO_RESTRICT, ())][-1] == 95
@@ -0,0 +1,113 @@
+import gzip
+import logging
+import threading
+import time
+
+import pytest
+
+from application import create_app
+from capture import UpdateRecorder
+from clock import VirtualClock
+from dispatcher import OutboundDispatcher
+from replay import Replayer, StubTransport
+from scheduler import TaskScheduler
+
+START = 1600000000.0
+CHAT_ID = -100
+ADMIN_ID = 1
+NEWBIE_ID = 2
+
+
+def join_update(update_id: int, received_at: float) -> dict:
+    user = dict(id=NEWBIE_ID, is_bot=False, first_name='newbie')
+    return dict(update_id=update_id, message=dict(
+        message_id=update_id,
+        date=int(received_at),
+        chat=dict(id=CHAT_ID, type='supergroup'),
+        new_chat_members=[user],
+        **{'from': user},
+    ))
+
+
+class TestVirtualClock:
+    def test_advance(self):
+        clock = VirtualClock(START)
+        clock.advance_to(START + 10)
+        clock.advance_to(START + 5)
+        assert clock.time() == START + 10
+        assert clock.monotonic() == 10
+
+    def test_speed(self):
+        clock = VirtualClock(START, speed=1000)
+        clock.sleep(50)
+        assert 50 <= clock.monotonic() < 1000
+
+    def test_scheduler_fires_in_virtual_time(self):
+        clock = VirtualClock(START)
+        scheduler = TaskScheduler(logging.getLogger(), clock=clock)
+        fired = threading.Event()
+        scheduler.start()
+        try:
+            scheduler.schedule(3600, fired.set)
+            assert scheduler.next_run_at() == 3600
+            assert not fired.wait(0.1)
+            clock.advance_to(START + 3600)
+            assert fired.wait(1)
+        finally:
+            scheduler.stop()
+
+
+class TestUpdateRecorder:
+    def test_roundtrip(self, tmp_path):
+        file_path = tmp_path / 'capture.jsonl.gz'
+        recorder = UpdateRecorder(file_path, VirtualClock(START))
+        recorder.record([{'update_id': 1}, {'update_id': 2}])
+        recorder.close()
+        assert list(UpdateRecorder.read(file_path)) == [(START, {'update_id': 1}), (START, {'update_id': 2})]
+
+    def test_truncated(self, tmp_path):
+        file_path = tmp_path / 'capture.jsonl.gz'
+        recorder = UpdateRecorder(file_path, VirtualClock(START))
+        recorder.record([{'update_id': 1}])
+        # Not closed, as if the bot was killed: flushed records are still readable
+        data = file_path.read_bytes()
+        recorder.close()
+        file_path.write_bytes(data)
+        assert list(UpdateRecorder.read(file_path)) == [(START, {'update_id': 1})]
+
+    def test_empty(self, tmp_path):
+        file_path = tmp_path / 'capture.jsonl.gz'
+        with gzip.open(str(file_path), 'wb'):
+            pass
+        assert list(UpdateRecorder.read(file_path)) == []
+
+
+class TestReplayer:
+    def test_timeout_kick(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('TELEGRAM_TOKEN', '0:replay')
+        monkeypatch.setenv('TELEGRAM_CHAT_ID', str(CHAT_ID))
+        monkeypatch.setenv('STATE_FILE', str(tmp_path / 'state.sqlite3'))
+        for name in 'CHATS_FILE', 'METRICS_PORT', 'CAPTURE_FILE':
+            monkeypatch.delenv(name, raising=False)
+
+        logger = logging.getLogger()
+        clock = VirtualClock(START)
+        transport = StubTransport(clock, (ADMIN_ID,))
+        app = create_app(logger, components=dict(
+            clock=clock,
+            transport=transport,
+            dispatcher=OutboundDispatcher(logger, rate_limits=False),
+        ))
+        records = [(START, join_update(1, START))]
+        app.start()
+        started = time.monotonic()
+        try:
+            assert Replayer(app, clock, logger).run(records, tail=24 * 60 * 60) == 1
+        finally:
+            app.stop()
+
+        assert time.monotonic() - started < 30
+        assert clock.time() == pytest.approx(START + 24 * 60 * 60)
+        assert transport.calls['sendMessage'] >= 1
+        assert transport.calls['restrictChatMember'] >= 1
+        assert transport.calls['kickChatMember'] == 1
@@ -0,0 +1,73 @@
+import pytest
+from telebot.types import Message
+
+from const import Command, TelegramChatType
+from router import CommandRouter
+
+CHAT_ID = -100
+
+
+def chat_message(text: str, chat_id: int = CHAT_ID, chat_type: str = TelegramChatType.SUPER_GROUP) -> Message:
+    return Message.de_json({
+        'message_id': 1,
+        'date': 0,
+        'chat': {'id': chat_id, 'type': chat_type},
+        'from': {'id': 1, 'is_bot': False, 'first_name': 'user'},
+        'text': text,
+    })
+
+
+@pytest.fixture
+def router():
+    router = CommandRouter({CHAT_ID})
+    for command in Command.RO, Command.TO, Command.RW, Command.BAN, Command.PASS, Command.PING, Command.ME:
+        router.command(command)(lambda message, command=command: command)
+    return router
+
+
+class TestCommandRouter:
+    @pytest.mark.parametrize(
+        'text, expected',
+        [
+            ('!ro 10m', Command.RO),
+            ('/to@rude_qa_bot 1h', Command.TO),
+            ('!rw', Command.RW),
+            ('!rw something', None),
+            ('/pass foo', None),
+            ('!ban 1d spam', Command.BAN),
+            ('/pass', Command.PASS),
+            ('/ping', Command.PING),
+            ('/me sleeps', Command.ME),
+            ('!robot', None),
+            ('hello !ro', None),
+            ('', None),
+        ]
+    )
+    def test_dispatch(self, router, text, expected):
+        assert router.dispatch(chat_message(text)) is expected
+        assert router.get_command(chat_message(text)) is expected
+
+    @pytest.mark.parametrize(
+        'chat_id, chat_type',
+        [
+            (CHAT_ID, 'private'),
+            (-200, TelegramChatType.SUPER_GROUP),
+        ]
+    )
+    def test_foreign_chat(self, router, chat_id, chat_type):
+        assert not router.accepts(chat_message('!ro', chat_id, chat_type))
+
+    def test_route_is_looked_up_once(self, router, monkeypatch):
+        lookups = []
+        match = router._match
+        monkeypatch.setattr(router, '_match', lambda message: lookups.append(message) or match(message))
+        message = chat_message('!ro 10m')
+
+        assert router.accepts(message)
+        assert router.dispatch(message) is router.get_command(message) is Command.RO
+        assert len(lookups) == 1
+
+    @pytest.mark.parametrize('text', ['just some chat text', 'ro 10m', '! ro', '/', '!', 'hello /ping'])
+    def test_chat_text_is_not_accepted(self, router, text):
+        assert not router.accepts(chat_message(text))
+        assert router.get_command(chat_message(text)) is None
@@ -0,0 +1,76 @@
+import logging
+import threading
+import time
+import tracemalloc
+
+import pytest
+
+from scheduler import TaskScheduler
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = TaskScheduler(logging.getLogger('scheduler_test'))
+    scheduler.start()
+    yield scheduler
+    scheduler.stop()
+
+
+class TestTaskScheduler:
+    def test_tasks_fire_in_deadline_order(self, scheduler):
+        fired = []
+        done = threading.Event()
+        scheduler.schedule(0.2, lambda: (fired.append('late'), done.set()))
+        scheduler.schedule(0.1, fired.append, ('early',))
+
+        assert done.wait(2)
+        assert fired == ['early', 'late']
+
+    def test_keyed_task_replaces_pending_one(self, scheduler):
+        fired = []
+        done = threading.Event()
+        scheduler.schedule(0.1, fired.append, ('stale',), key=(1, 'restore'))
+        scheduler.schedule(0.2, lambda: (fired.append('actual'), done.set()), key=(1, 'restore'))
+
+        assert len(scheduler) == 1
+        assert done.wait(2)
+        assert fired == ['actual']
+        assert (1, 'restore') not in scheduler
+
+    def test_cancel(self, scheduler):
+        fired = []
+        scheduler.schedule(0.05, fired.append, ('kick',), key=(1, 'timeout_kick'))
+
+        assert scheduler.cancel((1, 'timeout_kick'))
+        assert not scheduler.cancel((1, 'timeout_kick'))
+        time.sleep(0.15)
+        assert fired == []
+        assert len(scheduler) == 0
+
+    def test_100k_pending_timers(self, scheduler):
+        count = 100000
+        lags = []
+        done = threading.Event()
+
+        def action(intended: float):
+            lags.append(time.monotonic() - intended)
+            if len(lags) == count:
+                done.set()
+
+        threads_before = threading.active_count()
+        tracemalloc.start()
+        for i in range(count):
+            pause = 3 + (i % 1000) / 1000
+            scheduler.schedule(pause, action, (time.monotonic() + pause,), key=(i, 'restore'))
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        assert len(scheduler) == count
+        assert threading.active_count() - threads_before <= 2
+        assert done.wait(30)
+
+        lags.sort()
+        p50, p99 = lags[count // 2], lags[int(count * 0.99)]
+        print(f'\n100k timers: {memory / count:.0f} bytes/timer, lag p50={p50 * 1000:.1f}ms p99={p99 * 1000:.1f}ms')
+        assert memory / count < 1024
+        assert p99 < 2
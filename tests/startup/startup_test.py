@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from startup import StartupProfiler
+
+SRC = Path(__file__).parents[2] / 'src'
+READY_BUDGET = 1.0  # seconds from process start to the first getUpdates request
+
+STARTUP_SCRIPT = '''
+import logging, sys, threading
+from startup import StartupProfiler
+profiler = StartupProfiler()
+profiler.install()
+
+from telebot import apihelper
+from application import create_app
+
+apihelper.API_URL = sys.argv[1]
+logging.basicConfig(level=logging.WARNING)
+app = create_app(logging.getLogger(), profiler=profiler)
+thread = threading.Thread(target=app.run)
+thread.start()
+while profiler.ready_time is None:
+    thread.join(0.01)
+app.bot.stop_polling()
+thread.join()
+print(profiler.report())
+print(profiler.ready_time)
+'''
+
+
+class TestStartupProfiler:
+    def test_self_time(self):
+        profiler = StartupProfiler()
+        with profiler.component('outer'):
+            with profiler.component('inner'):
+                sum(range(100000))
+        (outer_total, outer_self), (inner_total, inner_self) = profiler._components['outer'], profiler._components['inner']
+        assert outer_total >= inner_total == inner_self
+        assert outer_self == pytest.approx(outer_total - inner_total)
+
+    def test_time_to_first_get_updates(self, fake_api, tmp_path):
+        env = dict(
+            os.environ,
+            PYTHONPATH=str(SRC),
+            TELEGRAM_TOKEN='123456789:token',
+            TELEGRAM_CHAT_ID='-100',
+            STATE_FILE=str(tmp_path / 'state.sqlite3'),
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', STARTUP_SCRIPT, fake_api.url],
+            env=env, cwd=str(SRC.parent), stdout=subprocess.PIPE, timeout=60,
+        )
+        output = result.stdout.decode().strip().split('\n')
+        print('\n' + '\n'.join(output[:-1]))
+        assert result.returncode == 0
+        assert float(output[-1]) < READY_BUDGET
@@ -0,0 +1,147 @@
+import logging
+import time
+import tracemalloc
+
+import pytest
+from telebot.types import Message, User
+
+from admin_cache import AdminCache
+from bot import RudeBot
+from const import Command, RestrictDuration, BanDuration, FloodSettings
+from dto import GreetingQuestionDto
+from error import ChatConfigLoadError
+from greeting import QuestionProvider
+from router import CommandRouter
+from scheduler import TaskScheduler
+from tenancy import ChatConfigLoader, ChatContext
+
+CHAT_ID = -100
+logger = logging.getLogger('tenancy_test')
+
+CHATS_YAML = """
+chats:
+  - chat_id: -100
+  - chat_id: -200
+    questions_file: resources/other_questions.yaml
+    restrict_duration: {default: 10m, max: 1d}
+    ban_duration: {max: 30d}
+    notifications:
+      read_only: ['{first_name} помолчит {duration_text}']
+    flood: {media: [2, null, 20]}
+"""
+
+
+def chat_message(text: str, chat_id: int) -> Message:
+    return Message.de_json({
+        'message_id': 1,
+        'date': 0,
+        'chat': {'id': chat_id, 'type': 'supergroup'},
+        'from': {'id': 1, 'is_bot': False, 'first_name': 'user'},
+        'text': text,
+    })
+
+
+def create_chats(count: int, questions: QuestionProvider) -> dict:
+    bot = RudeBot('123:token', threaded=False)
+    scheduler = TaskScheduler(logger)
+    admin_cache = AdminCache(bot, scheduler, logger)
+    return {
+        chat_id: ChatContext(ChatConfigLoader.default(chat_id), bot, scheduler, admin_cache, None, questions, logger)
+        for chat_id in range(CHAT_ID, CHAT_ID - count, -1)
+    }
+
+
+@pytest.fixture
+def chats_file(tmp_path):
+    file_path = tmp_path / 'chats.yaml'
+    file_path.write_text(CHATS_YAML, encoding='utf8')
+    return file_path
+
+
+class TestChatConfigLoader:
+    def test_defaults(self, chats_file):
+        config = ChatConfigLoader.load(chats_file)[0]
+        assert config.chat_id == CHAT_ID
+        assert config.restrict_duration is RestrictDuration
+        assert config.ban_duration is BanDuration
+        assert config.notifications == dict()
+        assert config.flood_thresholds is None
+
+    def test_duration_overrides(self, chats_file):
+        config = ChatConfigLoader.load(chats_file)[1]
+        chat = create_chats(1, QuestionProvider())[CHAT_ID]
+
+        assert chat.methods.get_duration('', config.restrict_duration).seconds == 600
+        assert chat.methods.get_duration('2d', config.restrict_duration).seconds == 86400
+        assert chat.methods.get_duration('60d', config.ban_duration).seconds == 30 * 86400
+        assert chat.methods.get_duration('', RestrictDuration).seconds == 300
+
+    def test_notification_overrides(self, chats_file):
+        config = ChatConfigLoader.load(chats_file)[1]
+        bot = RudeBot('123:token', threaded=False)
+        chat = ChatContext(config, bot, TaskScheduler(logger), None, None, QuestionProvider(), logger)
+        assert chat.notification.read_only('user', '10 минут') == 'user помолчит 10 минут'
+
+    def test_flood_overrides(self, chats_file):
+        config = ChatConfigLoader.load(chats_file)[1]
+        assert config.flood_thresholds == dict(FloodSettings.THRESHOLDS, media=(2, None, 20))
+
+    @pytest.mark.parametrize(
+        'content',
+        [
+            'chats: []',
+            'chats:\n  - chat_id: -100\n  - chat_id: -100',
+            'chats:\n  - chat_id: chat',
+            'chats:\n  - chat_id: -100\n    restrict_duration: {default: soon}',
+            'chats:\n  - chat_id: -100\n    restrict_duration: {max: 1s}',
+            'chats:\n  - chat_id: -100\n    notifications: {read_only: []}',
+            'chats:\n  - chat_id: -100\n    flood: {stickers: [1, 2, 3]}',
+            'chats:\n  - chat_id: -100\n    flood: {messages: [1, 2]}',
+        ]
+    )
+    def test_malformed(self, tmp_path, content):
+        file_path = tmp_path / 'chats.yaml'
+        file_path.write_text(content, encoding='utf8')
+        with pytest.raises(ChatConfigLoadError):
+            ChatConfigLoader.load(file_path)
+
+
+class TestChatContext:
+    def test_same_user_in_two_chats(self):
+        chats = create_chats(2, QuestionProvider())
+        question = GreetingQuestionDto(text='?', keyboard=None, timeout=120, reply={'0': 'ok'})
+        user = User(id=1, is_bot=False, first_name='user')
+        for chat in chats.values():
+            chat.newbie_storage.add(user=user, timeout=1120, question=question)
+
+        chats[CHAT_ID].newbie_storage.remove(user)
+        assert user.id not in chats[CHAT_ID].newbie_storage
+        assert user.id in chats[CHAT_ID - 1].newbie_storage
+        assert chats[CHAT_ID].methods.task_key(user.id, 'kick') != chats[CHAT_ID - 1].methods.task_key(user.id, 'kick')
+
+    def test_cost_per_chat(self):
+        questions = QuestionProvider()
+        questions.get_questions()
+        create_chats(1, questions)
+
+        results = []
+        for count in 1, 10, 50:
+            tracemalloc.start()
+            chats = create_chats(count, questions)
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            router = CommandRouter(chats)
+            router.command(Command.RO)(lambda message: message.chat.id)
+            messages = [chat_message('!ro 10m', chat_id) for chat_id in chats] * (2000 // count)
+            started = time.perf_counter()
+            for message in messages:
+                assert router.dispatch(message) in chats
+            latency = (time.perf_counter() - started) / len(messages)
+            results.append((count, memory / count, latency))
+
+        print()
+        for count, memory, latency in results:
+            print(f'{count:3} chats: {memory / 1024:.1f}KiB per chat, {latency * 1e6:.2f}us per routed command')
+        assert results[-1][1] < 64 * 1024
+        assert results[-1][2] < results[0][2] * 4
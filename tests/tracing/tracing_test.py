@@ -0,0 +1,108 @@
+import json
+import logging
+import time
+
+from bot import RudeBot
+from tracing import Tracer, traced
+
+logger = logging.getLogger('tracing_test')
+
+
+class Update:
+    def __init__(self, update_id: int):
+        self.update_id = update_id
+
+
+@traced
+def is_admin():
+    time.sleep(0.001)
+
+
+@traced
+def restrict():
+    is_admin()
+
+
+def read_events(file_path) -> list:
+    return json.loads(file_path.read_text(encoding='utf8').rstrip().rstrip(',') + ']')
+
+
+class TestTracer:
+    def test_spans_by_update(self, tmp_path):
+        file_path = tmp_path / 'trace.json'
+        tracer = Tracer(logger, file_path, sample_rate=1)
+        tracer.start()
+        tracer.handler(lambda update: restrict())(Update(42))
+        tracer.stop()
+
+        events = read_events(file_path)
+        assert [_['name'] for _ in events] == ['is_admin', 'restrict', '<lambda>']
+        assert {_['args']['update_id'] for _ in events} == {42}
+        assert {_['ph'] for _ in events} == {'X'}
+        is_admin_event, restrict_event, handler_event = events
+        assert restrict_event['ts'] <= is_admin_event['ts']
+        assert handler_event['dur'] >= restrict_event['dur'] >= is_admin_event['dur'] >= 1000
+
+    def test_not_sampled(self, tmp_path):
+        file_path = tmp_path / 'trace.json'
+        tracer = Tracer(logger, file_path, sample_rate=0)
+        tracer.start()
+        tracer.handler(lambda update: restrict())(Update(42))
+        tracer.stop()
+        assert not file_path.exists()
+
+    def test_rotation(self, tmp_path):
+        file_path = tmp_path / 'trace.json'
+        tracer = Tracer(logger, file_path, sample_rate=1, max_bytes=1000, backup_count=2)
+        tracer.start()
+        handler = tracer.handler(lambda update: restrict())
+        for update_id in range(100):
+            handler(Update(update_id))
+        tracer.stop()
+
+        assert sorted(_.name for _ in tmp_path.iterdir()) == ['trace.json', 'trace.json.1', 'trace.json.2']
+        assert read_events(tmp_path / 'trace.json.1')[-1]['args']['update_id'] < 100
+
+    def test_watchdog(self, caplog):
+        tracer = Tracer(logger, budget=0.1)
+        tracer.start()
+
+        def slow_handler(update):
+            time.sleep(0.5)
+
+        with caplog.at_level(logging.WARNING, logger='tracing_test'):
+            tracer.handler(slow_handler)(Update(7))
+        tracer.stop()
+
+        warnings = [_.getMessage() for _ in caplog.records]
+        assert len(warnings) == 1
+        assert 'Handler slow_handler of update 7' in warnings[0]
+        assert 'time.sleep(0.5)' in warnings[0]
+
+    def test_untraced_call_cost(self):
+        def noop():
+            pass
+
+        wrapped = traced(noop)
+        count = 200000
+        started = time.perf_counter()
+        for _ in range(count):
+            noop()
+        plain = (time.perf_counter() - started) / count
+        started = time.perf_counter()
+        for _ in range(count):
+            wrapped()
+        overhead = (time.perf_counter() - started) / count - plain
+
+        print(f'\nspan overhead without trace: {overhead * 1e9:.0f}ns')
+        assert overhead < 1e-6
+
+    def test_update_id_is_passed_to_handlers(self):
+        message = {'message_id': 1, 'date': 0, 'chat': {'id': -100, 'type': 'supergroup'}, 'text': '!ro'}
+        updates = RudeBot.de_json_updates([
+            {'update_id': 10, 'message': message},
+            {'update_id': 11, 'callback_query': {'id': '1', 'from': {'id': 1, 'is_bot': False, 'first_name': 'user'},
+                                                 'chat_instance': '1', 'data': '0', 'message': message}},
+        ])
+        assert updates[0].message.update_id == 10
+        assert updates[1].callback_query.update_id == 11
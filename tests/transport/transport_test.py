@@ -0,0 +1,50 @@
+import logging
+import threading
+
+from telebot import TeleBot, apihelper
+
+from transport import ApiTransport
+
+BURST = 200
+logger = logging.getLogger('transport_test')
+
+
+def restrict_burst(bot: TeleBot):
+    """Every call from its own short-lived thread, as timers and handlers do"""
+    for chunk in range(0, BURST, 20):
+        threads = [threading.Thread(target=bot.restrict_chat_member, args=(-100, _), kwargs=dict(until_date=0))
+                   for _ in range(chunk, chunk + 20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+
+class TestApiTransport:
+    def test_burst_reuses_connections(self, fake_api):
+        bot = TeleBot('123:token')
+        transport = ApiTransport(logger, pool_size=20)
+        transport.install()
+        try:
+            restrict_burst(bot)
+        finally:
+            transport.uninstall()
+
+        stats = transport.stats()
+        assert stats['requests'] == BURST
+        assert stats['connections'] <= 20
+        assert fake_api.calls.count('restrictChatMember') == BURST
+
+    def test_long_poll_timeouts(self, fake_api):
+        transport = ApiTransport(logger, command_timeout=(1, 2), long_poll_connect_timeout=3)
+        timeouts = []
+        transport._session.request = lambda *args, **kwargs: timeouts.append(kwargs['timeout'])
+        apihelper_check_result = apihelper._check_result
+        apihelper._check_result = lambda method_name, result: {'result': []}
+        try:
+            transport.make_request('123:token', 'getUpdates', params={'timeout': 20})
+            transport.make_request('123:token', 'restrictChatMember', params={'chat_id': -100})
+        finally:
+            apihelper._check_result = apihelper_check_result
+
+        assert timeouts == [(3, 30), (1, 2)]
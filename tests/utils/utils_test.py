@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+from const import RestrictDuration, BanDuration, BaseDuration
+from duration_parsing import legacy_get_duration
+from error import ParseBanDurationError
+from utils import BotUtils
+
+methods = BotUtils.__new__(BotUtils)  # get_duration does not depend on bot state
+
+
+def random_duration(rng: random.Random):
+    """Random compound duration with its expected seconds"""
+    terms = [(rng.randint(0, 500), rng.choice('smhdy')) for _ in range(rng.randint(1, 4))]
+    text = rng.choice(['', ' ']).join(f'{amount}{unit}' for amount, unit in terms)
+    return text, sum(amount * BaseDuration.UNITS[unit]['rate'] for amount, unit in terms)
+
+
+class TestGetDuration:
+    @pytest.mark.parametrize(
+        'text, duration_class, seconds, duration_text',
+        [
+            ('', RestrictDuration(), 300, '5 минут'),
+            ('', BanDuration(), 0, 'навсегда'),
+            ('30', RestrictDuration(), 1800, '30 минут'),
+            ('21h', RestrictDuration(), 75600, '21 час'),
+            ('1h30m', RestrictDuration(), 5400, '1 час 30 минут'),
+            ('2d 4h', BanDuration(), 187200, '2 дня 4 часа'),
+            ('1s', RestrictDuration(), 5, '5 секунд'),
+            ('11d', RestrictDuration(), 864000, '10 дней'),
+            ('11y', BanDuration(), 315360000, '10 лет'),
+            ('+1h30m', RestrictDuration(), 5400, '1 час 30 минут'),
+            ('-1h30m', RestrictDuration(), 5, '5 секунд'),
+            ('-5', BanDuration(), 0, 'навсегда'),
+        ]
+    )
+    def test_parse(self, text, duration_class, seconds, duration_text):
+        duration = methods.get_duration(text, duration_class)
+        assert (duration.seconds, duration.text) == (seconds, duration_text)
+
+    @pytest.mark.parametrize(
+        'text', ['x', '5x', '1d spam', 'm5', '1.5h', '5ms', '1h-30m', '1h +30m', '+', '--5', '+-5']
+    )
+    def test_invalid(self, text):
+        with pytest.raises(ParseBanDurationError):
+            methods.get_duration(text, RestrictDuration())
+
+    def test_random_corpus(self):
+        rng = random.Random(1011)
+        for _ in range(5000):
+            text, seconds = random_duration(rng)
+            clamped = min(max(seconds, BanDuration.MIN_DURATION.seconds), BanDuration.MAX_DURATION.seconds)
+            duration = methods.get_duration(text, BanDuration())
+            assert duration.seconds == clamped, text
+            if sum(c.isalpha() for c in text) == 1:  # Single term durations are parsed as before
+                legacy = legacy_get_duration(text, BanDuration())
+                assert duration.seconds == (legacy[0] if isinstance(legacy, tuple) else legacy.seconds), text
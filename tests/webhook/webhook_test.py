@@ -0,0 +1,107 @@
+import http.client
+import json
+import logging
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from bot import RudeBot
+from const import WebhookSettings
+from webhook import WebhookServer
+
+SECRET = 'secret'
+UPDATE_COUNT = 200
+logger = logging.getLogger('webhook_test')
+
+
+def make_update(update_id: int) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': -100, 'type': 'supergroup'},
+            'from': {'id': update_id, 'is_bot': False, 'first_name': 'user'},
+            'text': 'hello',
+        },
+    }
+
+
+class HandledUpdates:
+    def __init__(self, bot: RudeBot, count: int = 0):
+        self.message_ids = []
+        self.done = threading.Event()
+
+        @bot.message_handler(func=lambda m: True)
+        def handler(message):
+            self.message_ids.append(message.message_id)
+            if len(self.message_ids) == count:
+                self.done.set()
+
+
+def post(port: int, body: dict, secret: str = SECRET) -> int:
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{port}/',
+        data=json.dumps(body).encode(),
+        headers={WebhookSettings.SECRET_TOKEN_HEADER: secret, 'Content-Type': 'application/json'},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+class TestWebhook:
+    def test_wrong_secret_is_rejected(self):
+        bot = RudeBot('123:token', threaded=False)
+        handled = HandledUpdates(bot)
+        server = WebhookServer(bot, SECRET, logger, host='127.0.0.1', port=0)
+        server.start()
+
+        assert post(server.port, make_update(1), secret='wrong') == 403
+        assert handled.message_ids == []
+        server.drain()
+
+    def test_malformed_update_is_acknowledged(self):
+        bot = RudeBot('123:token', threaded=False)
+        handled = HandledUpdates(bot)
+        server = WebhookServer(bot, SECRET, logger, host='127.0.0.1', port=0)
+        server.start()
+
+        assert post(server.port, {'update_id': 1, 'message': {'message_id': 1}}) == 200
+        assert post(server.port, [make_update(2), 'not an update']) == 200
+        assert handled.message_ids == []
+        server.drain()
+
+    def test_bad_content_length_is_rejected(self):
+        bot = RudeBot('123:token', threaded=False)
+        server = WebhookServer(bot, SECRET, logger, host='127.0.0.1', port=0)
+        server.start()
+
+        connection = http.client.HTTPConnection('127.0.0.1', server.port)
+        for length in 'abc', '-1':
+            connection.putrequest('POST', '/')
+            connection.putheader('Content-Length', length)
+            connection.putheader(WebhookSettings.SECRET_TOKEN_HEADER, SECRET)
+            connection.endheaders()
+            response = connection.getresponse()
+            response.read()
+            assert response.status == 400
+        connection.close()
+        server.drain()
+
+    def test_concurrent_updates_are_handled(self):
+        bot = RudeBot('123:token', num_threads=4)
+        handled = HandledUpdates(bot, UPDATE_COUNT)
+        server = WebhookServer(bot, SECRET, logger, host='127.0.0.1', port=0)
+        server.start()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            statuses = list(executor.map(post, [server.port] * UPDATE_COUNT, map(make_update, range(UPDATE_COUNT))))
+        assert handled.done.wait(30)
+        server.drain()
+
+        assert statuses == [200] * UPDATE_COUNT
+        assert sorted(handled.message_ids) == list(range(UPDATE_COUNT))
@@ -0,0 +1,98 @@
+import logging
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from bot import RudeBot
+from const import WorkerSettings
+from workers import UpdatePartitioner, WorkerSupervisor
+
+CHAT_COUNT = 16
+UPDATE_COUNT = 400
+HANDLER_CPU_TIME = 0.002
+logger = logging.getLogger('workers_test')
+
+
+def chat_update(update_id: int, chat_id: int) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'supergroup'},
+            'from': {'id': update_id, 'is_bot': False, 'first_name': 'user'},
+            'text': f'message {update_id}',
+        },
+    }
+
+
+def record_worker(index: int, workers: int, updates, results):
+    """Parses updates as the bot does, burns handler CPU time and reports handled update ids"""
+    for json_updates in iter(updates.get, None):
+        for update in RudeBot.de_json_updates(json_updates):
+            started = time.process_time()
+            while time.process_time() - started < HANDLER_CPU_TIME:
+                repr(update.message.__dict__)
+            results.put((index, update.message.chat.id, update.update_id))
+
+
+def run_supervisor(workers: int) -> tuple:
+    results = multiprocessing.get_context(WorkerSettings.START_METHOD).Queue()
+    supervisor = WorkerSupervisor(RudeBot('123:token'), logger, workers, target=record_worker, args=(results,))
+    supervisor.start()
+    supervisor.dispatch([chat_update(0, -1)])
+    results.get(timeout=30)  # Workers are up
+
+    updates = [chat_update(update_id, -100 - update_id % CHAT_COUNT) for update_id in range(1, UPDATE_COUNT + 1)]
+    started = time.perf_counter()
+    for offset in range(0, UPDATE_COUNT, 100):
+        supervisor.dispatch(updates[offset:offset + 100])
+    handled = [results.get(timeout=30) for _ in range(UPDATE_COUNT)]
+    elapsed = time.perf_counter() - started
+    supervisor.stop()
+    return handled, UPDATE_COUNT / elapsed
+
+
+class TestUpdatePartitioner:
+    @pytest.mark.parametrize(
+        'json_update, expected',
+        [
+            (chat_update(1, -100), -100),
+            ({'update_id': 1, 'chat_member': {'chat': {'id': -100}}}, -100),
+            ({'update_id': 1, 'callback_query': {'from': {'id': 5}, 'message': {'chat': {'id': -100}}}}, -100),
+            ({'update_id': 1, 'callback_query': {'from': {'id': 5}, 'inline_message_id': '1'}}, 5),
+        ]
+    )
+    def test_key(self, json_update, expected):
+        assert UpdatePartitioner.get_key(json_update) == expected
+
+    def test_negative_chat_ids(self):
+        partitioner = UpdatePartitioner(3)
+        assert {partitioner.get_index(-1001424452281 - _) for _ in range(30)} == {0, 1, 2}
+
+
+class TestWorkerSupervisor:
+    def test_pending_updates_are_skipped(self, fake_api):
+        supervisor = WorkerSupervisor(RudeBot('123:token', threaded=False), logger, 1)
+        assert supervisor.skip_pending() is None
+
+        fake_api.push_updates([chat_update(update_id, -100) for update_id in range(1, 4)])
+        assert supervisor.skip_pending() == 4
+
+    def test_chat_order(self):
+        handled, _ = run_supervisor(3)
+        workers = dict()
+        order = dict()
+        for index, chat_id, update_id in handled:
+            assert workers.setdefault(chat_id, index) == index
+            order.setdefault(chat_id, []).append(update_id)
+        assert len(workers) == CHAT_COUNT
+        assert all(update_ids == sorted(update_ids) for update_ids in order.values())
+
+    def test_throughput_by_workers(self):
+        throughput = {workers: run_supervisor(workers)[1] for workers in (1, 2, 4)}
+        print('\n' + ', '.join(f'{workers} workers: {_:.0f} updates/s' for workers, _ in throughput.items()))
+        if len(os.sched_getaffinity(0)) >= 4:
+            assert throughput[4] > throughput[1] * 2